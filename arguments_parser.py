@@ -16,5 +16,33 @@ def get_parser():
     parser.add_argument('--catalog', help='presto catalog to query', type=str, default='tpch')
     parser.add_argument('--schema', help='schema to query', type=str, default='tiny')
     parser.add_argument('--repeats', help='repeat queries', type=int, default=1)
+    parser.add_argument('--adaptive_repeats', help='repeat queries until the median runtime is precise enough (ignores --repeats)', action='store_true')
+    parser.add_argument('--max_repeats', help='maximum number of runs per config of the adaptive repetition', type=int, default=20)
+    parser.add_argument('--ci_width', help='target width of the confidence interval of the median relative to the median', type=float, default=0.05)
+    parser.add_argument('--timeout_factor', help='kill runs of a config after this multiple of the default config\'s median runtime (0 disables it)',
+                        type=float, default=3.0)
+    parser.add_argument('--timeout_slack', help='seconds added to the deadline of a config', type=float, default=10.0)
+    parser.add_argument('--fingerprint_sample_rate', help='hash only 1 out of n result rows (chosen by content) into the result fingerprint',
+                        type=int, default=1)
+    parser.add_argument('--discard_results', help='drain query results without computing their fingerprint', action='store_true')
+    parser.add_argument('--resume', help='continue interrupted explorations, finished queries and measured configs are skipped', action='store_true')
+    parser.add_argument('--pipeline', help='approximate the query spans of upcoming queries on a separate session while timing the current query',
+                        action='store_true')
+    parser.add_argument('--lookahead', help='maximum number of queries whose span is approximated ahead of the timed query', type=int, default=2)
+    parser.add_argument('--work_queue', help='claim the queries from a work queue in the database shared with other drivers (implies --resume)',
+                        action='store_true')
+    parser.add_argument('--lease_seconds', help='lease of a claimed query, it is renewed by heartbeats', type=int, default=300)
+    parser.add_argument('--presto_host', help='coordinator of the presto cluster', type=str, default='localhost')
+    parser.add_argument('--presto_port', help='port of the presto coordinator', type=int, default=8080)
+    parser.add_argument('--callback_host', help='address of this driver that the presto coordinator sends plans and stats to', type=str,
+                        default='localhost')
+    parser.add_argument('--async_storage', help='write configs and measurements in a background thread', action='store_true')
+    parser.add_argument('--planning_sessions', help='number of presto sessions that plan the configs of a DP stage concurrently', type=int, default=4)
+    parser.add_argument('--trace', help='write the phases of the driver as chrome trace json to this file and log a summary', type=str)
+    parser.add_argument('--profile_phase', help='profile a traced phase using cProfile (e.g. fingerprint, storage, plan), requires --trace',
+                        type=str)
+    parser.add_argument('--compact_plans', help='move the inline plans stored by previous versions into the plan store and exit', action='store_true')
+    parser.add_argument('--check_indexes', help='check that the hot lookups of the storage use indexes and exit (no presto cluster is required)',
+                        action='store_true')
     parser.add_argument('--drop_caches', help='drop fs caches before each run (requires root)', action='store_true')
     return parser
@@ -1,16 +1,19 @@
 """This module coordinates the query span approximation and the generation of new optimizer configurations for a query"""
-import asyncio
-import operator
 import prestodb
 import storage
 import settings
-import hashlib
+import statistics
+import tracing
+import work_queue
 from optimizer_config import OptimizerConfig
-from functools import reduce
-from presto_connector import presto_session
+from result_drain import drain
+from result_fingerprint import ResultFingerprint
+from repetition import FAILED, TIMEOUT, AdaptiveRepetition, FixedRepetition
+from presto_connector import duration_seconds
+from stage_planner import StagePlanner
 from custom_logging import bao_logging
 from session_properties import BAO_DISABLED_OPTIMIZERS, BAO_ENABLE, BAO_EXECUTE_QUERY, BAO_EXPORT_GRAPHVIZ, BAO_EXPORT_JSON, \
-    BAO_EXPORT_TIMES, BAO_GET_QUERY_SPAN, BAO_QUERY_SPAN_ITERATIVE
+    BAO_EXPORT_TIMES, BAO_GET_QUERY_SPAN, BAO_QUERY_SPAN_ITERATIVE, QUERY_MAX_EXECUTION_TIME
 import time
 
 FLIGHTS_QUERIES_PATH = 'queries/flights/'
@@ -20,25 +23,12 @@ TPCH_QUERIES_PATH = 'queries/tpch/'
 TPCDS_QUERIES_PATH = 'queries/tpcds/'
 STACK_QUERIES_PATH = 'queries/stackoverflow/'
 
-
-async def _receive_query_plans_async():
-    callback_server = presto_session.callback_server
-    if settings.EXPORT_GRAPHVIZ:
-        bao_logging.info('receive logical and fragmented dot (graphviz) plans')
-        for _ in range(2):
-            callback_server.handle_request()
-        bao_logging.info('received 2 dot plans')
-    if settings.EXPORT_JSON:
-        bao_logging.info('receive logical and fragmented json plans')
-        for _ in range(2):
-            callback_server.handle_request()
-        bao_logging.info('received 2 json plans')
-
-    status = presto_session.status
-    settings.LOGICAL_DOT = status.logical_dot
-    settings.FRAGMENTED_DOT = status.fragmented_dot
-    settings.LOGICAL_JSON = status.logical_json
-    settings.FRAGMENTED_JSON = status.fragmented_json
+# either the storage module (synchronous writes) or a measurement_sink.MeasurementSink, both provide the same register functions
+SINK = storage
+# plans the configs of a DP stage concurrently before they are executed
+PLANNER = StagePlanner()
+# runs of a config that may fail without skipping the config (no presto worker available, missing execution stats)
+MAX_RETRIES = 3
 
 
 def load_query(filepath):
@@ -48,8 +38,8 @@ def load_query(filepath):
         return ''.join(lines).replace('\\s', ' ').replace(';', '')
 
 
-async def execute(cur, query_string):
-    cur = cur.cursor()
+def execute(conn, query_string):
+    cur = conn.cursor()
     cur.execute(query_string)
     try:
         result = cur.fetchall()
@@ -59,227 +49,285 @@ async def execute(cur, query_string):
         return e
 
 
-async def _run_query_async(conn, query_string):
-    return await execute(conn, query_string)
-
-
-async def execute_async(conn, query_string):
-    query_task = _run_query_async(conn, query_string)
-    query_plans_task = _receive_query_plans_async()
-    responses = await asyncio.gather(query_task, query_plans_task)
-    return responses
-
-
-def exec_query(conn, query_string, set_config_variable=False):
-    if set_config_variable or not settings.EXPORT_GRAPHVIZ:
-        cur = conn.cursor()
+def exec_query(conn, query_string):
+    """Execute the query, the plans and execution stats presto sends to the callback server are fetched by the query id of the cursor.
+    The result rows are not kept, a background thread fetches them while they are hashed into the result fingerprint (see result_drain.py)."""
+    cur = conn.cursor()
+    with tracing.span('execute'):
         cur.execute(query_string)
-        result = cur.fetchall()
-        return result, cur
-    else:
-        # asynchronously process callbacks from presto containing the dot representations
-        loop = asyncio.get_event_loop()
-        result = loop.run_until_complete(execute_async(conn, query_string))[0]
-        if isinstance(result, prestodb.exceptions.PrestoQueryError):
-            raise result
-        return result  # result = (result, cursor containing query stats)
+    fingerprint = ResultFingerprint(settings.FINGERPRINT_SAMPLE_RATE) if settings.FINGERPRINT_RESULTS else None
+    with tracing.span('drain'):
+        drain_stats = drain(cur, None if fingerprint is None else tracing.traced('fingerprint', fingerprint.add_all))
+    bao_logging.info('Fetched the result of query %s: %s', cur.stats['queryId'], drain_stats)
+    return fingerprint, cur, drain_stats  # result = (result fingerprint, cursor containing query stats, fetch throughput)
 
 
-def reset_presto_config(conn):
+def reset_presto_config(session):
     """Reset the presto session """
     configs = [BAO_EXPORT_GRAPHVIZ, BAO_EXPORT_JSON, BAO_EXPORT_TIMES, BAO_ENABLE, BAO_GET_QUERY_SPAN]
     for config in configs:
-        set_presto_config(conn, config, False)
-    set_presto_config(conn, BAO_EXECUTE_QUERY, True)
-    enable_all_optimizers_and_rules(conn)
+        set_presto_config(session, config, False)
+    set_presto_config(session, BAO_EXECUTE_QUERY, True)
+    enable_all_optimizers_and_rules(session)
 
 
-def set_presto_config(conn, setting, enable=True):
-    try:
-        settings.PRESTO_SETTINGS[setting] = enable
-        exec_query(conn, f'SET session {setting} = {"true" if enable else "false"}', set_config_variable=True)
-    except prestodb.exceptions.PrestoUserError:
-        pass
+def set_presto_config(session, setting, enable=True):
+    """The property is sent with the next query of the session, see presto_connector.SessionProperties"""
+    settings.PRESTO_SETTINGS[setting] = enable
+    session.properties.set(setting, enable)
 
 
-def enable_all_optimizers_and_rules(conn):
-    exec_query(conn, f'SET session {BAO_DISABLED_OPTIMIZERS} = \'\'', set_config_variable=True)
+def enable_all_optimizers_and_rules(session):
+    session.properties.reset(BAO_DISABLED_OPTIMIZERS)
 
 
-def set_optimizer_config(conn, setting):
-    try:
-        exec_query(conn, setting, set_config_variable=True)
-    except prestodb.exceptions.PrestoUserError:
-        pass
+def set_optimizer_config(session, properties):
+    """Disable the optimizers and rules of the config (session properties, see OptimizerConfig.next), all others are enabled"""
+    enable_all_optimizers_and_rules(session)
+    session.properties.update(properties)
 
 
-def run(conn, query_path):
+def run(session, query_path):
     query_string = load_query(query_path)
     try:
-        return exec_query(conn, query_string)
-    except prestodb.exceptions.PrestoUserError as e:
-        bao_logging.error('Error with query: %s: %s', query_path, str(e))
-        return e
-    except prestodb.exceptions.PrestoQueryError as e:
+        return exec_query(session.get_connection(), query_string)
+    except (prestodb.exceptions.PrestoUserError, prestodb.exceptions.PrestoQueryError) as e:
         bao_logging.error('Error with query: %s: %s', query_path, str(e))
+        # presto does not send execution stats for failed queries, drop the plans it sent before the query failed
+        session.callback_server.discard_pending()
         return e
 
 
-def register_query_config_and_measurement(query_path, disabled_rules, cursor=None, initial_call=False, result=None):
-    presto_session.callback_server.handle_request()  # wait for execution stats
-    plan_hash = presto_session.status.execution_stats['plan_hash']
-    logical_dot = settings.LOGICAL_DOT if settings.EXPORT_GRAPHVIZ else None
-    fragmented_dot = settings.FRAGMENTED_DOT if settings.EXPORT_GRAPHVIZ else None
-    logical_json = settings.LOGICAL_JSON if settings.EXPORT_JSON else None
-    fragmented_json = settings.FRAGMENTED_JSON if settings.EXPORT_JSON else None
-    is_duplicate = storage.register_query_config(query_path, disabled_rules, logical_dot, fragmented_dot, logical_json, fragmented_json, plan_hash)
+def register_query_config_and_measurement(session, query_path, disabled_rules, cursor=None, result=None, drain_stats=None, registered=False):
+    """Register the config of the run
+    :param registered: the config has been registered (and found distinct) by the planning phase, its plan hash is not checked again
+    :returns: whether the plan is a duplicate and the time measurement of the run (None for duplicates), see time_measurement
+    """
+    try:
+        with tracing.span('callback_wait'):
+            callbacks = session.callback_server.query_callbacks(cursor.stats['queryId'])
+    except TimeoutError:
+        bao_logging.fatal('Presto did not send the execution stats of query %s (%s) - skip this run', cursor.stats['queryId'], query_path)
+        return False, None
+    execution_stats = callbacks.execution_stats
+    logical_dot = callbacks.logical_dot if settings.EXPORT_GRAPHVIZ else None
+    fragmented_dot = callbacks.fragmented_dot if settings.EXPORT_GRAPHVIZ else None
+    logical_json = callbacks.logical_json if settings.EXPORT_JSON else None
+    fragmented_json = callbacks.fragmented_json if settings.EXPORT_JSON else None
+    if registered:
+        # checking again would flag the config as a duplicate of the configs that collapsed onto its plan during planning
+        return False, time_measurement(query_path, cursor, result, execution_stats, drain_stats)
+    with tracing.span('storage'):
+        is_duplicate = SINK.register_query_config(query_path, disabled_rules, logical_dot, fragmented_dot, logical_json, fragmented_json,
+                                                  execution_stats['plan_hash'])
     if is_duplicate:
         bao_logging.info('Plan hash already known')
-    if not (is_duplicate or initial_call):
-        register_time_measurement(query_path, disabled_rules, cursor, result)
+        return is_duplicate, None
+    return is_duplicate, time_measurement(query_path, cursor, result, execution_stats, drain_stats)
 
-    settings.LOGICAL_DOT = None
-    settings.FRAGMENTED_DOT = None
-    return is_duplicate
 
-
-def register_time_measurement(query_path, disabled_rules, cursor, result):
+def time_measurement(query_path, cursor, result, execution_stats, drain_stats=None):
+    """Check the result fingerprint of the run
+    :param result: ResultFingerprint of the run (None if results are discarded), see exec_query
+    :param drain_stats: client-side fetch throughput of the run
+    :returns: keyword arguments of SINK.register_measurement
+    """
     assert cursor is not None
-    assert result is not None
-
-    def hash_sql_result():
-        """Generate a hash fingerprint for the result retrieved from presto to assert that results are (probably) identical.
-        Its important to round floats here, e.g. using 2 decimal places."""
-        flattened_result = reduce(operator.concat, result)
-        normalized_result = tuple(map(lambda item: round(item, 2) if isinstance(item, float) else item, flattened_result))
-        md5 = hashlib.md5()
-        for item in normalized_result:
-            md5.update(str(item).encode())
-        return md5.digest()
+    assert execution_stats is not None
 
     # check if results match
-    result_fingerprint = hash_sql_result()
-    if not storage.register_query_fingerprint(query_path, result_fingerprint):
-        bao_logging.warning('Result fingerprint=%s does not match existing fingerprints!', result_fingerprint)
-
-    status = presto_session.status
-    if not status.execution_stats['query_id'] == cursor.stats['queryId']:
-        bao_logging.fatal('WRONG EXECUTION STATS RECEIVED: %s vs %s', status.execution_stats['query_id'], cursor.stats['queryId'])
-        status.execution_stats = None
-        return
-    # wait for presto server to call back
-    execution_stats = status.execution_stats
-    assert execution_stats is not None
-    storage.register_measurement(
-        query_path,
-        disabled_rules,
-        elapsed=execution_stats['elapsed'],
-        planning=execution_stats['planning'],
-        scheduling=execution_stats['scheduling'],
-        running=execution_stats['running'],
-        finishing=execution_stats['finishing'],
-        cpu=execution_stats['cpu'],
-        input_data_size=execution_stats['input_data_size'],
-        nodes=cursor.stats['nodes'])
-    presto_session.status.execution_stats = None
-
-
-def run_query_with_optimizer_configs(connection, query_path):
+    if result is not None:
+        result_fingerprint = result.digest()
+        with tracing.span('storage'):
+            is_match = SINK.register_query_fingerprint(query_path, result_fingerprint)
+        if not is_match:
+            bao_logging.warning('Result fingerprint=%s does not match existing fingerprints!', result_fingerprint)
+
+    # the callback server routes the execution stats by query id
+    assert execution_stats['query_id'] == cursor.stats['queryId']
+    return dict(elapsed=execution_stats['elapsed'],
+                planning=execution_stats['planning'],
+                scheduling=execution_stats['scheduling'],
+                running=execution_stats['running'],
+                finishing=execution_stats['finishing'],
+                cpu=execution_stats['cpu'],
+                input_data_size=execution_stats['input_data_size'],
+                nodes=cursor.stats['nodes'],
+                fetch_rows=None if drain_stats is None else drain_stats.num_rows,
+                fetch_seconds=None if drain_stats is None else drain_stats.fetch_seconds)
+
+
+def register_time_measurements(query_path, disabled_rules, measurements, warmup_runs, stop_reason):
+    """Store the runs of the config once the repetition stopped, the first warmup_runs are flagged as warm-up runs"""
+    work_queue.check_lease()
+    with tracing.span('storage'):
+        for run_index, measurement in enumerate(measurements):
+            SINK.register_measurement(query_path, disabled_rules, warmup=run_index < warmup_runs, stop_reason=stop_reason, **measurement)
+
+
+def run_query_with_optimizer_configs(session, query_path):
     """Use dynamic programming to find good optimizer configs"""
     bao_logging.info('Start DP for query %s', query_path)
+    set_presto_config(session, BAO_EXPORT_TIMES, True)
 
-    set_presto_config(connection, BAO_EXPORT_TIMES, True)
-
-    config = OptimizerConfig(query_path)
+    config = OptimizerConfig(query_path, resume=settings.RESUME)
+    if config.finished:
+        bao_logging.info('The exploration of %s has already finished', query_path)
+        return
+    query_string = load_query(query_path)
     num_duplicates = 0
     while config.has_next():
-        enable_all_optimizers_and_rules(connection)
-        optimizer_configs = config.next()
-
-        for setting in optimizer_configs:
-            set_optimizer_config(connection, setting)
-
-        # skip configs which have been executed previously
-        if storage.check_for_existing_measurements(query_path, config.get_disabled_opts_rules()):
-            pass  # continue
-
-        # check first if this config generates a new query plan (prevent actual execution of plan)
-        set_presto_config(connection, 'execute_query', False)
-        run(connection, query_path)
-        set_presto_config(connection, 'execute_query', True)
-
-        if register_query_config_and_measurement(query_path, config.get_disabled_opts_rules(), initial_call=True):
-            num_duplicates += 1
-            continue
+        work_queue.check_lease()
+        # runs of worse configs stop early, the default config has been measured in a previous stage (if at all)
+        with tracing.span('storage', query=query_path):
+            baseline = storage.get_runtimes(query_path, None)
+        stage = config.next_stage()
+        if settings.RESUME:
+            # a resumed stage skips the configs that have been measured before the driver stopped
+            completed = storage.completed_configs(query_path, settings.REPEATS)
+            stage = [(disabled_rules, properties) for disabled_rules, properties in stage if str(disabled_rules) not in completed]
+        # planning phase: plan all configs of the DP stage concurrently (without executing them), configs sharing a plan are collapsed
+        with tracing.span('plan_stage', query=query_path, configs=len(stage)):
+            planned_configs = PLANNER.plan_stage(query_string, stage)
+        distinct_configs = []
+        for planned in planned_configs:
+            if planned.error is not None:
+                bao_logging.fatal('Optimizer %s cannot be disabled for %s - skip this config (%s)', planned.disabled_rules, query_path, planned.error)
+                continue
+            with tracing.span('storage', query=query_path, config=planned.disabled_rules):
+                is_duplicate = SINK.register_query_config(query_path, planned.disabled_rules, planned.logical_dot, planned.fragmented_dot,
+                                                          planned.logical_json, planned.fragmented_json, planned.plan_hash)
+            if is_duplicate:
+                bao_logging.info('Plan hash already known')
+                num_duplicates += 1
+                continue
+            distinct_configs.append(planned)
 
-        run_config(config, connection, query_path)
+        # timing phase: execute the distinct plans one after another
+        for planned in distinct_configs:
+            with tracing.span('session', query=query_path, config=planned.disabled_rules):
+                set_optimizer_config(session, planned.properties)
+            run_config(planned.disabled_rules, session, query_path, baseline, registered=True)
+        with tracing.span('storage', query=query_path):
+            SINK.flush()  # the next DP stage is derived from the measurements of the previous stages
 
-    enable_all_optimizers_and_rules(connection)
-    run_config(config, connection, query_path)  # re-run default config with all optimizers being enabled again
+    enable_all_optimizers_and_rules(session)
+    run_config(None, session, query_path, storage.get_runtimes(query_path, None))  # re-run default config with all optimizers being enabled again
 
+    config.finish()
     bao_logging.info('Found %s duplicated query plans!', num_duplicates)
 
 
-def run_config(config, conn, query_path):
-    for repeat in range(settings.REPEATS):
-        result = run(conn, query_path)
+def new_repetition(baseline=None):
+    if settings.ADAPTIVE_REPEATS:
+        return AdaptiveRepetition(baseline, max_runs=settings.MAX_REPEATS, target_width=settings.TARGET_CI_WIDTH)
+    return FixedRepetition(settings.REPEATS)
+
+
+def execution_deadline(session, baseline):
+    """:returns: maximum execution time (seconds) of a config, TIMEOUT_FACTOR times the median runtime of the default config plus slack"""
+    default_timeout = duration_seconds(session.execution_timeout)
+    if not baseline or settings.TIMEOUT_FACTOR <= 0:
+        return default_timeout
+    # runtimes are measured in milliseconds
+    deadline = settings.TIMEOUT_FACTOR * statistics.median(baseline) / 1000 + settings.TIMEOUT_SLACK_SECONDS
+    return min(deadline, default_timeout)
+
+
+def censored_measurement(deadline):
+    """Measurement of a run that has been killed by the deadline, the deadline is a lower bound of its runtime"""
+    deadline = int(deadline * 1000)
+    # input_data_size is not nullable (bigserial column in schema.sql)
+    return dict(elapsed=deadline, planning=None, scheduling=None, running=deadline, finishing=0, cpu=None, input_data_size=0, nodes=None,
+                censored=True)
+
+
+def run_config(disabled_rules, session, query_path, baseline=None, registered=False):
+    """Run the config until the repetition policy stops, the measurements are stored together with the stop reason
+    :param baseline: runtimes of the default config, the adaptive repetition stops early if the config is significantly slower
+                     and runs are killed once they exceed the deadline derived from it (see execution_deadline)
+    :param registered: the config has been registered by the planning phase, see register_query_config_and_measurement
+    """
+    deadline = execution_deadline(session, baseline)
+    with tracing.span('config', query=query_path, config=disabled_rules), session.query():
+        session.properties.set(QUERY_MAX_EXECUTION_TIME, f'{int(deadline * 1000)}ms')
+        try:
+            _run_config(disabled_rules, session, query_path, baseline, deadline, registered)
+        finally:
+            # later queries of the session must not inherit the deadline, also if a run raises (e.g. a lost lease)
+            session.properties.set(QUERY_MAX_EXECUTION_TIME, session.execution_timeout)
+
+
+def _run_config(disabled_rules, session, query_path, baseline, deadline, registered=False):
+    repetition = new_repetition(baseline)
+    measurements = []
+    stop_reason = None
+    retries = 0
+    while stop_reason is None:
+        result = run(session, query_path)
+        if isinstance(result, prestodb.exceptions.PrestoQueryError) and result.error_name == 'EXCEEDED_TIME_LIMIT':
+            # a hopeless config, further runs would be killed as well
+            bao_logging.info('Config [%s] of %s exceeded its deadline of %.1fs', disabled_rules, query_path, deadline)
+            measurements.append(censored_measurement(deadline))
+            stop_reason = TIMEOUT
+            break
         if isinstance(result, prestodb.exceptions.PrestoQueryError):
             # configuration does not work -> disabled optimizers/rules are required
             if result.error_name == 'NO_NODES_AVAILABLE':
                 bao_logging.fatal('Presto returned an error while running query %s: NO_NODES_AVAILABLE', query_path)
-                repeat -= 1
-                continue
-            else:
-                bao_logging.fatal('Optimizer %s cannot be disabled for %s - skip this config', config.get_disabled_opts_rules(), query_path)
-                break
+                retries += 1
+                if retries <= MAX_RETRIES:
+                    continue
+            bao_logging.fatal('Optimizer %s cannot be disabled for %s - skip this config', disabled_rules, query_path)
+            stop_reason = FAILED
+            break
 
-        if register_query_config_and_measurement(query_path, config.get_disabled_opts_rules(), result=result[0], cursor=result[1]):
+        is_duplicate, measurement = register_query_config_and_measurement(session, query_path, disabled_rules, result=result[0], cursor=result[1],
+                                                                          drain_stats=result[2], registered=registered)
+        if is_duplicate:
             # config results in already known query plan!
             break
+        if measurement is None:
+            retries += 1
+            stop_reason = FAILED if retries > MAX_RETRIES else None
+            continue
+        measurements.append(measurement)
+        repetition.add(measurement['running'] + measurement['finishing'])
+        stop_reason = repetition.stop_reason()
 
+    if len(measurements) > 0:
+        bao_logging.info('Stop running %s [%s] after %s runs (%s warm-up): %s', query_path, disabled_rules, len(measurements), repetition.warmup_runs(),
+                         stop_reason)
+        register_time_measurements(query_path, disabled_rules, measurements, repetition.warmup_runs(), stop_reason)
 
-def run_get_query_span(connection, query_path, iterative: bool = True):
-    """Given the presto connection and the path to a sql file, get the query span and store it in the database"""
-
-    set_presto_config(connection, BAO_GET_QUERY_SPAN, True)
-    set_presto_config(connection, BAO_QUERY_SPAN_ITERATIVE, iterative)
-
-    async def _receive_span_async():
-        # query span comprises 4 components (required/effective rules/optimizers);
-        for _ in range(2):
-            bao_logging.debug('wait for query span callback ...')
-            presto_session.callback_server.handle_request()
-            bao_logging.debug('callback received!')
 
-    def _get_span_async():
-        return asyncio.gather(_run_query_async(connection, query_string), _receive_span_async())
+def run_get_query_span(session, query_path, iterative: bool = True):
+    """Given the presto session and the path to a sql file, get the query span and store it in the database"""
+    set_presto_config(session, BAO_GET_QUERY_SPAN, True)
+    set_presto_config(session, BAO_QUERY_SPAN_ITERATIVE, iterative)
 
     bao_logging.info('Approximate query span for query: %s', query_path)
     storage.register_query(query_path)
     query_string = load_query(query_path)
 
-    # asynchronously fetch query spans from presto server
-    loop = asyncio.get_event_loop()
-
     # measure the time it takes to calculate the query span
     start = time.time()
-    loop.run_until_complete(_get_span_async())
+    with tracing.span('query_span', query=query_path), session.query():
+        execute(session.get_connection(), query_string)
+        # query span comprises 4 components (required/effective rules/optimizers)
+        bao_logging.debug('wait for query span callback ...')
+        effective_optimizers, required_optimizers = session.callback_server.query_span()
+    bao_logging.debug('callback received!')
     end = time.time()
 
-    effective = list(filter(lambda optimizer: len(optimizer['dependencies']) == 0, presto_session.status.effective_optimizers))
-    alternatives = list(filter(lambda optimizer: len(optimizer['dependencies']) > 0, presto_session.status.effective_optimizers))
-    required = presto_session.status.required_optimizers
+    effective = list(filter(lambda optimizer: len(optimizer['dependencies']) == 0, effective_optimizers))
+    alternatives = list(filter(lambda optimizer: len(optimizer['dependencies']) > 0, effective_optimizers))
+    required = required_optimizers
 
     with open(f'''./evaluation/query_span_system_{'iterative' if iterative else 'batch'}.csv''', 'a', encoding='utf-8') as results_file:
         results_file.write(f'job/{query_path},{end - start},{len(effective)},{len(required)},{len(alternatives)}\n')
 
-    assert presto_session.status.effective_optimizers is not None
-    for optimizer in presto_session.status.effective_optimizers:  # pylint: disable=not-an-iterable
-        storage.register_optimizer(query_path, optimizer['name'], 'query_effective_optimizers')
-        # consider recursive optimizer dependencies here
-        for dependency in optimizer['dependencies']:
-            storage.register_optimizer_dependency(query_path, optimizer['name'], dependency, 'query_effective_optimizers_dependencies')
-
-    assert presto_session.status.required_optimizers is not None
-    for optimizer in presto_session.status.required_optimizers:  # pylint: disable=not-an-iterable
-        storage.register_optimizer(query_path, optimizer['name'], 'query_required_optimizers')
+    assert effective_optimizers is not None
+    assert required_optimizers is not None
+    work_queue.check_lease()
+    storage.register_query_span(query_path, effective_optimizers, required_optimizers)
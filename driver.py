@@ -5,41 +5,111 @@ import sys
 
 from arguments_parser import get_parser
 import benchmark
-from presto_connector import presto_session
+import storage
+import tracing
+import work_queue
+from pipeline import run_pipelined
+from presto_connector import PrestoSession
 from benchmark import TPCH_QUERIES_PATH, JOB_QUERIES_PATH, \
     STACK_QUERIES_PATH, set_presto_config, reset_presto_config, run_get_query_span, run_query_with_optimizer_configs
 import settings
 from custom_logging import bao_logging
+from measurement_sink import MeasurementSink
+from stage_planner import StagePlanner
 from session_properties import BAO_EXPORT_GRAPHVIZ, BAO_EXPORT_JSON
 
+presto_session = None
+span_session = None
+trace_file = None
+
 
 def signal_handler(sig, frame):
     """Reset the current presto session in case of unexpected errors"""
-    reset_presto_config(presto_session.connection)
-    presto_session.callback_server.server_close()
+    if presto_session is not None:
+        reset_presto_config(presto_session)
+        presto_session.close()
+    if span_session is not None:
+        span_session.close()
+    close_sink()
     print(f'Stop driver as it received signal={sig} (frame={frame})! You pressed Ctrl+C! Reset presto configs!')
     sys.exit(0)
 
 
+def close_sink():
+    """Write all buffered configs and measurements and close the planning sessions before the driver stops
+    :returns: number of rows that could not be written, they are kept in the spill file of the sink
+    """
+    benchmark.PLANNER.close()
+    unwritten = 0
+    if isinstance(benchmark.SINK, MeasurementSink):
+        unwritten = benchmark.SINK.close()
+    if trace_file is not None:
+        bao_logging.info('Time spent per phase of the driver:\n%s', tracing.TRACER.summary())
+        tracing.TRACER.export(trace_file)
+    return unwritten
+
+
+def benchmark_queries(name):
+    """:returns: paths of the queries of the benchmark"""
+    if name == 'job':
+        queries = sorted(list(filter(lambda q: q.endswith('.sql') and q != 'schema_job.sql', os.listdir(JOB_QUERIES_PATH))))
+        return [f'{JOB_QUERIES_PATH}{query}' for query in queries]
+    if name == 'stack':
+        with open(STACK_QUERIES_PATH + 'stack_queries.txt', 'r', encoding='utf-8') as f:
+            return [STACK_QUERIES_PATH + line.replace('\n', '') for line in f.readlines()]
+    if name == 'tpch':
+        return [f'{TPCH_QUERIES_PATH}{query}.sql' for query in range(1, 2) if query not in [2]]
+    if name == 'example':
+        return ['./presentation/query.sql']
+    return []
+
+
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, signal_handler)
 
-    presto_session.restart_callback_server()
-
     args = get_parser().parse_args()
+    if args.compact_plans or args.check_indexes:
+        # maintenance of the storage, no presto cluster is required
+        if args.compact_plans:
+            storage.compact_plans()
+        if args.check_indexes:
+            # raises storage.MissingIndexError
+            storage.check_index_usage()
+        sys.exit(0)
+    if args.trace is not None:
+        trace_file = args.trace
+        tracing.TRACER.enable(args.profile_phase)
     settings.REPEATS = args.repeats
+    # a query claimed again after a lost lease continues the exploration of the previous driver
+    settings.RESUME = args.resume or args.work_queue
+    settings.FINGERPRINT_SAMPLE_RATE = args.fingerprint_sample_rate
+    settings.FINGERPRINT_RESULTS = not args.discard_results
+    settings.ADAPTIVE_REPEATS = args.adaptive_repeats
+    settings.MAX_REPEATS = args.max_repeats
+    settings.TARGET_CI_WIDTH = args.ci_width
+    settings.TIMEOUT_FACTOR = args.timeout_factor
+    settings.TIMEOUT_SLACK_SECONDS = args.timeout_slack
     settings.EXPORT_GRAPHVIZ = args.dot
     settings.EXPORT_JSON = args.json
 
-    reset_presto_config(presto_session.get_connection())
-    set_presto_config(presto_session.get_connection(), BAO_EXPORT_GRAPHVIZ, args.dot)
-    set_presto_config(presto_session.get_connection(), BAO_EXPORT_JSON, args.json)
+    bao_logging.info('connect to presto=%s:%s, catalog:schema=%s:%s', args.presto_host, args.presto_port, args.catalog, args.schema)
+    presto_session = PrestoSession(args.catalog, args.schema, host=args.presto_host, port=args.presto_port, callback_host=args.callback_host)
+    reset_presto_config(presto_session)
+    set_presto_config(presto_session, BAO_EXPORT_GRAPHVIZ, args.dot)
+    set_presto_config(presto_session, BAO_EXPORT_JSON, args.json)
 
-    assert args.query_span or args.record_time
+    assert args.query_span or args.record_time or args.pipeline
+    assert not (args.pipeline and args.work_queue), 'the work queue hands out one query at a time, it cannot be pipelined'
     benchmark.ENABLE_DROP_CACHES = args.drop_caches
+    if args.async_storage:
+        benchmark.SINK = MeasurementSink()
+    benchmark.PLANNER = StagePlanner(args.planning_sessions, presto_session)
 
     RUN_QUERY = None
-    if args.query_span:
+    if args.pipeline:
+        RUN_QUERY = run_query_with_optimizer_configs
+        bao_logging.info('approximate query spans and collect measurements (look-ahead: %s queries)', args.lookahead)
+    elif args.query_span:
         RUN_QUERY = run_get_query_span
         bao_logging.info('approximate query spans')
     elif args.record_time:
@@ -47,34 +117,23 @@ if __name__ == '__main__':
         bao_logging.info('collect measurements')
 
     assert RUN_QUERY is not None
-    bao_logging.info('connect to catalog:schema=%s:%s', args.catalog, args.schema)
+    QUERIES = benchmark_queries(args.benchmark)
+    if args.pipeline:
+        # the spans are approximated on a separate session, its callback server only receives the spans
+        span_session = PrestoSession(args.catalog, args.schema, host=args.presto_host, port=args.presto_port, callback_host=args.callback_host)
+        reset_presto_config(span_session)
+        run_pipelined(lambda path: run_get_query_span(span_session, path), lambda path: RUN_QUERY(presto_session, path), QUERIES, args.lookahead)
+        span_session.close()
+    elif args.work_queue:
+        work_queue.run_worker(lambda path: RUN_QUERY(presto_session, path), QUERIES, 'query_span' if args.query_span else 'record_time',
+                              lease_seconds=args.lease_seconds, heartbeat_seconds=args.lease_seconds / 5)
+    else:
+        for PATH in QUERIES:
+            bao_logging.info('run %s...', PATH)
+            RUN_QUERY(presto_session, PATH)
 
-    presto_session.set_catalog(args.catalog)
-    presto_session.set_schema(args.schema)
-
-    if args.benchmark == 'job':
-        queries = sorted(list(filter(lambda q: q.endswith('.sql') and q != 'schema_job.sql', os.listdir(JOB_QUERIES_PATH))))
-        for query in queries:
-            bao_logging.info('run JOB Q%s...', query)
-            RUN_QUERY(presto_session.get_connection(), f'{JOB_QUERIES_PATH}{query}')
-    elif args.benchmark == 'stack':
-        with open(STACK_QUERIES_PATH + 'stack_queries.txt', 'r', encoding='utf-8') as f:
-            queries = list(map(lambda line: line.replace('\n', ''), f.readlines()))
-
-        for query in list(queries):
-            query = STACK_QUERIES_PATH + query
-            bao_logging.info('run STACK Q%s...', query)
-            RUN_QUERY(presto_session.get_connection(), query)
-    elif args.benchmark == 'tpch':
-        for query in range(1, 2):
-            if query in [2]:
-                continue
-            bao_logging.info('run TPC-H Q%s...', query)
-            PATH = f'{TPCH_QUERIES_PATH}{query}.sql'
-            RUN_QUERY(presto_session.get_connection(), PATH)
-    elif args.benchmark == 'example':
-        PATH = './presentation/query.sql'
-        RUN_QUERY(presto_session.get_connection(), PATH)
-
-    reset_presto_config(presto_session.get_connection())
-    presto_session.callback_server.server_close()
+    reset_presto_config(presto_session)
+    presto_session.close()
+    if close_sink() > 0:
+        # the experience is incomplete, the spilled rows are written by the next driver started in this directory
+        sys.exit(1)
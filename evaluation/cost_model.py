@@ -7,10 +7,10 @@ import numpy as np
 import os
 
 
-def predict_data(benchmark: list[str], data_dir, model_name, retrain=False):
+def predict_data(benchmark: list[str], data_dir, model_name, retrain=False, snapshot_dir=None):
 
     if retrain:
-        x_train, y_train, x_test, y_test, training_data, test_data = load_data(benchmark, training_ratio=0.8)
+        x_train, y_train, x_test, y_test, training_data, test_data = load_data(benchmark, training_ratio=0.8, snapshot_dir=snapshot_dir)
         serialize_data('data', x_train, y_train, x_test, y_test, training_data, test_data)
         train_and_save_model(model_name, x_train, y_train, x_test, y_test)
     else:
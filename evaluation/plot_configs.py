@@ -9,7 +9,7 @@ import storage
 if __name__ == '__main__':
 
     # ===== set matplotlib latex style =====
-    queries = storage.get_df("""select * from queries where query_path like '%%job%%'""")
+    queries = storage.get_df("""select * from queries where benchmark = 'job'""")
     for query in queries['query_path']:
         texify.latexify(3.39, 2.2, custom_params={'xtick.labelsize': 5})
         style.set_custom_style()
@@ -28,7 +28,7 @@ if __name__ == '__main__':
 
                 benchmark = ''
                 stmt = f'''
-                    select q.query_path, (running + finishing) as elapsed, qoc.disabled_rules, m.time
+                    select q.query_path, (running + finishing) as elapsed, qoc.disabled_rules, m.time, m.warmup
                     from queries q,
                          measurements m,
                          query_optimizer_configs qoc
@@ -43,9 +43,10 @@ if __name__ == '__main__':
                     'select distinct disabled_rules from df', locals())
                 runtimes = {}
                 for dr in disabled_rules['disabled_rules']:
-                    runs = pdsql.sqldf(f'''select elapsed from df where disabled_rules = '{dr}' order by time asc''')
-                    # drop the first measurement of each query
-                    data = runs['elapsed'].to_list()[1:]  # list(filter(lambda x: x < 400000, runs['elapsed'].to_list()[1:]))  #  #
+                    runs = pdsql.sqldf(f'''select elapsed, warmup from df where disabled_rules = '{dr}' order by time asc''')
+                    warmup = runs['warmup'].astype(bool)
+                    # drop the warm-up runs detected by the adaptive repetition, otherwise the first measurement of each query
+                    data = runs['elapsed'][~warmup].to_list() if warmup.any() else runs['elapsed'].to_list()[1:]
                     if len(data) > 0:
                         if dr == 'None':
                             data = data[:15]
@@ -20,4 +20,4 @@ select q.query_path,
            where qeod.query_id = q.id
        ) as alternative_rules
 from queries q
-where q.query_path like '%%job%%';
+where q.benchmark = 'job';
@@ -1,7 +1,9 @@
 """This module trains and evaluates the Bao integration for Presto"""
 import json
 import os
+import snapshot
 import storage
+from measurement_table import MeasurementTable
 import model
 import numpy as np
 import pickle
@@ -9,7 +11,6 @@ from custom_logging import bao_logging
 from plot_optimizer_configs import plot_performance, plot_learned_performance
 from performance_prediction import PerformancePrediction
 import random
-from copy import deepcopy
 from presto_query_plan.plan_fields import ESTIMATES
 
 
@@ -17,13 +18,17 @@ class BaoTrainingException(Exception):
     pass
 
 
-def load_data(bench=None, training_ratio=0.8):
-    training_data, test_data = storage.experience(bench, training_ratio)
+def load_data(bench=None, training_ratio=0.8, snapshot_dir=None):
+    if snapshot_dir is not None:
+        # read the local snapshot (see snapshot.py) instead of querying the database
+        training_data, test_data = snapshot.experience(snapshot_dir, bench, training_ratio)
+    else:
+        training_data, test_data = storage.experience(bench, training_ratio)
 
-    x_train = [config.plan_json for config in training_data]
-    y_train = [config.running_time for config in training_data]
-    x_test = [config.plan_json for config in test_data]
-    y_test = [config.running_time for config in test_data]
+    x_train = training_data.plans_json()
+    y_train = training_data.running_times.tolist()
+    x_test = test_data.plans_json()
+    y_test = test_data.running_times.tolist()
 
     return x_train, y_train, x_test, y_test, training_data, test_data
 
@@ -58,6 +63,10 @@ def deserialize_data(directory):
         training_configs = pickle.load(f)
     with open(f'{directory}/test_configs', 'rb') as f:
         test_configs = pickle.load(f)
+    # previous versions pickled lists of storage.Measurement
+    if not isinstance(training_configs, MeasurementTable):
+        training_configs = MeasurementTable.from_measurements(training_configs)
+        test_configs = MeasurementTable.from_measurements(test_configs)
     return x_train, y_train, x_test, y_test, training_configs, test_configs
 
 
@@ -77,6 +86,18 @@ def train_and_save_model(filename, x_train, y_train, x_test, y_test, verbose=Tru
     return regression_model, losses
 
 
+def train_and_save_model_on_stream(filename, stream, verbose=True):
+    """Train the model on the experience stream without loading the whole experience (see model.BaoRegression.fit_experience)
+    :param stream: returns a new stream of (training, test) batches, e.g. lambda: storage.stream_experience(benchmark)
+    """
+    regression_model = model.BaoRegression(verbose=verbose)
+    losses = regression_model.fit_experience(stream)
+    bao_logging.info('training samples: %s', regression_model.num_items_trained_on())
+    regression_model.save(filename)
+
+    return regression_model, losses
+
+
 def evaluate_prediction(y, predictions, plans, query_path, is_training) -> PerformancePrediction:
     default_plan = list(filter(lambda x: x.num_disabled_rules == 0, plans))[0]
 
@@ -101,37 +122,57 @@ def evaluate_prediction(y, predictions, plans, query_path, is_training) -> Perfo
                                  best_alt_plan_running_time, query_path, is_training)
 
 
-def choose_best_plans(filename: str, test_configs: list[storage.Measurement], is_training: bool) -> list[
-    PerformancePrediction]:
+def choose_best_plans(filename: str, test_configs: MeasurementTable, is_training: bool) -> list[PerformancePrediction]:
     """For each query, let Bao estimate the performance of all QEPs and compare them to the runtime of the default plan"""
+    return choose_best_plans_on_stream(filename, [test_configs], is_training)
+
+
+def query_batches(batches):
+    """Regroup batches of the experience stream, which is ordered by query id, such that all plans of a query are in the same batch"""
+    pending = MeasurementTable.empty()
+    for batch in batches:
+        table = MeasurementTable.concatenate([pending, batch])
+        if len(table) == 0:
+            continue
+        # the last query may continue in the next batch
+        is_last_query = table.query_ids == table.query_ids[-1]
+        pending = table.take(is_last_query)
+        if not is_last_query.all():
+            yield table.take(~is_last_query)
+    if len(pending) > 0:
+        yield pending
+
+
+def choose_best_plans_on_stream(filename: str, batches, is_training: bool) -> list[PerformancePrediction]:
+    """choose_best_plans for the batches of the experience stream, only one batch is held in memory at a time"""
 
     # load model
     bao_model = model.BaoRegression(verbose=True)
     bao_model.load(filename)
 
-    # load query plans for prediction
-    all_query_plans = {}
-    for plan_runtime in test_configs:
-        if plan_runtime.query_id in all_query_plans:
-            all_query_plans[plan_runtime.query_id].append(plan_runtime)
-        else:
-            all_query_plans[plan_runtime.query_id] = [plan_runtime]
+    performance_predictions: list[PerformancePrediction] = []
+    for test_configs in query_batches(batches):
+        performance_predictions.extend(_choose_best_plans(bao_model, test_configs, is_training))
+    return list(reversed(sorted(performance_predictions, key=lambda entry: entry.selected_plan_relative_improvement)))
+
 
+def _choose_best_plans(bao_model, test_configs: MeasurementTable, is_training: bool) -> list[PerformancePrediction]:
     performance_predictions: list[PerformancePrediction] = []
 
-    for query_id in sorted(all_query_plans.keys()):
-        plans_and_estimates = all_query_plans[query_id]
-        plans_and_estimates = sorted(plans_and_estimates, key=lambda record: record.running_time)
+    # query plans for prediction, grouped by query and sorted by their runtime
+    _, groups = test_configs.group_by_query()
+    for rows in groups:
+        plans_and_estimates = [test_configs[index] for index in rows]
         query_path = plans_and_estimates[0].query_path
 
-        bao_logging.info('Preprocess data for query %s', plans_and_estimates[0].query_path)
-        x = [x.plan_json for x in plans_and_estimates]
-        y = [x.running_time for x in plans_and_estimates]
+        bao_logging.info('Preprocess data for query %s', query_path)
+        x = [test_configs.plan(index) for index in rows]
+        y = test_configs.running_times[rows].tolist()
 
         predictions = bao_model.predict(x)
         performance_prediction = evaluate_prediction(y, predictions, plans_and_estimates, query_path, is_training)
         performance_predictions.append(performance_prediction)
-    return list(reversed(sorted(performance_predictions, key=lambda entry: entry.selected_plan_relative_improvement)))
+    return performance_predictions
 
 
 def remove_estimates_helper(qep: dict):
@@ -153,26 +194,41 @@ def remove_estimates(datasets: list[list[str]]) -> list[list[str]]:
         yield result
 
 
-def remove_estimates_from_measurements(datasets: list[list[storage.Measurement]]) -> list[list[storage.Measurement]]:
+def remove_estimates_from_measurements(datasets: list[MeasurementTable]) -> list[MeasurementTable]:
+    def remove_estimates_from_plan(plan):
+        qep = json.loads(plan)
+        remove_estimates_helper(qep)
+        return qep
+
     for dataset in datasets:
-        result = []
-        for measurement in dataset:
-            measurement = deepcopy(measurement)
-            qep = json.loads(measurement.plan_json)
-            remove_estimates_helper(qep)
-            measurement.plan_json = qep
-            result.append(measurement)
-        yield result
+        # the rows share their arrays with the original dataset, only the plans are copied
+        yield dataset.map_plans(remove_estimates_from_plan)
 
 
-def train(bench: str, considered_queries_in_plot: list[str], run_without_estimates=False):
+def train(bench: str, considered_queries_in_plot: list[str], run_without_estimates=False, streaming=False):
     model_name = 'model'
     data_dir = 'data'
     model_name_no_estimates = 'model_no_estimates'
     data_dir_no_estimates = 'data_no_estimates'
     retrain = True
 
-    if retrain:
+    if streaming:
+        # train and evaluate on the experience stream, without loading the whole experience
+        def stream():
+            return storage.stream_experience(bench, training_ratio=0.8)
+
+        def stream_without_estimates():
+            return (tuple(remove_estimates_from_measurements(batch)) for batch in stream())
+
+        train_and_save_model_on_stream(model_name, stream)
+        if run_without_estimates:
+            train_and_save_model_on_stream(model_name_no_estimates, stream_without_estimates)
+
+        test_data = (test_batch for _, test_batch in stream())
+        training_data = (training_batch for training_batch, _ in stream())
+        test_data_no_estimates = (test_batch for _, test_batch in stream_without_estimates())
+        training_data_no_estimates = (training_batch for training_batch, _ in stream_without_estimates())
+    elif retrain:
         x_train, y_train, x_test, y_test, training_data, test_data = load_data(bench, training_ratio=0.8)
         serialize_data(data_dir, x_train, y_train, x_test, y_test, training_data, test_data)
         train_and_save_model(model_name, x_train, y_train, x_test, y_test)
@@ -194,21 +250,29 @@ def train(bench: str, considered_queries_in_plot: list[str], run_without_estimat
                 deserialize_data(data_dir_no_estimates)
             print(y_train_no_estimates)
 
+    def choose(model_dir, data, is_training):
+        # streamed data is a generator of batches
+        if isinstance(data, MeasurementTable):
+            return choose_best_plans(model_dir, data, is_training)
+        return choose_best_plans_on_stream(model_dir, data, is_training)
+
     # todo run with and without estimates
-    configs = [(model_name, test_data, training_data),
-               (model_name_no_estimates, test_data_no_estimates, training_data_no_estimates)]
+    configs = [(model_name, test_data, training_data)]
+    if run_without_estimates:
+        configs.append((model_name_no_estimates, test_data_no_estimates, training_data_no_estimates))
 
+    performances = {}
     for model_dir, test_data, training_data in configs:
-        performance_test = choose_best_plans(model_dir, test_data, is_training=False)
-        performance_training = choose_best_plans(model_dir, training_data, is_training=True)
+        performance_test = choose(model_dir, test_data, is_training=False)
+        performance_training = choose(model_dir, training_data, is_training=True)
+        performances[model_dir] = performance_test, performance_training
 
         # calculate absolute improvements
         abs_improvements_test = sum([x.selected_plan_absolute_improvement for x in performance_test])
         abs_test = sum([x.default_plan_runtime for x in performance_test])
         print(f'test improvement rel: {(abs_improvements_test / float(abs_test)):.4f}')
     # todo evaluate also the improvmenets of the best hint sets here!!!
-    performance_test = choose_best_plans(model_name, test_data, is_training=False)
-    performance_training = choose_best_plans(model_name, training_data, is_training=True)
+    performance_test, performance_training = performances[model_name]
 
     # calculate absolute improvements for test and training sets
     def calc_improvements(dataset: list):
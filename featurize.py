@@ -159,6 +159,28 @@ def _get_plan_stats(data):
     return StatExtractor([CPU_COST, ROWS], [costs_min, rows_min], [costs_max, rows_max])
 
 
+def _merge_estimate_ranges(ranges, data):
+    """Extend the range (min, max) of the log estimates per field by the estimates of the plans, see _get_plan_stats
+    :param ranges: dict of field -> (min, max), updated in place
+    """
+    def recurse(node):
+        if ESTIMATES in node:
+            for field in (CPU_COST, ROWS):
+                estimate = node[ESTIMATES][field]
+                if estimate not in (0, 'NaN'):
+                    value = np.log(estimate + 1)
+                    lo, hi = ranges.get(field, (value, value))
+                    ranges[field] = (min(lo, value), max(hi, value))
+
+        if CHILDREN in node:
+            for child in node[CHILDREN]:
+                recurse(child)
+
+    for plan in data:
+        recurse(plan)
+    return ranges
+
+
 def _get_all_relations(data):
     all_rels = []
 
@@ -240,6 +262,8 @@ class TreeFeaturizer:
 
     def __init__(self):
         self.__tree_builder = None
+        self.__relations = set()
+        self.__ranges = {}
 
     def fit(self, trees):
         for t in trees:
@@ -249,6 +273,17 @@ class TreeFeaturizer:
         stats_extractor = _get_plan_stats(trees)
         self.__tree_builder = TreeBuilder(stats_extractor, all_rels)
 
+    def partial_fit(self, trees):
+        """Fit the featurizer batch by batch, all batches have to be fitted before the first tree is transformed"""
+        for t in trees:
+            self.preprocess(t)
+            _attach_buf_data(t)
+        self.__relations.update(_get_all_relations(trees))
+        _merge_estimate_ranges(self.__ranges, trees)
+        fields = [CPU_COST, ROWS]
+        stats_extractor = StatExtractor(fields, [self.__ranges.get(f, (0, 1))[0] for f in fields], [self.__ranges.get(f, (0, 1))[1] for f in fields])
+        self.__tree_builder = TreeBuilder(stats_extractor, self.__relations)
+
     def preprocess(self, plan):
         # this plan has been preprocessed already
         if PREPROCESSED in plan and plan[PREPROCESSED]:
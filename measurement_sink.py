@@ -0,0 +1,266 @@
+"""This module implements a write-behind sink that persists query configs and measurements in a background thread.
+
+Rows that cannot be written (e.g. the database is unreachable) are not dropped: after retrying with exponential backoff, they are spilled
+to a local file of the driver. The spilled rows are written on their own before the next batch, and when a driver is started again it
+adopts the spill files of stopped drivers on the same host. Spilled rows that still fail on their own while the database accepts other
+rows (e.g. constraint violations) are set aside in a rejected file, so they do not block later writes.
+"""
+import atexit
+import glob
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+from datetime import datetime
+
+import storage
+from custom_logging import bao_logging
+
+# maximum number of buffered rows, the driver blocks if the sink is full (backpressure)
+MAX_PENDING = 256
+# maximum number of rows that are written in the same transaction
+BATCH_SIZE = 64
+FLUSH_RETRIES = 5
+# the delay doubles after every failed attempt
+RETRY_DELAY_SECONDS = 1.0
+MAX_RETRY_DELAY_SECONDS = 30.0
+# the spill files of the drivers are kept in the working directory, one file per driver process (see spill_path)
+SPILL_DIRECTORY = '.'
+SPILL_PREFIX = 'measurement_sink'
+# queue item that makes the background thread write the spilled rows, see flush
+_REPLAY = object()
+
+
+def spill_path(directory=SPILL_DIRECTORY, pid=None):
+    """:returns: path of the spill file of the driver process, concurrent drivers do not share it"""
+    return os.path.join(directory, f'{SPILL_PREFIX}.{socket.gethostname()}.{os.getpid() if pid is None else pid}.spill')
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SpillFile:
+    """Local file keeping the rows (pairs of a storage insert function and its keyword arguments) that could not be written"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, rows):
+        if len(rows) == 0:
+            self.clear()
+            return
+        # replace the file atomically, a crash while spilling keeps the previously spilled rows
+        with open(f'{self.path}.tmp', 'wb') as f:
+            pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def append(self, rows):
+        self.save(self.load() + rows)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def adopt_orphans(self):
+        """Take over the spilled rows of stopped drivers of this host (default spill paths only)
+        :returns: number of adopted rows
+        """
+        directory = os.path.dirname(self.path) or '.'
+        adopted = 0
+        for path in glob.glob(spill_path(directory, '*')):
+            pid = path.rsplit('.', 2)[-2]
+            if path == self.path or not pid.isdigit() or _is_running(int(pid)):
+                continue
+            # renaming is atomic, only one of several starting drivers adopts the file
+            claimed = f'{self.path}.adopted'
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            rows = SpillFile(claimed).load()
+            self.append(rows)
+            os.remove(claimed)
+            adopted += len(rows)
+            bao_logging.info('Adopted %s spilled rows of the stopped driver %s', len(rows), pid)
+        return adopted
+
+
+class MeasurementSink:
+    """The MeasurementSink buffers query configs, result fingerprints and measurements in a bounded queue.
+    A background thread writes them in batches (one transaction per batch) while the driver already executes the next query.
+    It provides the same register functions as the storage module and is used as a drop-in replacement.
+    :param path: file of the rows that could not be written (default: spill_path), rows spilled by a previous driver are written first
+    """
+
+    def __init__(self, max_pending=MAX_PENDING, batch_size=BATCH_SIZE, path=None):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.batch_size = batch_size
+        self.adopt_orphans = path is None
+        self.spill = SpillFile(spill_path() if path is None else path)
+        self.rejected = SpillFile(f'{self.spill.path}.rejected')
+        self.num_rejected = 0
+        self.closed = False
+        self.worker = threading.Thread(target=self._run, name='measurement-sink', daemon=True)
+        self.worker.start()
+        # do not lose buffered rows if the driver exits without closing the sink
+        atexit.register(self.close)
+
+    def _put(self, operation, **kwargs):
+        assert not self.closed
+        if self.queue.full():
+            bao_logging.info('measurement sink is full, wait for pending writes')
+        self.queue.put((operation, kwargs))
+
+    def register_query_config(self, query_path, disabled_rules, logical_dot, fragmented_dot, logical_json, fragmented_json, plan_hash):
+        """Buffer the query optimizer configuration.
+        :returns: query plan is already known and a duplicate
+        """
+        # the metadata cache remembers the plan hash, i.e. buffered configs are considered for later duplicate checks
+        is_duplicate = storage.check_plan_hash(query_path, disabled_rules, plan_hash)
+        self._put(storage.insert_query_config, query_path=query_path, disabled_rules=disabled_rules, logical_dot=logical_dot,
+                  fragmented_dot=fragmented_dot, logical_json=logical_json, fragmented_json=fragmented_json, plan_hash=plan_hash,
+                  is_duplicate=is_duplicate)
+        return is_duplicate
+
+    def register_query_fingerprint(self, query_path, fingerprint):
+        """Buffer the result fingerprint, mismatching fingerprints are reported once they are written.
+        :returns: always true as the comparison happens asynchronously
+        """
+        self._put(storage.check_query_fingerprint, query_path=query_path, fingerprint=fingerprint)
+        return True
+
+    def register_measurement(self, query_path, disabled_rules, elapsed, planning, scheduling, running, finishing, cpu, input_data_size, nodes,
+                             warmup=False, stop_reason=None, censored=False, fetch_rows=None, fetch_seconds=None):
+        bao_logging.info('register a new measurement for query %s and the disabled rules/optimizers [%s]', query_path, disabled_rules)
+        self._put(storage.insert_measurement, query_path=query_path, disabled_rules=disabled_rules, elapsed=elapsed, planning=planning,
+                  scheduling=scheduling, running=running, finishing=finishing, cpu=cpu, input_data_size=input_data_size, nodes=nodes,
+                  now=datetime.now(), warmup=warmup, stop_reason=stop_reason, censored=censored,
+                  fetch_rows=fetch_rows, fetch_seconds=fetch_seconds)
+
+    def unwritten(self):
+        """:returns: number of rows that are spilled or have been rejected by the database"""
+        return len(self.spill.load()) + self.num_rejected
+
+    def _report_unwritten(self):
+        unwritten = self.unwritten()
+        if unwritten > 0:
+            bao_logging.fatal('%s rows have not been written to the database, see %s and %s', unwritten, self.spill.path, self.rejected.path)
+        return unwritten
+
+    def flush(self):
+        """Block until all buffered rows have been written or spilled, spilled rows are written again
+        :returns: number of rows that have not been written (see unwritten)
+        """
+        if not self.closed:
+            self.queue.put(_REPLAY)
+            self.queue.join()
+        return self._report_unwritten()
+
+    def close(self):
+        """Write all buffered rows and stop the background thread
+        :returns: number of rows that have not been written (see unwritten)
+        """
+        if self.closed:
+            return self.unwritten()
+        self.closed = True
+        self.queue.put(None)
+        self.worker.join()
+        return self._report_unwritten()
+
+    @staticmethod
+    def _write_with_retries(rows):
+        """:returns: results of the rows, None if all attempts failed"""
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                return storage.write_batch(rows)
+            except Exception as e:  # pylint: disable=broad-except
+                bao_logging.error('Could not write %s buffered rows (attempt %s): %s', len(rows), attempt + 1, str(e))
+                if attempt + 1 < FLUSH_RETRIES:
+                    time.sleep(min(RETRY_DELAY_SECONDS * 2 ** attempt, MAX_RETRY_DELAY_SECONDS))
+        return None
+
+    @staticmethod
+    def _check_results(rows, results):
+        for (operation, kwargs), result in zip(rows, results):
+            if operation == storage.check_query_fingerprint and not result:  # pylint: disable=comparison-with-callable
+                bao_logging.warning('Result fingerprint=%s does not match existing fingerprints!', kwargs['fingerprint'])
+
+    def _replay(self):
+        """Write the spilled rows in their own transaction, rows are written one by one if that fails
+        :returns: spilled rows that could not be written on their own
+        """
+        spilled = self.spill.load()
+        if len(spilled) == 0:
+            return []
+        try:
+            self._check_results(spilled, storage.write_batch(spilled))
+            self.spill.clear()
+            bao_logging.info('Wrote %s spilled rows of %s', len(spilled), self.spill.path)
+            return []
+        except Exception as e:  # pylint: disable=broad-except
+            bao_logging.error('Could not write %s spilled rows, write them one by one: %s', len(spilled), str(e))
+        failed = []
+        for row in spilled:
+            try:
+                self._check_results([row], storage.write_batch([row]))
+            except Exception:  # pylint: disable=broad-except
+                failed.append(row)
+        self.spill.save(failed)
+        return failed
+
+    def _write(self, batch):
+        # spilled rows are written before the batch, e.g. measurements reference the configs of earlier rows
+        failed = self._replay()
+        if len(batch) == 0:
+            return
+        results = self._write_with_retries(batch)
+        if results is None:
+            self.spill.append(batch)
+            bao_logging.fatal('Spilled %s rows to %s after %s failed attempts, they are written before the next batch', len(batch), self.spill.path,
+                              FLUSH_RETRIES)
+            return
+        self._check_results(batch, results)
+        if len(failed) > 0:
+            # the database accepts other rows, the spilled rows fail on their own and would be retried forever
+            self.rejected.append(failed)
+            self.spill.clear()
+            self.num_rejected += len(failed)
+            bao_logging.fatal('Set %s spilled rows that cannot be written aside in %s', len(failed), self.rejected.path)
+
+    def _run(self):
+        # write the rows spilled by a previous driver before any new row
+        if self.adopt_orphans:
+            self.spill.adopt_orphans()
+        self._write([])
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            # take everything that is already buffered, but do not wait for more rows
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                stop = True
+            operations = [item for item in batch if item is not None and item is not _REPLAY]
+            if len(operations) > 0 or _REPLAY in batch or stop:
+                self._write(operations)
+            for _ in batch:
+                self.queue.task_done()
@@ -0,0 +1,166 @@
+"""This module implements a columnar in-memory representation of measurements (the experience to train BAO)"""
+import numpy as np
+
+from plan_store import CompressedPlan
+
+
+def _decompress(plan):
+    return plan.decompress() if isinstance(plan, CompressedPlan) else plan
+
+
+class MeasurementRow:
+    """Read-only view of one row of a MeasurementTable, it provides the attributes of storage.Measurement"""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def query_path(self):
+        return self.table.query_paths[self.table.query_ids[self.index]]
+
+    @property
+    def query_id(self):
+        return int(self.table.query_ids[self.index])
+
+    @property
+    def optimizer_config(self):
+        return int(self.table.config_ids[self.index])
+
+    @property
+    def disabled_rules(self):
+        return self.table.disabled_rules[self.index]
+
+    @property
+    def num_disabled_rules(self):
+        return int(self.table.num_disabled_rules[self.index])
+
+    @property
+    def plan_json(self):
+        return self.table.plan(self.index)
+
+    @property
+    def running_time(self):
+        return float(self.table.running_times[self.index])
+
+    @property
+    def cpu_time(self):
+        cpu_time = self.table.cpu_times[self.index]
+        return None if np.isnan(cpu_time) else float(cpu_time)
+
+    def __repr__(self):
+        return f'MeasurementRow(query_id={self.query_id}, optimizer_config={self.optimizer_config}, running_time={self.running_time})'
+
+
+class MeasurementTable:
+    """Measurements stored column-wise in typed numpy arrays, one row per query optimizer config.
+    Query paths are stored once per query and plans once per distinct plan, rows reference them by query id and plan index.
+    Subsets (take, split_by_query) share the query paths and plans with the table they are derived from."""
+
+    def __init__(self, query_ids, config_ids, num_disabled_rules, running_times, cpu_times, disabled_rules, plan_indexes, plans, query_paths):
+        self.query_ids = np.asarray(query_ids, dtype=np.int64)
+        self.config_ids = np.asarray(config_ids, dtype=np.int64)
+        self.num_disabled_rules = np.asarray(num_disabled_rules, dtype=np.int32)
+        self.running_times = np.asarray(running_times, dtype=np.float64)
+        # missing cpu times are stored as nan
+        self.cpu_times = np.asarray(cpu_times, dtype=np.float64)
+        self.disabled_rules = np.asarray(disabled_rules, dtype=object)
+        self.plan_indexes = np.asarray(plan_indexes, dtype=np.int32)
+        # plan text, parsed plan, or CompressedPlan
+        self.plans = plans
+        # query id -> query path
+        self.query_paths = query_paths
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [], [], [], [], {})
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a table from (query_path, query_id, config_id, disabled_rules, num_disabled_rules, plan_key, plan, running_time, cpu_time) rows,
+        rows with the same plan key (e.g. the plan digest) share their plan"""
+        rows = list(rows)
+        plans = []
+        plan_indexes = []
+        plan_keys = {}
+        query_paths = {}
+        for query_path, query_id, _, _, _, plan_key, plan, _, _ in rows:
+            query_paths[query_id] = query_path
+            if plan_key is None or plan_key not in plan_keys:
+                plans.append(plan)
+                plan_keys[plan_key] = len(plans) - 1
+                plan_indexes.append(len(plans) - 1)
+            else:
+                plan_indexes.append(plan_keys[plan_key])
+        return cls([row[1] for row in rows], [row[2] for row in rows], [row[4] for row in rows], [float(row[7]) for row in rows],
+                   [np.nan if row[8] is None else float(row[8]) for row in rows], [row[3] for row in rows], plan_indexes, plans, query_paths)
+
+    @classmethod
+    def from_measurements(cls, measurements):
+        """Convert storage.Measurement objects (e.g. loaded from pickles of previous versions)"""
+        return cls.from_rows((m.query_path, m.query_id, m.optimizer_config, m.disabled_rules, m.num_disabled_rules, None, m.plan_json,
+                              m.running_time, m.cpu_time) for m in measurements)
+
+    @staticmethod
+    def concatenate(tables):
+        """Concatenate tables, the plans of all tables are merged into one list"""
+        tables = list(tables)
+        if len(tables) == 0:
+            return MeasurementTable.empty()
+        plans = []
+        query_paths = {}
+        plan_indexes = []
+        for table in tables:
+            plan_indexes.append(table.plan_indexes + len(plans))
+            plans.extend(table.plans)
+            query_paths.update(table.query_paths)
+        return MeasurementTable(np.concatenate([t.query_ids for t in tables]), np.concatenate([t.config_ids for t in tables]),
+                                np.concatenate([t.num_disabled_rules for t in tables]), np.concatenate([t.running_times for t in tables]),
+                                np.concatenate([t.cpu_times for t in tables]), np.concatenate([t.disabled_rules for t in tables]),
+                                np.concatenate(plan_indexes), plans, query_paths)
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return MeasurementRow(self, index)
+
+    def __iter__(self):
+        return (MeasurementRow(self, index) for index in range(len(self)))
+
+    def plan(self, index):
+        return _decompress(self.plans[self.plan_indexes[index]])
+
+    def plans_json(self):
+        """:returns: plan of every row"""
+        return [self.plan(index) for index in range(len(self))]
+
+    def take(self, indexes):
+        """:returns: table of the given rows (index array or boolean mask)"""
+        return MeasurementTable(self.query_ids[indexes], self.config_ids[indexes], self.num_disabled_rules[indexes], self.running_times[indexes],
+                                self.cpu_times[indexes], self.disabled_rules[indexes], self.plan_indexes[indexes], self.plans, self.query_paths)
+
+    def map_plans(self, function):
+        """:returns: table with the same rows whose plans are transformed by the function, it is called once per distinct plan"""
+        return MeasurementTable(self.query_ids, self.config_ids, self.num_disabled_rules, self.running_times, self.cpu_times, self.disabled_rules,
+                                self.plan_indexes, [function(_decompress(plan)) for plan in self.plans], self.query_paths)
+
+    def group_by_query(self):
+        """Group the rows by query id, the rows of a group are sorted by their running time
+        :returns: sorted query ids and one index array per query
+        """
+        order = np.lexsort((self.running_times, self.query_ids))
+        query_ids, starts = np.unique(self.query_ids[order], return_index=True)
+        if len(order) == 0:
+            return query_ids, []
+        return query_ids, np.split(order, starts[1:])
+
+    def split_by_query(self, training_query_ids):
+        """:returns: rows of the training queries and rows of the remaining queries"""
+        is_training = np.isin(self.query_ids, np.asarray(list(training_query_ids), dtype=np.int64))
+        return self.take(is_training), self.take(~is_training)
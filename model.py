@@ -39,6 +39,10 @@ def _inv_log1p(x):
     return np.exp(x) - 1
 
 
+def _parse_plans(table):
+    return [json.loads(plan) if isinstance(plan, str) else plan for plan in table.plans_json()]
+
+
 class BaoData:
     def __init__(self, data):
         assert data
@@ -137,7 +141,34 @@ class BaoRegression:
         self.__tree_transform.fit(x_train + x_test)
         x_train = self.__tree_transform.transform(x_train)
         x_test = self.__tree_transform.transform(x_test)
+        return self.__train(x_train, y_train, x_test, y_test)
+
+    def fit_experience(self, stream):
+        """Train the model on the experience streamed by storage.stream_experience without holding the plans of all batches in memory.
+        The experience is streamed twice: the featurizer is fitted on the first pass, the plans are featurized batch by batch on the second
+        pass. Only the feature trees and the runtimes are kept for training.
+        :param stream: returns a new stream of (training, test) batches, e.g. lambda: storage.stream_experience(benchmark)
+        """
+        self.__tree_transform = TreeFeaturizer()
+        for training_data, test_data in stream():
+            self.__tree_transform.partial_fit(_parse_plans(training_data) + _parse_plans(test_data))
+
+        x_train, y_train, x_test, y_test = [], [], [], []
+        for training_data, test_data in stream():
+            x_train.extend(self.__tree_transform.transform(_parse_plans(training_data)))
+            y_train.extend(training_data.running_times.tolist())
+            x_test.extend(self.__tree_transform.transform(_parse_plans(test_data)))
+            y_test.extend(test_data.running_times.tolist())
+        self.__n = len(x_train)
+        if not x_train:
+            raise ValueError('Cannot train a Bao model with no experience')
+
+        y_train = self.__pipeline.fit_transform(np.array(y_train).reshape(-1, 1)).astype(np.float32)
+        y_test = self.__pipeline.fit_transform(np.array(y_test).reshape(-1, 1)).astype(np.float32)
+        return self.__train(x_train, y_train, x_test, y_test)
 
+    def __train(self, x_train, y_train, x_test, y_test):
+        """Train the network on the featurized trees and the transformed runtimes"""
         pairs = list(zip(x_train, y_train))
         pairs_test = list(zip(x_test, y_test))
 
@@ -1,6 +1,5 @@
 """This module provides the classes QuerySpan and the OptimizerConfiguration"""
 import storage
-import pandasql as pdsql
 import statistics
 import progressbar
 from custom_logging import bao_logging
@@ -46,15 +45,24 @@ class OptimizerConfig:
     """An OptimizerConfig allows to efficiently explore the search space of different optimizer settings.
       It implements a dynamic programming-based approach to execute promising optimizer configurations (e.g. disable certain optimizers)"""
 
-    def __init__(self, query_path):
+    def __init__(self, query_path, resume=False):
+        """:param resume: continue the exploration from the last checkpoint of the query (see checkpoint) if there is one"""
         self.query_path = query_path
         # store configs that resulted in runtimes worse than the baseline
         self.blacklisted_configs = set()
         self.query_span = QuerySpan(self.query_path)
         self.tunable_opts_rules = self.query_span.get_tunable_optimizers()
+        self.finished = False
 
-        self.n = 0  # consider 1 rule/optimizer at once
-        self.configs = self.get_next_configs()
+        state = storage.load_exploration_state(query_path) if resume else None
+        if state is None:
+            self.n = 0  # consider 1 rule/optimizer at once
+            self.configs = self.get_next_configs()
+            self.checkpoint()
+        else:
+            self.n, self.configs, blacklisted_configs, self.finished = state
+            self.blacklisted_configs = {frozenset(config) for config in blacklisted_configs}
+            bao_logging.info('Resume the exploration of %s at DP stage %s', query_path, self.n - 1)
         self.iterator = -1
 
         self.progress_bar = None
@@ -86,6 +94,17 @@ class OptimizerConfig:
                     return False
         return True
 
+    def checkpoint(self):
+        """Persist the current DP stage, its configs, and the blacklist. The configs of a stage are taken at once (see next_stage),
+        i.e. a resumed exploration restarts the stage and skips its configs that have already been measured."""
+        storage.save_exploration_state(self.query_path, self.n, self.configs, sorted(sorted(config) for config in self.blacklisted_configs),
+                                       self.finished)
+
+    def finish(self):
+        """Mark the exploration of the query as finished, a resumed driver skips the query"""
+        self.finished = True
+        self.checkpoint()
+
     def restart_progress_bar(self):
         if self.progress_bar is not None:
             self.progress_bar.finish()
@@ -98,36 +117,22 @@ class OptimizerConfig:
         return f'Config {{\n\toptimizers:{self.tunable_opts_rules}}}'
 
     def get_measurements(self):
-        # we do not consider planning and scheduling time in the total runtime
-        stmt = f'''
-            select (running + finishing) as total_runtime, qoc.disabled_rules, m.time, qoc.num_disabled_rules
-            from queries q,
-                 measurements m,
-                 query_optimizer_configs qoc
-            where m.query_optimizer_config_id = qoc.id
-              and qoc.query_id = q.id
-              and q.query_path = '{self.query_path}'
-              and (qoc.num_disabled_rules = 1 or qoc.duplicated_plan = false)
-            order by m.time asc;
-            '''
-        df = storage.get_df(stmt)
-        return df
+        # runtime statistics per config, we do not consider planning and scheduling time in the total runtime
+        df = storage.get_runtime_stats(self.query_path)
+        return df[(df['num_disabled_rules'] == 1) | (df['duplicated_plan'] == False)]  # pylint: disable=singleton-comparison
 
     def get_baseline(self):
-        # pylint: disable=possibly-unused-variable
+        """:returns: median and mean runtime of the default config"""
         df = self.get_measurements()
-        runs = pdsql.sqldf('select total_runtime from df where disabled_rules = \'None\'', locals())
-        runtimes = runs['total_runtime'].to_list()
-        return runtimes
+        baseline = df[df['disabled_rules'] == 'None']
+        if len(baseline) == 0:
+            raise statistics.StatisticsError('no measurements of the default config')
+        return baseline['runtime_median'].iloc[0], baseline['runtime_mean'].iloc[0]
 
     def get_promising_measurements_by_num_rules(self, num_disabled_rules, baseline_median, baseline_mean):
-        measurements = self.get_measurements()
-        stmt = f'''select total_runtime, disabled_rules, time
-        from measurements
-        where num_disabled_rules = {num_disabled_rules};
-        '''
-        df = pdsql.sqldf(stmt, locals())
-        measurements = df.groupby(['disabled_rules'])['total_runtime'].agg(['median', 'mean'])
+        df = self.get_measurements()
+        measurements = df[df['num_disabled_rules'] == num_disabled_rules].set_index('disabled_rules')
+        measurements = measurements.rename(columns={'runtime_median': 'median', 'runtime_mean': 'mean'})
 
         # find bad configs and black list them so they are not used in later DP stages
         bad_configs = measurements[(measurements['median'] > baseline_median) |
@@ -155,11 +160,9 @@ class OptimizerConfig:
             configs = [[opt] for opt in self.tunable_opts_rules]
         else:
             # build config based on DP
-            baseline = self.get_baseline()
             try:
                 # basic statistics for baseline
-                median = statistics.median(baseline)
-                mean = statistics.mean(baseline)
+                median, mean = self.get_baseline()
                 # get results from previous runs, consider only those configs better than the baseline
                 single_optimizers = self.get_promising_measurements_by_num_rules(1, median, mean) + [[key] for key in self.query_span.dependencies]
                 combinations_previous_run = self.get_promising_measurements_by_num_rules(n - 1, median, mean)
@@ -174,7 +177,7 @@ class OptimizerConfig:
         return configs
 
     def get_num_configs(self):
-        return len(self.configs)
+        return 0 if self.configs is None else len(self.configs)
 
     def get_disabled_opts_rules(self):
         if self.configs is None or len(self.configs) == 0 or len(self.configs[self.iterator]) == 0:
@@ -185,6 +188,7 @@ class OptimizerConfig:
         if self.iterator < self.get_num_configs() - 1:
             return True
         self.configs = self.get_next_configs()
+        self.checkpoint()
         if self.configs is None:
             return False
         bao_logging.info('Enter next DP stage, execute for %s hint sets/configurations', len(self.configs))
@@ -198,7 +202,17 @@ class OptimizerConfig:
         conf = self.configs[self.iterator]
         tmp_optimizers = list(filter(lambda x: x in self.query_span.get_tunable_optimizers(), conf))
 
-        commands = []
+        properties = {}
         if len(tmp_optimizers) > 0:
-            commands.append(f'''SET session {BAO_DISABLED_OPTIMIZERS} = \'{','.join(tmp_optimizers)}\'''')
-        return commands
+            properties[BAO_DISABLED_OPTIMIZERS] = ','.join(tmp_optimizers)
+        return properties
+
+    def next_stage(self):
+        """Take all remaining configs of the current DP stage at once
+        :returns: list of (disabled rules, session properties) per config
+        """
+        stage = []
+        while self.iterator < self.get_num_configs() - 1:
+            properties = self.next()
+            stage.append((self.get_disabled_opts_rules(), properties))
+        return stage
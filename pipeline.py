@@ -0,0 +1,75 @@
+"""This module overlaps the query span approximation of upcoming queries with the time measurements of the current query.
+
+Approximating a query span only keeps the presto coordinator busy (planning), while the time measurements keep the workers busy (execution).
+A background thread approximates the spans on its own presto session and hands the queries over to the driver through a bounded look-ahead
+queue, i.e. it runs at most lookahead queries ahead of the query that is timed. The queries are timed in their original order.
+"""
+import queue
+import threading
+
+from custom_logging import bao_logging
+
+LOOKAHEAD = 2
+# the span thread checks this often whether the driver stopped while it waits for space in the look-ahead queue
+POLL_SECONDS = 1.0
+
+
+class SpanPipeline:
+    """Approximate the query spans of the queries in a background thread
+    :param approximate_span: called with the path of every query in the span thread, e.g. run_get_query_span bound to the span session
+    """
+
+    def __init__(self, approximate_span, query_paths, lookahead=LOOKAHEAD):
+        assert lookahead > 0, 'the look-ahead queue needs space for at least one query'
+        self.approximate_span = approximate_span
+        self.query_paths = list(query_paths)
+        self.ready = queue.Queue(maxsize=lookahead)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._approximate_spans, name='span-pipeline', daemon=True)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.ready.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _approximate_spans(self):
+        for query_path in self.query_paths:
+            if self.stopped.is_set():
+                return
+            try:
+                self.approximate_span(query_path)
+                error = None
+            except Exception as e:  # pylint: disable=broad-except
+                error = e
+            if not self._put((query_path, error)):
+                return
+
+    def __iter__(self):
+        """:returns: the paths of the queries whose span is stored, in the order of the queries"""
+        if not self.thread.is_alive():
+            self.thread.start()
+        try:
+            for _ in self.query_paths:
+                query_path, error = self.ready.get()
+                if error is not None:
+                    # the exploration of a query depends on its span, skip the query
+                    bao_logging.error('Failed to approximate the query span of %s: %s', query_path, error)
+                    continue
+                yield query_path
+        finally:
+            self.close()
+
+    def close(self):
+        # the thread stops after the span it is approximating, it does not delay the driver
+        self.stopped.set()
+
+
+def run_pipelined(approximate_span, run_query, query_paths, lookahead=LOOKAHEAD):
+    """Time the queries (run_query) while the spans of the next lookahead queries are approximated (approximate_span)"""
+    for query_path in SpanPipeline(approximate_span, query_paths, lookahead):
+        bao_logging.info('run %s...', query_path)
+        run_query(query_path)
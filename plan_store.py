@@ -0,0 +1,48 @@
+"""This module implements the compression of query plans for the content-addressed plan store (table plan_blobs)"""
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD = 'zstd'
+ZLIB = 'zlib'
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+
+
+def plan_digest(plan: str) -> bytes:
+    """The plan store is keyed by the sha256 digest of the uncompressed plan"""
+    return hashlib.sha256(plan.encode()).digest()
+
+
+def compress_plan(plan: str):
+    """Compress the plan using zstd, zlib is used if the zstandard package is not installed
+    :returns: codec and compressed plan
+    """
+    if zstandard is not None:
+        return ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(plan.encode())
+    return ZLIB, zlib.compress(plan.encode(), ZLIB_LEVEL)
+
+
+def decompress_plan(codec, data) -> str:
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ImportError('the plan has been compressed using zstd, install the zstandard package to read it')
+        return zstandard.ZstdDecompressor().decompress(bytes(data)).decode()
+    assert codec == ZLIB
+    return zlib.decompress(bytes(data)).decode()
+
+
+class CompressedPlan:
+    """A plan loaded from the plan store, it is decompressed only when it is needed"""
+    __slots__ = ('codec', 'data')
+
+    def __init__(self, codec, data):
+        self.codec = codec
+        self.data = bytes(data)
+
+    def decompress(self) -> str:
+        return decompress_plan(self.codec, self.data)
@@ -1,21 +1,43 @@
-"""This module provides several helper functions to connect to presto server and to receive messages from Presto via the predefined bao-socket"""
+"""This module provides several helper functions to connect to presto server and to receive messages from Presto via the session's bao-socket"""
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import prestodb
 import json
+import queue
 import struct
-import socketserver
+import threading
 from enum import Enum
 from custom_logging import bao_logging
+from session_properties import BAO_SOCKET, QUERY_MAX_EXECUTION_TIME
 
-# expected presto message prefixes
-SPAN = 'span:'
-EFFECTIVE = 'effective:'
-REQUIRED = 'required:'
-LOGICAL = 'logical:'
-FRAGMENTED = 'fragmented:'
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# expected presto message prefixes, messages are dispatched on their raw bytes
+SPAN = b'span:'
+EFFECTIVE = b'effective:'
+REQUIRED = b'required:'
+LOGICAL = b'logical:'
+FRAGMENTED = b'fragmented:'
 
 # message encodings
-JSON = 'json:'
-DOT = 'dot:'
+JSON = b'json:'
+DOT = b'dot:'
+
+# every message is prefixed by its length (4 bytes, big endian)
+FRAME_HEADER = struct.Struct('>i')
+
+# units of presto durations (e.g. 4m, 1500ms)
+DURATION_UNITS = {'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# callbacks of queries that have not been consumed are dropped after this number of newer queries
+MAX_RETAINED_QUERIES = 256
+# maximum time to wait for the callbacks of a query after its result has been fetched
+CALLBACK_TIMEOUT_SECONDS = 60
 
 
 class PrestoOptimizerType(Enum):
@@ -23,97 +45,285 @@ class PrestoOptimizerType(Enum):
     RULE = 2
 
 
-def recvall(sock, size, buffer=bytes()):
-    while len(buffer) < size:
-        part = sock.recv(size - len(buffer))
-        buffer += part
-    return buffer
+def duration_seconds(duration):
+    """:returns: seconds of a presto duration"""
+    duration = duration.strip()
+    unit = duration.lstrip('0123456789.')
+    return float(duration[:len(duration) - len(unit)]) * DURATION_UNITS[unit.strip()]
+
+
+def remove_prefix(message, prefix):
+    """:returns: memoryview of the message without the prefix, the message is not copied"""
+    assert message[:len(prefix)] == prefix
+    return message[len(prefix):]
+
+
+def parse_json(message):
+    """Parse a json message (memoryview) from its utf-8 bytes, orjson parses the buffer in place"""
+    if orjson is not None:
+        return orjson.loads(message)
+    return json.loads(bytes(message))
+
+
+def _strip(message):
+    """memoryview without leading and trailing whitespace"""
+    start, end = 0, len(message)
+    while start < end and message[start] in b' \t\r\n':
+        start += 1
+    while end > start and message[end - 1] in b' \t\r\n':
+        end -= 1
+    return message[start:end]
+
 
+class CallbackProtocol(asyncio.BufferedProtocol):
+    """Receive the length-prefixed messages of one presto connection. The event loop reads the socket (recv_into) directly into the
+    preallocated buffer of the current frame, so even multi-megabyte plans are received without intermediate copies."""
 
-def remove_prefix(text, prefix):
-    assert text.startswith(prefix)
-    return text[len(prefix):]
+    def __init__(self, server):
+        self.server = server
+        self.header = bytearray(FRAME_HEADER.size)
+        self.frame = self.header
+        self.received = 0
+        self.in_header = True
 
+    def get_buffer(self, sizehint):
+        return memoryview(self.frame)[self.received:]
 
-def receive_query_span(message):
-    if message.startswith(EFFECTIVE):
-        # fixme: query span also contains rule dependencies, fix parsing now
-        presto_session.status.effective_optimizers = json.loads(remove_prefix(message, EFFECTIVE))
-    else:
-        assert message.startswith(REQUIRED)
-        presto_session.status.required_optimizers = json.loads(remove_prefix(message, REQUIRED))
+    def buffer_updated(self, nbytes):
+        self.received += nbytes
+        if self.received < len(self.frame):
+            return
+        if self.in_header:
+            length = FRAME_HEADER.unpack(self.header)[0]
+            self.frame = bytearray(length)
+            self.received = 0
+            self.in_header = False
+            if length > 0:
+                return
+        self.server.dispatch(memoryview(self.frame))
+        self.frame = self.header
+        self.received = 0
+        self.in_header = True
 
 
-class PrestoCallbackHandler(socketserver.BaseRequestHandler):
-    """Request handler class to receive and decode messages from presto server."""
+class QueryCallbacks:
+    """Messages presto sent for one query: the query plans (json, dot) followed by the execution stats"""
 
-    def get_message(self):
-        buffer = recvall(self.request, 4)
-        length = struct.unpack('>i', buffer[:4])[0]
-        buffer = recvall(self.request, length + 4, buffer)
-        return buffer[4:].decode()
+    def __init__(self):
+        self.logical_dot = None
+        self.fragmented_dot = None
+        self.logical_json = None
+        self.fragmented_json = None
+        self.execution_stats = None
 
-    def handle(self):
+
+class CallbackServer:
+    """Asyncio server that receives the messages presto sends to the bao_socket of one session, its event loop runs in a background thread.
+    Query plans are collected until the execution stats of the query arrive, the stats contain the query id and complete the future of the query.
+    Plans and query spans do not reference a query, i.e. they are attributed to the query whose stats arrive next. A session must therefore
+    run one query at a time (see PrestoSession.query), use one session per thread."""
+
+    def __init__(self, host='localhost', port=0):
+        self.lock = threading.Lock()
+        self.queries = collections.OrderedDict()  # query id -> future of QueryCallbacks
+        self.pending = QueryCallbacks()
+        self.pending_span = {}
+        self.spans = queue.Queue()
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(self.loop.create_server(lambda: CallbackProtocol(self), host, port))
+        self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f'presto-callbacks-{self.port}', daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        """Value of the session property bao_socket"""
+        return f'{self.host}:{self.port}'
+
+    def dispatch(self, message):
         """there are different types of messages:
         1. Query span containing either rules or optimizers (encoded as json)
         2. Logical or fragmented query plan (encoded as json)
         3. Query execution stats (e.g. time measurements, plan hash, etc.)
         4. Graphviz encoded query plan (encoded as dot)
+        The message is a memoryview of the received frame, only dot plans are decoded to str.
         """
-        message = self.get_message()
-
-        if message.startswith(JSON):
-            message = remove_prefix(message, JSON)
-            message = message.strip()
-            if message.startswith(SPAN):
-                receive_query_span(remove_prefix(message, SPAN))
-            elif message.startswith(LOGICAL):
-                presto_session.status.logical_json = json.loads(remove_prefix(message, LOGICAL))
-            elif message.startswith(FRAGMENTED):
-                presto_session.status.fragmented_json = json.loads(remove_prefix(message, FRAGMENTED))
+        if message[:len(JSON)] == JSON:
+            message = _strip(remove_prefix(message, JSON))
+            if message[:len(SPAN)] == SPAN:
+                self._receive_query_span(remove_prefix(message, SPAN))
+            elif message[:len(LOGICAL)] == LOGICAL:
+                self._receive_plan('logical_json', parse_json(remove_prefix(message, LOGICAL)))
+            elif message[:len(FRAGMENTED)] == FRAGMENTED:
+                self._receive_plan('fragmented_json', parse_json(remove_prefix(message, FRAGMENTED)))
             else:
-                execution_stats = json.loads(message)
-                presto_session.status.execution_stats = execution_stats
-                presto_session.status.recorded_stats[execution_stats['query_id']] = execution_stats
-        elif message.startswith(DOT):
+                execution_stats = parse_json(message)
+                with self.lock:
+                    callbacks, self.pending = self.pending, QueryCallbacks()
+                callbacks.execution_stats = execution_stats
+                future = self._future(execution_stats['query_id'])
+                if not future.done():
+                    future.set_result(callbacks)
+        elif message[:len(DOT)] == DOT:
             dot = remove_prefix(message, DOT)
-            if dot.startswith(LOGICAL):
-                presto_session.status.logical_dot = remove_prefix(dot, LOGICAL)
-            elif dot.startswith(FRAGMENTED):
-                presto_session.status.fragmented_dot = remove_prefix(dot, FRAGMENTED)
-        self.request.close()
+            if dot[:len(LOGICAL)] == LOGICAL:
+                self._receive_plan('logical_dot', str(remove_prefix(dot, LOGICAL), 'utf-8'))
+            elif dot[:len(FRAGMENTED)] == FRAGMENTED:
+                self._receive_plan('fragmented_dot', str(remove_prefix(dot, FRAGMENTED), 'utf-8'))
+
+    def _receive_plan(self, name, plan):
+        with self.lock:
+            if getattr(self.pending, name) is not None:
+                # the plans of two queries arrived before the execution stats of the first one, the session ran queries concurrently
+                bao_logging.warning('Received a second %s plan before the execution stats of the query, the plan of the previous query is dropped', name)
+            setattr(self.pending, name, plan)
+
+    def _receive_query_span(self, message):
+        if message[:len(EFFECTIVE)] == EFFECTIVE:
+            # fixme: query span also contains rule dependencies, fix parsing now
+            self.pending_span[EFFECTIVE] = parse_json(remove_prefix(message, EFFECTIVE))
+        else:
+            self.pending_span[REQUIRED] = parse_json(remove_prefix(message, REQUIRED))
+        if len(self.pending_span) == 2:
+            self.spans.put((self.pending_span[EFFECTIVE], self.pending_span[REQUIRED]))
+            self.pending_span = {}
+
+    def _future(self, query_id):
+        with self.lock:
+            future = self.queries.get(query_id)
+            if future is None:
+                future = self.queries[query_id] = concurrent.futures.Future()
+                while len(self.queries) > MAX_RETAINED_QUERIES:
+                    self.queries.popitem(last=False)
+            return future
+
+    def query_callbacks(self, query_id, timeout=CALLBACK_TIMEOUT_SECONDS) -> QueryCallbacks:
+        """Wait for the plans and execution stats of the query, they are removed from the server afterwards
+        :raises TimeoutError: presto did not send the execution stats of the query in time
+        """
+        try:
+            return self._future(query_id).result(timeout)
+        except concurrent.futures.TimeoutError as e:
+            # concurrent.futures.TimeoutError is an alias of the builtin TimeoutError only since python 3.11
+            raise TimeoutError(f'Presto did not send the execution stats of query {query_id} within {timeout}s') from e
+        finally:
+            with self.lock:
+                self.queries.pop(query_id, None)
+
+    def query_span(self, timeout=None):
+        """Wait for the next query span
+        :returns: effective and required optimizers
+        """
+        return self.spans.get(timeout=timeout)
+
+    def discard_pending(self):
+        """Drop the plans of a query that failed, they must not be attributed to the next query"""
+        with self.lock:
+            self.pending = QueryCallbacks()
+
+    def reset(self):
+        """Discard all received messages"""
+        with self.lock:
+            self.queries.clear()
+            self.pending = QueryCallbacks()
+        self.pending_span = {}
+        self.spans = queue.Queue()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class SessionProperties:
+    """Session properties of a presto connection that are maintained client-side instead of sending SET SESSION statements.
+    prestodb sends the properties of the connection (X-Presto-Session header) with every query, changes take effect with the next query
+    and setting a property to its current value does nothing. Property names are validated once per session using SHOW SESSION."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        # prestodb shares this dict with the requests of all cursors (and updates it for SET SESSION statements)
+        self.properties = connection.session_properties
+        self.supported = None
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return str(value)
+
+    def _is_supported(self, name):
+        if self.supported is None:
+            cursor = self.connection.cursor()
+            cursor.execute('SHOW SESSION')
+            self.supported = {row[0] for row in cursor.fetchall()}
+        return name in self.supported
+
+    def get(self, name):
+        return self.properties.get(name)
+
+    def set(self, name, value):
+        """Set the property for the following queries
+        :returns: whether the value changed
+        """
+        value = self._encode(value)
+        if self.properties.get(name) == value:
+            return False
+        if not self._is_supported(name):
+            # presto rejects every query of a session with an unknown property
+            bao_logging.warning('Presto does not support the session property %s, ignore it', name)
+            return False
+        self.properties[name] = value
+        return True
+
+    def update(self, properties):
+        """Set several properties, e.g. the properties of an optimizer config
+        :returns: whether any value changed
+        """
+        changed = [self.set(name, value) for name, value in properties.items()]
+        return any(changed)
+
+    def reset(self, name):
+        """Reset the property to the default value of presto"""
+        return self.properties.pop(name, None) is not None
 
 
 class PrestoSession:
-    """This class wraps a session to presto as well as a callback server communicating with presto"""
-
-    class Status:
-        """Store the information received from presto"""
-
-        def __init__(self):
-            self.effective_optimizers = None
-            self.required_optimizers = None
-            self.execution_stats = {}
-            self.logical_dot = None
-            self.fragmented_dot = None
-            self.logical_json = None
-            self.fragmented_json = None
-            self.allow_reuse_address = True
-            self.recorded_stats = {}
-
-    def __init__(self, catalog=None, schema=None, request_timeout=prestodb.constants.DEFAULT_REQUEST_TIMEOUT, execution_timeout='4m'):
+    """This class wraps a session to presto as well as a callback server receiving the messages presto sends for this session"""
+
+    def __init__(self, catalog=None, schema=None, request_timeout=prestodb.constants.DEFAULT_REQUEST_TIMEOUT, execution_timeout='4m',
+                 session_properties=None, host='localhost', port=8080, callback_host='localhost'):
+        # every session has its own callback port, presto sends the messages to the address of the session property bao_socket,
+        # i.e. the callback host has to be reachable from the coordinator if presto does not run on the driver's machine
+        self.callback_host = callback_host
+        self.callback_server = CallbackServer(callback_host)
+        self.execution_timeout = execution_timeout
+        properties = {QUERY_MAX_EXECUTION_TIME: execution_timeout, BAO_SOCKET: self.callback_server.address}
+        properties.update(session_properties or {})
         self.connection = prestodb.dbapi.connect(
-            host='localhost',
-            port=8080,
+            host=host,
+            port=port,
             user='admin',
             catalog=catalog,
             schema=schema,
             request_timeout=request_timeout,
-            session_properties={'query_max_execution_time': execution_timeout},
+            session_properties=properties,
         )
-        self.callback_server = socketserver.TCPServer(('localhost', 9999), PrestoCallbackHandler)
-        self.status = PrestoSession.Status()
-        self.callback_server.eprsdf = self
+        self.properties = SessionProperties(self.connection)
+        self.in_flight = threading.Lock()
+
+    @contextlib.contextmanager
+    def query(self):
+        """Scope of the queries of one thread, from executing a query until its callbacks are consumed
+        :raises RuntimeError: another thread runs a query on this session, its plans would be mixed up (see CallbackServer)
+        """
+        if not self.in_flight.acquire(blocking=False):
+            raise RuntimeError(f'Another query of the session with callback server {self.callback_server.address} is in flight, '
+                               'use one session per thread')
+        try:
+            yield self
+        finally:
+            self.in_flight.release()
 
     def get_connection(self):
         return self.connection
@@ -125,15 +335,22 @@ class PrestoSession:
         self.connection.schema = schema
 
     def restart_callback_server(self):
-        # close previous callback server, old messages/requests will be discarded
-        if self.callback_server is not None:
-            bao_logging.info('shutdown callback server to discard previous messages')
-            self.callback_server.server_close()
+        bao_logging.info('discard previous messages of the callback server at %s', self.callback_server.address)
+        self.callback_server.reset()
+
+    def close(self):
+        self.callback_server.close()
+        self.connection.close()
+
 
-        bao_logging.info('start callback server')
-        self.callback_server = socketserver.TCPServer(('localhost', 9999), PrestoCallbackHandler)
-        self.callback_server.session = self
-        self.status = PrestoSession.Status()
+_default_session = None
+_default_session_lock = threading.Lock()
 
 
-presto_session = PrestoSession()
+def get_default_session():
+    """:returns: session of the local presto cluster (localhost:8080), it is created (opening its callback server) on first use"""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = PrestoSession()
+        return _default_session
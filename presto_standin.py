@@ -0,0 +1,482 @@
+"""This module implements a stand-in for the modified presto coordinator, it allows to benchmark and test the driver without a presto cluster.
+
+The stand-in speaks the part of presto's HTTP client protocol that prestodb uses (POST /v1/statement, GET of the next uri, DELETE /v1/query),
+honors the bao session properties, and pushes the same length-prefixed callback messages to the session's bao_socket as presto does.
+Query spans, plans, and runtimes come from a synthetic model seeded by the query text, i.e. they are deterministic per query and optimizer
+config (up to the runtime noise). All latencies are scaled by time_scale, e.g. 0.01 runs a plan of 5s model runtime in 50ms.
+
+    python3 presto_standin.py --port 8080 --time_scale 0.01
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from custom_logging import bao_logging
+from presto_connector import DOT, EFFECTIVE, FRAGMENTED, FRAME_HEADER, JSON, LOGICAL, REQUIRED, SPAN, duration_seconds
+from presto_query_plan.operators import AGGREGATE_FINAL, AGGREGATE_PARTIAL, INNER_JOIN, OUTPUT, REMOTE_EXCHANGE, SCAN_FILTER_PROJECT
+from presto_query_plan.plan_fields import CHILDREN, ESTIMATES, NODE_TYPE, TABLE_NAME
+from presto_query_plan.stats import CPU_COST, NETWORK_COST, ROWS
+from session_properties import BAO_DISABLED_OPTIMIZERS, BAO_EXECUTE_QUERY, BAO_EXPORT_GRAPHVIZ, BAO_EXPORT_JSON, BAO_EXPORT_TIMES, \
+    BAO_GET_QUERY_SPAN, BAO_SOCKET, QUERY_MAX_EXECUTION_TIME
+
+KNOBS_FILE = 'knobs/presto.txt'
+# session properties listed by SHOW SESSION, the driver ignores (and does not send) properties that are not listed
+SESSION_PROPERTIES = {BAO_DISABLED_OPTIMIZERS: '', BAO_EXECUTE_QUERY: 'true', BAO_EXPORT_JSON: 'false', BAO_EXPORT_GRAPHVIZ: 'false',
+                      BAO_EXPORT_TIMES: 'false', BAO_GET_QUERY_SPAN: 'false', BAO_SOCKET: '', QUERY_MAX_EXECUTION_TIME: '100d',
+                      'bao': 'false', 'query_span_iterative': 'true'}
+PAGE_ROWS = 1000
+
+
+def _unit(*parts):
+    """:returns: stable pseudo-random number in [0, 1) derived from the parts (independent of PYTHONHASHSEED)"""
+    digest = hashlib.blake2b('\x1f'.join(map(str, parts)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+
+def _tables(query_string):
+    """:returns: names of the tables the query reads, taken from its FROM and JOIN clauses"""
+    tables = []
+    match = re.search(r'\bFROM\b(.*?)(\bWHERE\b|\bGROUP\b|\bORDER\b|$)', query_string, re.IGNORECASE | re.DOTALL)
+    if match is not None:
+        for item in re.split(r',|\bJOIN\b', match.group(1), flags=re.IGNORECASE):
+            name = re.match(r'\s*(?:(?:LEFT|RIGHT|INNER|OUTER|CROSS)\s+)*([A-Za-z_][\w.]*)', item, re.IGNORECASE)
+            if name is not None and name.group(1).upper() not in ('SELECT', 'ON'):
+                tables.append(name.group(1))
+    return tables or ['t0']
+
+
+class PlanningError(Exception):
+    """Presto cannot plan the query without the disabled optimizer (a required optimizer)"""
+
+
+class SyntheticModel:
+    """Query spans, plans, and runtimes of queries, every random choice is seeded by the query text (and the optimizer config)
+    :param effective_ratio: fraction of the knobs that change the plan of a query when they are disabled
+    :param required_ratio: fraction of the knobs that cannot be disabled
+    :param dependency_ratio: fraction of the effective optimizers that only change the plan if another effective optimizer is disabled as well
+    :param runtime_ms: range of the runtimes of the default plans (log-uniform)
+    :param noise: standard deviation of the log-normal runtime noise of a run
+    """
+
+    def __init__(self, knobs, effective_ratio=0.05, required_ratio=0.01, dependency_ratio=0.25, runtime_ms=(200, 5000), noise=0.05,
+                 planning_ms=20, span_ms=500, result_rows=100, nodes=4, seed=0):
+        self.knobs = list(knobs)
+        self.effective_ratio = effective_ratio
+        self.required_ratio = required_ratio
+        self.dependency_ratio = dependency_ratio
+        self.runtime_ms = runtime_ms
+        self.noise = noise
+        self.planning_ms = planning_ms
+        self.span_ms = span_ms
+        self.result_rows = result_rows
+        self.nodes = nodes
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_knobs_file(cls, path=KNOBS_FILE, **kwargs):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls([line.strip() for line in f if len(line.strip()) > 0], **kwargs)
+
+    def query_span(self, query_string):
+        """:returns: effective optimizers (dicts of name and dependencies) and required optimizers (dicts of name)"""
+        effective = [knob for knob in self.knobs if _unit(self.seed, query_string, 'effective', knob) < self.effective_ratio]
+        required = [knob for knob in self.knobs if knob not in effective and _unit(self.seed, query_string, 'required', knob) < self.required_ratio]
+        effective_optimizers = []
+        for knob in effective:
+            others = [other for other in effective if other != knob]
+            dependencies = []
+            if len(others) > 0 and _unit(self.seed, query_string, 'dependency', knob) < self.dependency_ratio:
+                dependencies = [others[int(_unit(self.seed, query_string, 'dependent', knob) * len(others))]]
+            effective_optimizers.append({'name': knob, 'dependencies': dependencies})
+        return effective_optimizers, [{'name': knob} for knob in required]
+
+    def _active(self, query_string, disabled):
+        """:returns: disabled optimizers that change the plan, an alternative optimizer needs its dependencies to be disabled as well"""
+        effective, required = self.query_span(query_string)
+        blocking = [optimizer['name'] for optimizer in required if optimizer['name'] in disabled]
+        if len(blocking) > 0:
+            raise PlanningError(f'The optimizer {blocking[0]} cannot be disabled')
+        return sorted(optimizer['name'] for optimizer in effective
+                      if optimizer['name'] in disabled and set(optimizer['dependencies']).issubset(disabled))
+
+    def plan(self, query_string, disabled):
+        """:returns: plan hash (32 bit like presto's), logical plan, fragmented plan, and the model runtime of the plan in ms
+        :raises PlanningError: if a required optimizer is disabled
+        """
+        active = self._active(query_string, disabled)
+        plan_hash = int(_unit(self.seed, query_string, *active) * 2 ** 32) - 2 ** 31
+        low, high = self.runtime_ms
+        runtime = math.exp(math.log(low) + _unit(self.seed, query_string, 'runtime') * (math.log(high) - math.log(low)))
+        for optimizer in active:
+            # disabling an optimizer slows most plans down, but some plans get faster
+            runtime *= 0.6 + 1.2 * _unit(self.seed, query_string, 'factor', optimizer)
+
+        tables = _tables(query_string)
+        order = sorted(tables, key=lambda table: _unit(plan_hash, table))
+        node = self._scan(order[0], query_string)
+        for table in order[1:]:
+            rows = node[ESTIMATES][0][ROWS] * (0.1 + _unit(plan_hash, 'selectivity', table))
+            node = {NODE_TYPE: INNER_JOIN, CHILDREN: [node, self._scan(table, query_string)],
+                    ESTIMATES: [{ROWS: rows, CPU_COST: rows * 8, NETWORK_COST: rows * 4}]}
+        rows = node[ESTIMATES][0][ROWS]
+        for name in [REMOTE_EXCHANGE, AGGREGATE_PARTIAL, REMOTE_EXCHANGE, AGGREGATE_FINAL, OUTPUT]:
+            node = {NODE_TYPE: name, CHILDREN: [node], ESTIMATES: [{ROWS: rows, CPU_COST: rows, NETWORK_COST: 0.0}]}
+            rows = 1.0
+        fragments = {'fragments': [{'id': str(i), 'root': fragment} for i, fragment in enumerate(_fragments(node))]}
+        return plan_hash, node, fragments, runtime
+
+    @staticmethod
+    def _scan(table, query_string):
+        rows = 10 ** (3 + 4 * _unit(query_string, 'rows', table))
+        return {NODE_TYPE: SCAN_FILTER_PROJECT, TABLE_NAME: table, ESTIMATES: [{ROWS: rows, CPU_COST: rows * 2, NETWORK_COST: 0.0}]}
+
+    def run_runtime(self, runtime):
+        """:returns: runtime of one run of the plan, the model runtime with log-normal noise"""
+        with self.lock:
+            return runtime * self.random.lognormvariate(0, self.noise)
+
+    def result(self, query_string):
+        """:returns: rows of the query result, they do not depend on the optimizer config"""
+        key = int(_unit(self.seed, query_string, 'result') * 1e9)
+        return [[i, key + i, f'row-{key}-{i}'] for i in range(self.result_rows)]
+
+
+def _fragments(root):
+    """Split the plan into fragments at its remote exchanges (the exchange belongs to the upper fragment)"""
+    fragments = [root]
+    stack = [root]
+    while len(stack) > 0:
+        node = stack.pop()
+        for child in node.get(CHILDREN, []):
+            if node[NODE_TYPE] == REMOTE_EXCHANGE:
+                fragments.append(child)
+            stack.append(child)
+    return fragments
+
+
+def _dot(name, plan):
+    lines = [f'digraph {name}_plan {{']
+    ids = itertools.count()
+
+    def _node(node):
+        node_id = next(ids)
+        lines.append(f'  n{node_id} [label="{node[NODE_TYPE]}{" " + node[TABLE_NAME] if TABLE_NAME in node else ""}"];')
+        for child in node.get(CHILDREN, []):
+            lines.append(f'  n{node_id} -> n{_node(child)};')
+        return node_id
+
+    _node(plan)
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+class CallbackClient:
+    """Send length-prefixed messages to the bao_socket of a session, one connection per socket address"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.messages = 0
+        self.bytes = 0
+
+    def send(self, address, *messages):
+        """Send the messages in this order, messages of concurrent queries of the same session are not interleaved"""
+        if not address:
+            return
+        frames = b''.join(FRAME_HEADER.pack(len(message)) + message for message in messages)
+        with self.lock:
+            connection = self.connections.get(address)
+            for attempt in range(2):
+                try:
+                    if connection is None:
+                        host, port = address.rsplit(':', 1)
+                        connection = self.connections[address] = socket.create_connection((host, int(port)))
+                    connection.sendall(frames)
+                    break
+                except OSError as e:
+                    # the session restarted its callback server (or closed it), reconnect once
+                    self.connections.pop(address, None)
+                    connection = None
+                    if attempt == 1:
+                        bao_logging.warning('Could not send callbacks to %s: %s', address, e)
+                        return
+            self.messages += len(messages)
+            self.bytes += len(frames)
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections.values():
+                connection.close()
+            self.connections = {}
+
+
+class StandinQuery:
+    """A query of the stand-in, its result pages are fetched by the client one after another"""
+
+    def __init__(self, query_id, rows, runtime_ms=0.0, deadline=None, stats=None, socket_address=None, columns=None, execute=False):
+        self.query_id = query_id
+        self.rows = rows
+        self.runtime_ms = runtime_ms
+        self.deadline = deadline
+        self.stats = stats
+        self.socket_address = socket_address
+        self.columns = columns or [{'name': f'c{i}', 'type': 'varchar'} for i in range(len(rows[0]) if len(rows) > 0 else 1)]
+        # queries that execute on the first fetch, all other results are returned with the response of the statement
+        self.execute = execute
+        self.executed = False
+
+
+class StandinCoordinator:
+    """Plans and runs the queries of the stand-in using the synthetic model, it is shared by all HTTP handler threads"""
+
+    def __init__(self, model, time_scale=1.0, page_rows=PAGE_ROWS):
+        self.model = model
+        self.time_scale = time_scale
+        self.page_rows = page_rows
+        self.callbacks = CallbackClient()
+        self.queries = {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.counts = {'planned': 0, 'executed': 0, 'spans': 0, 'failed': 0, 'timeouts': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def _sleep(self, milliseconds):
+        if milliseconds > 0 and self.time_scale > 0:
+            time.sleep(milliseconds / 1000 * self.time_scale)
+
+    def new_query_id(self):
+        return f'{datetime.now():%Y%m%d_%H%M%S}_{next(self.counter):05d}_standin'
+
+    def submit(self, statement, properties):
+        """Plan the statement, execution starts with the first fetch
+        :returns: the query
+        :raises PlanningError: if a required optimizer is disabled
+        """
+        query_id = self.new_query_id()
+        statement = statement.strip()
+        socket_address = properties.get(BAO_SOCKET)
+        if re.match(r'SHOW\s+SESSION', statement, re.IGNORECASE):
+            rows = [[name, properties.get(name, default), default, 'varchar', 'stand-in property'] for name, default in SESSION_PROPERTIES.items()]
+            return StandinQuery(query_id, rows)
+
+        explain = re.match(r'EXPLAIN\s*(\([^)]*\))?', statement, re.IGNORECASE)
+        query_string = statement[explain.end():].strip() if explain else statement
+        disabled = {name.strip() for name in properties.get(BAO_DISABLED_OPTIMIZERS, '').split(',') if len(name.strip()) > 0}
+        self._sleep(self.model.planning_ms)
+        try:
+            plan_hash, logical, fragmented, runtime = self.model.plan(query_string, disabled)
+        except PlanningError:
+            self._count('failed')
+            raise
+        self._count('planned')
+        if explain:
+            return StandinQuery(query_id, [[json.dumps(logical)]])
+
+        if properties.get(BAO_GET_QUERY_SPAN) == 'true':
+            self._sleep(self.model.span_ms)
+            effective, required = self.model.query_span(query_string)
+            self.callbacks.send(socket_address, JSON + SPAN + EFFECTIVE + json.dumps(effective).encode(),
+                                JSON + SPAN + REQUIRED + json.dumps(required).encode())
+            self._count('spans')
+            return StandinQuery(query_id, [[len(effective), len(required)]])
+
+        messages = []
+        if properties.get(BAO_EXPORT_JSON) == 'true':
+            messages += [JSON + LOGICAL + json.dumps(logical).encode(), JSON + FRAGMENTED + json.dumps(fragmented).encode()]
+        if properties.get(BAO_EXPORT_GRAPHVIZ) == 'true':
+            messages += [DOT + LOGICAL + _dot('logical', logical).encode(), DOT + FRAGMENTED + _dot('fragmented', fragmented['fragments'][0]['root']).encode()]
+        self.callbacks.send(socket_address, *messages)
+
+        stats = None
+        if properties.get(BAO_EXPORT_TIMES) == 'true':
+            stats = {'query_id': query_id, 'plan_hash': plan_hash, 'planning': round(self.model.planning_ms)}
+        if properties.get(BAO_EXECUTE_QUERY) == 'false':
+            # optimize only: presto sends the plans and the plan hash but does not execute the query
+            if stats is not None:
+                self.callbacks.send(socket_address, JSON + json.dumps({**stats, 'elapsed': round(self.model.planning_ms), 'scheduling': 0, 'running': 0,
+                                                                       'finishing': 0, 'cpu': 0, 'input_data_size': 0}).encode())
+            return StandinQuery(query_id, [])
+
+        deadline = duration_seconds(properties[QUERY_MAX_EXECUTION_TIME]) * 1000 if QUERY_MAX_EXECUTION_TIME in properties else None
+        query = StandinQuery(query_id, self.model.result(query_string), self.model.run_runtime(runtime), deadline, stats, socket_address, execute=True)
+        with self.lock:
+            self.queries[query_id] = query
+        return query
+
+    def fetch(self, query_id, token):
+        """:returns: rows of the page and whether there are more pages
+        :raises TimeoutError: if the run exceeds query_max_execution_time
+        """
+        with self.lock:
+            query = self.queries[query_id]
+        if not query.executed:
+            query.executed = True
+            if query.deadline is not None and query.runtime_ms > query.deadline:
+                self._sleep(query.deadline)
+                self.cancel(query_id)
+                self._count('timeouts')
+                raise TimeoutError(f'Query exceeded maximum time limit of {query.deadline / 1000:.2f}s')
+            self._sleep(query.runtime_ms)
+            self._count('executed')
+        page = query.rows[token * self.page_rows:(token + 1) * self.page_rows]
+        has_next = (token + 1) * self.page_rows < len(query.rows)
+        if not has_next:
+            self.cancel(query_id)
+            if query.stats is not None:
+                # presto reports durations in whole milliseconds
+                running = round(query.runtime_ms)
+                self.callbacks.send(query.socket_address, JSON + json.dumps({
+                    **query.stats, 'elapsed': round(self.model.planning_ms) + running + 2, 'scheduling': 1, 'running': running, 'finishing': 1,
+                    'cpu': round(running * self.model.nodes * 0.8), 'input_data_size': int(_unit(query_id, 'input') * 2 ** 30)}).encode())
+        return page, has_next
+
+    def cancel(self, query_id):
+        with self.lock:
+            self.queries.pop(query_id, None)
+
+    def close(self):
+        self.callbacks.close()
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """HTTP endpoints of the presto client protocol"""
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, nagle's algorithm would delay every response of the kept-alive connection
+    disable_nagle_algorithm = True
+    coordinator = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        bao_logging.debug('stand-in: ' + format, *args)
+
+    def _properties(self):
+        header = self.headers.get('X-Presto-Session', '')
+        pairs = [pair.split('=', 1) for pair in header.split(',') if '=' in pair]
+        return {name.strip(): unquote(value.strip()) for name, value in pairs}
+
+    def _send(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _response(self, query_id, rows=None, columns=None, next_token=None, error=None):
+        base = f'http://{self.headers.get("Host", "localhost")}'
+        body = {'id': query_id, 'infoUri': f'{base}/ui/query.html?{query_id}',
+                'stats': {'state': 'FAILED' if error else ('RUNNING' if next_token is not None else 'FINISHED'), 'nodes': self.coordinator.model.nodes}}
+        if next_token is not None:
+            body['nextUri'] = f'{base}/v1/statement/{query_id}/{next_token}'
+        if columns is not None:
+            body['columns'] = columns
+        if rows:
+            body['data'] = rows
+        if error is not None:
+            body['error'] = error
+        self._send(body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        if self.path != '/v1/statement':
+            self._send({'message': f'unknown resource {self.path}'}, 404)
+            return
+        statement = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        try:
+            query = self.coordinator.submit(statement, self._properties())
+        except PlanningError as e:
+            self._response(self.coordinator.new_query_id(), error={'message': str(e), 'errorCode': 0, 'errorName': 'GENERIC_USER_ERROR',
+                                                                'errorType': 'USER_ERROR'})
+            return
+        if query.execute:
+            self._response(query.query_id, columns=query.columns, next_token=0)
+        else:
+            self._response(query.query_id, rows=query.rows, columns=query.columns)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        match = re.match(r'/v1/statement/([^/]+)/(\d+)$', self.path)
+        if match is None:
+            self._send({'message': f'unknown resource {self.path}'}, 404)
+            return
+        query_id, token = match.group(1), int(match.group(2))
+        try:
+            rows, has_next = self.coordinator.fetch(query_id, token)
+        except KeyError:
+            self._send({'message': f'unknown query {query_id}'}, 404)
+            return
+        except TimeoutError as e:
+            self._response(query_id, error={'message': str(e), 'errorCode': 131075, 'errorName': 'EXCEEDED_TIME_LIMIT',
+                                            'errorType': 'INSUFFICIENT_RESOURCES'})
+            return
+        self._response(query_id, rows=rows, next_token=token + 1 if has_next else None)
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self.coordinator.cancel(self.path.rsplit('/', 1)[-1])
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class StandinServer:
+    """HTTP server of the stand-in, it serves requests in a background thread (port 0 chooses a free port)"""
+
+    def __init__(self, coordinator, host='localhost', port=0):
+        self.coordinator = coordinator
+        handler = type('BoundStandinHandler', (StandinHandler,), {'coordinator': coordinator})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f'presto-standin-{self.port}', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.coordinator.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Presto stand-in serving synthetic plans and runtimes to the driver')
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--time_scale', help='scale all latencies (planning, span, execution) by this factor', type=float, default=1.0)
+    parser.add_argument('--planning_ms', help='planning latency per query', type=float, default=20)
+    parser.add_argument('--span_ms', help='latency of a query span approximation', type=float, default=500)
+    parser.add_argument('--min_runtime_ms', help='minimum runtime of default plans', type=float, default=200)
+    parser.add_argument('--max_runtime_ms', help='maximum runtime of default plans', type=float, default=5000)
+    parser.add_argument('--noise', help='standard deviation of the log-normal runtime noise', type=float, default=0.05)
+    parser.add_argument('--effective_ratio', help='fraction of the optimizers that change the plan of a query', type=float, default=0.05)
+    parser.add_argument('--required_ratio', help='fraction of the optimizers that cannot be disabled', type=float, default=0.01)
+    parser.add_argument('--result_rows', help='number of result rows per query', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def create_coordinator(args):
+    model = SyntheticModel.from_knobs_file(effective_ratio=args.effective_ratio, required_ratio=args.required_ratio,
+                                           runtime_ms=(args.min_runtime_ms, args.max_runtime_ms), noise=args.noise, planning_ms=args.planning_ms,
+                                           span_ms=args.span_ms, result_rows=args.result_rows, seed=args.seed)
+    return StandinCoordinator(model, time_scale=args.time_scale)
+
+
+if __name__ == '__main__':
+    ARGS = get_parser().parse_args()
+    SERVER = StandinServer(create_coordinator(ARGS), ARGS.host, ARGS.port)
+    bao_logging.info('presto stand-in listening on %s:%s', SERVER.host, SERVER.port)
+    try:
+        SERVER.thread.join()
+    except KeyboardInterrupt:
+        SERVER.close()
@@ -0,0 +1,117 @@
+"""This module decides how often the plan of an optimizer config is executed.
+
+The fixed mode repeats every plan settings.REPEATS times. The adaptive mode discards warm-up runs and repeats the plan until the
+confidence interval of the median runtime is narrow enough, the plan is significantly slower than the default plan, or MAX_REPEATS is reached.
+"""
+import math
+import statistics
+
+# stop reasons stored with the measurements
+REPEATS = 'repeats'
+CONVERGED = 'converged'
+WORSE_THAN_BASELINE = 'worse_than_baseline'
+MAX_RUNS = 'max_runs'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+
+CONFIDENCE = 0.95
+# significance level of the sign test against the median runtime of the default config
+ALPHA = 0.05
+TARGET_RELATIVE_WIDTH = 0.05
+MIN_RUNS = 3
+MAX_RUNS_DEFAULT = 20
+# a leading run is a warm-up run if it is this much slower than the median of the following runs
+WARMUP_TOLERANCE = 0.2
+MAX_WARMUP_RUNS = 2
+
+
+def _binomial_cdf(k, n):
+    """P(X <= k) for X ~ Binomial(n, 0.5)"""
+    return sum(math.comb(n, i) for i in range(k + 1)) / 2 ** n
+
+
+def median_confidence_interval(values, confidence=CONFIDENCE):
+    """Distribution-free confidence interval of the median, its bounds are order statistics of the values
+    :returns: lower and upper bound, None if there are too few values for the requested confidence
+    """
+    values = sorted(values)
+    n = len(values)
+    # [x_(k), x_(n-k+1)] covers the median with probability 1 - 2 * P(X <= k - 1), choose the narrowest interval
+    for k in range(n // 2, 0, -1):
+        if 1 - 2 * _binomial_cdf(k - 1, n) >= confidence:
+            return values[k - 1], values[n - k]
+    return None
+
+
+def sign_test_greater(values, median, alpha=ALPHA):
+    """One-sided sign test
+    :returns: whether the median of the values is significantly greater than the given median
+    """
+    values = [value for value in values if value != median]
+    greater = sum(value > median for value in values)
+    # probability to observe at least this many greater values if both medians were equal
+    p_value = 1 - _binomial_cdf(greater - 1, len(values)) if greater > 0 else 1.0
+    return p_value < alpha
+
+
+class FixedRepetition:
+    """Run the plan a fixed number of times"""
+
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.runtimes = []
+
+    def add(self, runtime):
+        self.runtimes.append(runtime)
+
+    def warmup_runs(self):
+        return 0
+
+    def stop_reason(self):
+        return REPEATS if len(self.runtimes) >= self.repeats else None
+
+
+class AdaptiveRepetition:
+    """Repeat the plan until its median runtime is known precisely enough or it is significantly slower than the baseline
+    :param baseline: runtimes of the default config, None if they are not known (yet)
+    """
+
+    def __init__(self, baseline=None, max_runs=MAX_RUNS_DEFAULT, target_width=TARGET_RELATIVE_WIDTH, confidence=CONFIDENCE, min_runs=MIN_RUNS):
+        self.baseline_median = statistics.median(baseline) if baseline else None
+        self.max_runs = max_runs
+        self.target_width = target_width
+        self.confidence = confidence
+        self.min_runs = min_runs
+        self.runtimes = []
+
+    def add(self, runtime):
+        self.runtimes.append(runtime)
+
+    def warmup_runs(self):
+        """:returns: number of leading runs that are much slower than the runs following them (e.g. cold caches, jit compilation)"""
+        warmup = 0
+        while warmup < MAX_WARMUP_RUNS and len(self.runtimes) - warmup - 1 >= self.min_runs:
+            if self.runtimes[warmup] <= (1 + WARMUP_TOLERANCE) * statistics.median(self.runtimes[warmup + 1:]):
+                break
+            warmup += 1
+        return warmup
+
+    def steady_runtimes(self):
+        return self.runtimes[self.warmup_runs():]
+
+    def stop_reason(self):
+        """:returns: why the repetition stops, None if the plan has to be executed again"""
+        if len(self.runtimes) >= self.max_runs:
+            return MAX_RUNS
+        runtimes = self.steady_runtimes()
+        if len(runtimes) < self.min_runs:
+            return None
+        if self.baseline_median is not None and sign_test_greater(runtimes, self.baseline_median):
+            return WORSE_THAN_BASELINE
+        interval = median_confidence_interval(runtimes, self.confidence)
+        if interval is None:
+            return None
+        median = statistics.median(runtimes)
+        if interval[1] - interval[0] <= self.target_width * median:
+            return CONVERGED
+        return None
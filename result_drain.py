@@ -0,0 +1,88 @@
+"""This module drains query results in a background thread, presto's finishing phase waits until the client fetched all result pages.
+
+The fetch thread pulls the result as fast as possible and hands batches of rows to the consumer (e.g. the result fingerprint) on the
+calling thread, i.e. hashing or discarding rows does not slow down fetching and does not inflate the measured runtime of a plan.
+"""
+import queue
+import threading
+import time
+
+# rows handed over to the consumer at once
+BATCH_ROWS = 4096
+# batches buffered between fetch thread and consumer, the fetch thread waits if the consumer falls behind
+MAX_BUFFERED_BATCHES = 256
+
+
+class DrainStats:
+    """Client-side fetch throughput of one run
+    :param first_row_seconds: time until presto returned the first row, i.e. mostly execution time of the query
+    :param fetch_seconds: time from the first to the last row, i.e. fetching and decoding the result pages
+    """
+
+    def __init__(self, num_rows, fetch_seconds, consume_seconds, first_row_seconds=0.0):
+        self.num_rows = num_rows
+        self.fetch_seconds = fetch_seconds
+        self.consume_seconds = consume_seconds
+        self.first_row_seconds = first_row_seconds
+
+    @property
+    def rows_per_second(self):
+        return self.num_rows / self.fetch_seconds if self.fetch_seconds > 0 else float('inf')
+
+    def __repr__(self):
+        return (f'DrainStats(rows={self.num_rows}, first row={self.first_row_seconds:.3f}s, fetch={self.fetch_seconds:.3f}s, '
+                f'{self.rows_per_second:.0f} rows/s, consume={self.consume_seconds:.3f}s)')
+
+
+def _fetch(rows, batches, stats):
+    """Fetch thread: put batches of rows and finally None (or the exception raised while fetching) into the queue.
+    The client polls presto until the first page of rows arrives, the fetch time starts with the first row to exclude the execution."""
+    start = time.perf_counter()
+    first_row = None
+    try:
+        batch = []
+        for row in rows:
+            if first_row is None:
+                first_row = time.perf_counter()
+            batch.append(row)
+            if len(batch) == BATCH_ROWS:
+                batches.put(batch)
+                batch = []
+        if len(batch) > 0:
+            batches.put(batch)
+        batches.put(None)
+    except Exception as e:  # pylint: disable=broad-except
+        batches.put(e)
+    finally:
+        end = time.perf_counter()
+        first_row = end if first_row is None else first_row
+        stats['first_row_seconds'] = first_row - start
+        stats['fetch_seconds'] = end - first_row
+
+
+def drain(cursor, consume=None):
+    """Fetch all result rows of the executed query
+    :param consume: called with every batch of rows on the calling thread, rows are discarded if it is None
+    :returns: DrainStats of the run
+    :raises: errors of presto that occur while fetching (e.g. exceeded time limits)
+    """
+    batches = queue.Queue(maxsize=MAX_BUFFERED_BATCHES)
+    stats = {}
+    fetcher = threading.Thread(target=_fetch, args=(cursor.genall(), batches, stats), name='result-drain', daemon=True)
+    fetcher.start()
+    num_rows = 0
+    consume_seconds = 0.0
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        if isinstance(batch, Exception):
+            fetcher.join()
+            raise batch
+        num_rows += len(batch)
+        if consume is not None:
+            start = time.perf_counter()
+            consume(batch)
+            consume_seconds += time.perf_counter() - start
+    fetcher.join()
+    return DrainStats(num_rows, stats['fetch_seconds'], consume_seconds, stats['first_row_seconds'])
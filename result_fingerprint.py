@@ -0,0 +1,51 @@
+"""This module computes result fingerprints to assert that all optimizer configs of a query return (probably) identical results.
+
+Rows are hashed one by one while they are fetched and the row hashes are summed up, i.e. the fingerprint does not depend on the
+order of the rows and needs constant memory. Huge results can be sampled: only rows whose content hash is divisible by the sample rate
+are hashed, the sample is the same for every config as it does not depend on the row order either.
+
+Layout of a fingerprint: version (1 byte), sample rate (4 bytes), number of rows (8 bytes), sum of the row hashes (16 bytes)
+"""
+import hashlib
+import struct
+import zlib
+
+FINGERPRINT_VERSION = 2
+HEADER = struct.Struct('>BI')
+ROW_COUNT = struct.Struct('>Q')
+HASH_BYTES = 16
+HASH_MODULUS = 2 ** (8 * HASH_BYTES)
+
+
+def _normalize(item):
+    """Its important to round floats here, e.g. using 2 decimal places (+ 0.0 turns -0.0 into 0.0)"""
+    return round(item, 2) + 0.0 if isinstance(item, float) else item
+
+
+class ResultFingerprint:
+    """Order-insensitive fingerprint of a query result, add the rows while they are fetched"""
+
+    def __init__(self, sample_rate=1):
+        self.sample_rate = sample_rate
+        self.num_rows = 0
+        self.hash_sum = 0
+
+    def add(self, row):
+        self.num_rows += 1
+        data = repr(tuple(map(_normalize, row))).encode()
+        if self.sample_rate > 1 and zlib.crc32(data) % self.sample_rate != 0:
+            return
+        self.hash_sum = (self.hash_sum + int.from_bytes(hashlib.blake2b(data, digest_size=HASH_BYTES).digest(), 'big')) % HASH_MODULUS
+
+    def add_all(self, rows):
+        for row in rows:
+            self.add(row)
+        return self
+
+    def digest(self):
+        return HEADER.pack(FINGERPRINT_VERSION, self.sample_rate) + ROW_COUNT.pack(self.num_rows) + self.hash_sum.to_bytes(HASH_BYTES, 'big')
+
+
+def comparable(fingerprint, other):
+    """Fingerprints of different versions (e.g. md5 hashes of previous versions) or sample rates cannot be compared"""
+    return len(fingerprint) == len(other) and fingerprint[:HEADER.size] == other[:HEADER.size]
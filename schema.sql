@@ -81,3 +81,83 @@ CREATE TABLE IF NOT EXISTS measurements
     nodes                     INTEGER
 );
 --------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS schema_version
+(
+    version INTEGER PRIMARY KEY
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS plan_blobs
+(
+    digest BYTEA PRIMARY KEY, -- sha256 of the uncompressed plan
+    codec  TEXT,              -- compression of the plan (zstd or zlib)
+    plan   BYTEA
+);
+--------------------------------------------------------------------------------
+-- each distinct plan is stored once in plan_blobs, the inline plan columns are only set for configs of older versions
+ALTER TABLE query_optimizer_configs ADD COLUMN IF NOT EXISTS logical_plan_dot_digest BYTEA REFERENCES plan_blobs;
+ALTER TABLE query_optimizer_configs ADD COLUMN IF NOT EXISTS fragmented_plan_dot_digest BYTEA REFERENCES plan_blobs;
+ALTER TABLE query_optimizer_configs ADD COLUMN IF NOT EXISTS logical_plan_json_digest BYTEA REFERENCES plan_blobs;
+ALTER TABLE query_optimizer_configs ADD COLUMN IF NOT EXISTS fragmented_plan_json_digest BYTEA REFERENCES plan_blobs;
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS config_runtime_stats
+(
+    query_optimizer_config_id INTEGER PRIMARY KEY REFERENCES query_optimizer_configs,
+    num_measurements          INTEGER,
+    runtimes                  TEXT, -- sorted json list of the runtimes (running + finishing), a uniform sample of at most storage.MAX_RUNTIME_SAMPLES runtimes
+    cpu_times                 TEXT, -- sorted json list of the cpu times (sampled as the runtimes)
+    runtime_median            DECIMAL,
+    runtime_mean              DECIMAL,
+    runtime_min               INTEGER,
+    runtime_max               INTEGER,
+    cpu_time_median           DECIMAL
+);
+--------------------------------------------------------------------------------
+-- increasing measurement ids allow incremental snapshots of the experience (see snapshot.py), existing rows are numbered on upgrade
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+CREATE INDEX IF NOT EXISTS measurements_id_idx ON measurements (id);
+--------------------------------------------------------------------------------
+-- benchmark of the query (see storage.query_benchmark), the analytical queries filter on it instead of matching the query path
+ALTER TABLE queries ADD COLUMN IF NOT EXISTS benchmark TEXT;
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS benchmark TEXT;
+-- storage.migrate_benchmarks moves the measurements into a table partitioned by benchmark (one partition per benchmark and a default one)
+-- indexes of the hot lookups (see storage.check_index_usage), query_path and (query_id, disabled_rules) are indexed by their unique constraints
+CREATE INDEX IF NOT EXISTS queries_benchmark_idx ON queries (benchmark);
+CREATE INDEX IF NOT EXISTS query_optimizer_configs_hash_idx ON query_optimizer_configs (query_id, hash);
+CREATE INDEX IF NOT EXISTS measurements_config_idx ON measurements (query_optimizer_config_id);
+--------------------------------------------------------------------------------
+-- the adaptive repetition (see repetition.py) flags warm-up runs, they are not part of the runtime statistics
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS warmup BOOLEAN DEFAULT FALSE;
+-- why the runs of the config stopped (e.g. converged, worse_than_baseline, max_runs)
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS stop_reason TEXT;
+-- runs killed by the deadline of the config (see benchmark.execution_deadline), their runtime is the deadline (a lower bound)
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS censored BOOLEAN DEFAULT FALSE;
+-- client-side fetch throughput of the run (see result_drain.py): number of result rows and time to fetch them
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS fetch_rows BIGINT;
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS fetch_seconds DOUBLE PRECISION;
+--------------------------------------------------------------------------------
+-- checkpoint of the DP exploration of a query (see OptimizerConfig.checkpoint), a restarted driver resumes from it
+CREATE TABLE IF NOT EXISTS exploration_state
+(
+    query_id            INTEGER PRIMARY KEY REFERENCES queries,
+    stage               INTEGER, -- number of the next DP stage (OptimizerConfig.n)
+    configs             TEXT,    -- json list of the configs of the current stage
+    blacklisted_configs TEXT,    -- json list of configs that are worse than the baseline
+    finished            BOOLEAN DEFAULT FALSE,
+    updated             TIMESTAMP
+);
+--------------------------------------------------------------------------------
+-- work queue of distributed drivers (see work_queue.py), each driver claims queries with a lease and renews it by heartbeats
+CREATE TABLE IF NOT EXISTS work_items
+(
+    id            SERIAL PRIMARY KEY,
+    query_path    varchar(256),
+    mode          TEXT,                    -- record_time or query_span
+    status        TEXT DEFAULT 'pending',  -- pending, running, done, failed
+    worker        TEXT,                    -- driver holding the lease
+    lease_expires TIMESTAMP,
+    attempts      INTEGER DEFAULT 0,
+    updated       TIMESTAMP,
+    UNIQUE (query_path, mode)
+);
+CREATE INDEX IF NOT EXISTS work_items_status_idx ON work_items (mode, status, id);
+--------------------------------------------------------------------------------
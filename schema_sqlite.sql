@@ -0,0 +1,136 @@
+-- sqlite version of schema.sql, the median() aggregate is registered by storage_backends.SQLiteBackend
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS queries
+(
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_path         varchar(256) UNIQUE,
+    result_fingerprint BLOB
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS query_required_optimizers
+(
+    query_id     INTEGER REFERENCES queries,
+    optimizer TEXT,
+    PRIMARY KEY (query_id, optimizer)
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS query_effective_optimizers
+(
+    query_id     INTEGER REFERENCES queries,
+    optimizer TEXT,
+    PRIMARY KEY (query_id, optimizer)
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS query_effective_optimizers_dependencies
+(
+    query_id     INTEGER REFERENCES queries,
+    optimizer TEXT,
+    dependent_optimizer TEXT, -- dependency of 'optimizer'
+    PRIMARY KEY (query_id, optimizer, dependent_optimizer)
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS query_optimizer_configs
+(
+    id                   INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_id             INTEGER REFERENCES queries,
+    disabled_rules       TEXT,
+    logical_plan_dot     TEXT,
+    fragmented_plan_dot  TEXT,
+    logical_plan_json    TEXT,
+    fragmented_plan_json TEXT,
+    num_disabled_rules   INTEGER,
+    hash                 INTEGER, -- the hash value of the optimizer query plan
+    duplicated_plan      BOOLEAN DEFAULT FALSE,
+    UNIQUE (query_id, disabled_rules)
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS measurements
+(
+    query_optimizer_config_id INTEGER REFERENCES query_optimizer_configs,
+    elapsed                   INTEGER,
+    planning                  INTEGER,
+    scheduling                INTEGER,
+    running                   INTEGER,
+    finishing                 INTEGER,
+    machine                   TEXT,
+    time                      TIMESTAMP,
+    cpu_time                  DECIMAL,
+    input_data_size           BIGINT,
+    nodes                     INTEGER
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS schema_version
+(
+    version INTEGER PRIMARY KEY
+);
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS plan_blobs
+(
+    digest BLOB PRIMARY KEY, -- sha256 of the uncompressed plan
+    codec  TEXT,             -- compression of the plan (zstd or zlib)
+    plan   BLOB
+);
+--------------------------------------------------------------------------------
+-- each distinct plan is stored once in plan_blobs, the inline plan columns are only set for configs of older versions
+ALTER TABLE query_optimizer_configs ADD COLUMN logical_plan_dot_digest BLOB REFERENCES plan_blobs;
+ALTER TABLE query_optimizer_configs ADD COLUMN fragmented_plan_dot_digest BLOB REFERENCES plan_blobs;
+ALTER TABLE query_optimizer_configs ADD COLUMN logical_plan_json_digest BLOB REFERENCES plan_blobs;
+ALTER TABLE query_optimizer_configs ADD COLUMN fragmented_plan_json_digest BLOB REFERENCES plan_blobs;
+--------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS config_runtime_stats
+(
+    query_optimizer_config_id INTEGER PRIMARY KEY REFERENCES query_optimizer_configs,
+    num_measurements          INTEGER,
+    runtimes                  TEXT, -- sorted json list of the runtimes (running + finishing), a uniform sample of at most storage.MAX_RUNTIME_SAMPLES runtimes
+    cpu_times                 TEXT, -- sorted json list of the cpu times (sampled as the runtimes)
+    runtime_median            REAL, -- REAL affinity, otherwise sqlite stores integral medians as integers
+    runtime_mean              REAL,
+    runtime_min               INTEGER,
+    runtime_max               INTEGER,
+    cpu_time_median           REAL
+);
+--------------------------------------------------------------------------------
+-- benchmark of the query (see storage.query_benchmark), the analytical queries filter on it instead of matching the query path
+ALTER TABLE queries ADD COLUMN benchmark TEXT;
+ALTER TABLE measurements ADD COLUMN benchmark TEXT;
+-- indexes of the hot lookups (see storage.check_index_usage), query_path and (query_id, disabled_rules) are indexed by their unique constraints
+CREATE INDEX IF NOT EXISTS queries_benchmark_idx ON queries (benchmark);
+CREATE INDEX IF NOT EXISTS query_optimizer_configs_hash_idx ON query_optimizer_configs (query_id, hash);
+CREATE INDEX IF NOT EXISTS measurements_config_idx ON measurements (query_optimizer_config_id);
+--------------------------------------------------------------------------------
+-- the adaptive repetition (see repetition.py) flags warm-up runs, they are not part of the runtime statistics
+ALTER TABLE measurements ADD COLUMN warmup BOOLEAN DEFAULT FALSE;
+-- why the runs of the config stopped (e.g. converged, worse_than_baseline, max_runs)
+ALTER TABLE measurements ADD COLUMN stop_reason TEXT;
+-- runs killed by the deadline of the config (see benchmark.execution_deadline), their runtime is the deadline (a lower bound)
+ALTER TABLE measurements ADD COLUMN censored BOOLEAN DEFAULT FALSE;
+-- client-side fetch throughput of the run (see result_drain.py): number of result rows and time to fetch them
+ALTER TABLE measurements ADD COLUMN fetch_rows BIGINT;
+ALTER TABLE measurements ADD COLUMN fetch_seconds REAL;
+--------------------------------------------------------------------------------
+-- checkpoint of the DP exploration of a query (see OptimizerConfig.checkpoint), a restarted driver resumes from it
+CREATE TABLE IF NOT EXISTS exploration_state
+(
+    query_id            INTEGER PRIMARY KEY REFERENCES queries,
+    stage               INTEGER, -- number of the next DP stage (OptimizerConfig.n)
+    configs             TEXT,    -- json list of the configs of the current stage
+    blacklisted_configs TEXT,    -- json list of configs that are worse than the baseline
+    finished            BOOLEAN DEFAULT FALSE,
+    updated             TIMESTAMP
+);
+--------------------------------------------------------------------------------
+-- work queue of distributed drivers (see work_queue.py), each driver claims queries with a lease and renews it by heartbeats
+CREATE TABLE IF NOT EXISTS work_items
+(
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_path    varchar(256),
+    mode          TEXT,                    -- record_time or query_span
+    status        TEXT DEFAULT 'pending',  -- pending, running, done, failed
+    worker        TEXT,                    -- driver holding the lease
+    lease_expires TIMESTAMP,
+    attempts      INTEGER DEFAULT 0,
+    updated       TIMESTAMP,
+    UNIQUE (query_path, mode)
+);
+CREATE INDEX IF NOT EXISTS work_items_status_idx ON work_items (mode, status, id);
+--------------------------------------------------------------------------------
@@ -9,3 +9,4 @@ BAO_QUERY_SPAN_ITERATIVE = "query_span_iterative"
 BAO_EXECUTE_QUERY = "execute_query"
 BAO_SOCKET = "bao_socket"
 BAO_DISABLED_OPTIMIZERS = "bao_disabled_optimizers"
+QUERY_MAX_EXECUTION_TIME = "query_max_execution_time"
@@ -3,8 +3,17 @@
 EXPORT_GRAPHVIZ = False
 EXPORT_JSON = False
 REPEATS = 1
-LOGICAL_DOT = ''
-FRAGMENTED_DOT = ''
-LOGICAL_JSON = ''
-FRAGMENTED_JSON = ''
+# hash only every n-th result row (chosen by content) into the result fingerprint, see result_fingerprint.py
+FINGERPRINT_SAMPLE_RATE = 1
+# results are fetched in a background thread (see result_drain.py), they are hashed into the result fingerprint or discarded
+FINGERPRINT_RESULTS = True
+# continue the DP exploration of each query from its last checkpoint (see OptimizerConfig.checkpoint)
+RESUME = False
+# adaptive repetition (see repetition.py): repeat until the confidence interval of the median is narrow enough, at most MAX_REPEATS times
+ADAPTIVE_REPEATS = False
+MAX_REPEATS = 20
+TARGET_CI_WIDTH = 0.05
+# runs of a config are killed after TIMEOUT_FACTOR * median runtime of the default config + TIMEOUT_SLACK_SECONDS (0 disables the deadline)
+TIMEOUT_FACTOR = 3.0
+TIMEOUT_SLACK_SECONDS = 10.0
 PRESTO_SETTINGS = {}
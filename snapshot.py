@@ -0,0 +1,184 @@
+"""This module exports the experience into a local columnar snapshot (Parquet files) that is synchronized incrementally.
+
+A snapshot directory contains:
+    experience/part-*.parquet   runtime statistics per query optimizer config, later parts supersede rows of earlier parts
+    plans/part-*.parquet        compressed query plans referenced by their digest (see plan_store.py)
+    sync_state.json             id of the latest synchronized measurement and the ids below it that were missing (see storage.SYNC_WINDOW)
+
+Sync a snapshot with `python3 snapshot.py <directory>`, training and evaluation read it without querying the database.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+import storage
+from custom_logging import bao_logging
+from measurement_table import MeasurementTable
+from plan_store import CompressedPlan, compress_plan, plan_digest
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPERIENCE_DIR = 'experience'
+PLANS_DIR = 'plans'
+STATE_FILE = 'sync_state.json'
+
+
+def _check_pyarrow():
+    if pa is None:
+        raise ImportError('experience snapshots are stored as Parquet files, install the pyarrow package to use them')
+
+
+def _experience_schema():
+    return pa.schema([('config_id', pa.int64()), ('query_id', pa.int64()), ('query_path', pa.string()), ('benchmark', pa.string()),
+                      ('disabled_rules', pa.string()), ('num_disabled_rules', pa.int32()), ('plan_digest', pa.binary()),
+                      ('num_measurements', pa.int64()), ('runtime_median', pa.float64()), ('runtime_mean', pa.float64()),
+                      ('runtime_min', pa.int64()), ('runtime_max', pa.int64()), ('cpu_time_median', pa.float64())])
+
+
+def _plans_schema():
+    return pa.schema([('digest', pa.binary()), ('codec', pa.string()), ('plan', pa.binary())])
+
+
+def _read_state(directory):
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {'last_measurement_id': 0, 'missing_ids': [], 'parts': 0}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_state(directory, state):
+    # replace the state atomically, parts written by an interrupted sync are overwritten by the next sync
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, STATE_FILE)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def _parts(directory, name):
+    part_dir = os.path.join(directory, name)
+    if not os.path.exists(part_dir):
+        return []
+    return [os.path.join(part_dir, part) for part in sorted(os.listdir(part_dir)) if part.endswith('.parquet')]
+
+
+def _read_parts(directory, name, schema, columns=None):
+    tables = [pq.read_table(part, columns=columns, memory_map=True) for part in _parts(directory, name)]
+    if len(tables) == 0:
+        return schema.empty_table() if columns is None else schema.empty_table().select(columns)
+    return pa.concat_tables(tables)
+
+
+def _write_part(directory, name, part, table):
+    os.makedirs(os.path.join(directory, name), exist_ok=True)
+    pq.write_table(table, os.path.join(directory, name, f'part-{part:05d}.parquet'))
+
+
+def _optional_float(value):
+    return None if value is None else float(value)
+
+
+def sync(directory):
+    """Export the configs that received new measurements since the last sync into a new part of the snapshot
+    :returns: number of exported configs
+    """
+    _check_pyarrow()
+    state = _read_state(directory)
+    max_id, missing_ids, rows = storage.changed_experience(state['last_measurement_id'], state.get('missing_ids', []))
+    if len(rows) == 0:
+        _write_state(directory, {**state, 'last_measurement_id': max_id, 'missing_ids': missing_ids})
+        bao_logging.info('Snapshot %s is up to date (measurement id %s)', directory, max_id)
+        return 0
+
+    known_digests = {bytes(digest) for digest in _read_parts(directory, PLANS_DIR, _plans_schema(), ['digest']).column('digest').to_pylist()}
+    experience = {name: [] for name in _experience_schema().names}
+    plans = {'digest': [], 'codec': [], 'plan': []}
+    stored_digests = set()
+    for (query_path, query_id, config_id, disabled_rules, num_disabled_rules, inline_plan, digest,
+         num_measurements, runtime_median, runtime_mean, runtime_min, runtime_max, cpu_time_median) in rows:
+        if digest is None:
+            # configs of older versions store the plan inline, the snapshot moves it into the plans table
+            digest = plan_digest(inline_plan)
+            if digest not in known_digests:
+                codec, data = compress_plan(inline_plan)
+                plans['digest'].append(digest)
+                plans['codec'].append(codec)
+                plans['plan'].append(data)
+                known_digests.add(digest)
+        else:
+            digest = bytes(digest)
+            if digest not in known_digests:
+                stored_digests.add(digest)
+        for name, value in zip(experience.keys(), [config_id, query_id, query_path, storage.query_benchmark(query_path), disabled_rules,
+                                                   num_disabled_rules, digest, num_measurements, _optional_float(runtime_median),
+                                                   _optional_float(runtime_mean), runtime_min, runtime_max, _optional_float(cpu_time_median)]):
+            experience[name].append(value)
+
+    for digest, plan in storage.get_plans(stored_digests).items():
+        plans['digest'].append(digest)
+        plans['codec'].append(plan.codec)
+        plans['plan'].append(plan.data)
+
+    part = state['parts']
+    if len(plans['digest']) > 0:
+        _write_part(directory, PLANS_DIR, part, pa.Table.from_pydict(plans, schema=_plans_schema()))
+    _write_part(directory, EXPERIENCE_DIR, part, pa.Table.from_pydict(experience, schema=_experience_schema()))
+    _write_state(directory, {'last_measurement_id': max_id, 'missing_ids': missing_ids, 'parts': part + 1})
+    bao_logging.info('Synchronized %s configs and %s plans into snapshot %s (measurement id %s)', len(rows), len(plans['digest']), directory, max_id)
+    return len(rows)
+
+
+def load(directory, benchmark=None):
+    """Read the latest runtime statistics of all configs in the snapshot, the columns are memory-mapped
+    :returns: pyarrow table with one row per config
+    """
+    _check_pyarrow()
+    table = _read_parts(directory, EXPERIENCE_DIR, _experience_schema())
+    # keep the last exported row of each config
+    config_ids = table.column('config_id').to_numpy()[::-1]
+    _, last = np.unique(config_ids, return_index=True)
+    table = table.take(np.sort(len(config_ids) - 1 - last))
+    if benchmark is not None:
+        table = table.filter(pc.equal(table.column('benchmark'), storage.benchmark_name(benchmark)))
+    return table.sort_by([('query_id', 'ascending'), ('config_id', 'ascending')])
+
+
+def load_plans(directory):
+    """:returns: dict of digest -> CompressedPlan, plans are decompressed on access"""
+    _check_pyarrow()
+    table = _read_parts(directory, PLANS_DIR, _plans_schema())
+    return {digest: CompressedPlan(codec, data) for digest, codec, data in
+            zip(table.column('digest').to_pylist(), table.column('codec').to_pylist(), table.column('plan').to_pylist())}
+
+
+def experience(directory, benchmark=None, training_ratio=0.8, seed=0):
+    """Get the experience to train BAO from the snapshot, queries are split into training and test set by their hashed ids
+    :returns: MeasurementTables of the training and test queries
+    """
+    table = load(directory, benchmark)
+    plans_by_digest = load_plans(directory)
+    digests = table.column('plan_digest').to_pylist()
+    # the plan digests of the snapshot become plan indexes of the measurement table
+    plan_indexes = {digest: index for index, digest in enumerate(dict.fromkeys(digests))}
+    query_ids = table.column('query_id').to_numpy()
+    measurements = MeasurementTable(query_ids, table.column('config_id').to_numpy(), table.column('num_disabled_rules').to_numpy(),
+                                    table.column('runtime_median').to_numpy(), table.column('cpu_time_median').fill_null(np.nan).to_numpy(),
+                                    table.column('disabled_rules').to_numpy(zero_copy_only=False), [plan_indexes[digest] for digest in digests],
+                                    [plans_by_digest[digest] for digest in plan_indexes],
+                                    dict(zip(query_ids.tolist(), table.column('query_path').to_pylist())))
+    return measurements.split_by_query([query_id for query_id in np.unique(query_ids).tolist() if storage.is_training_query(query_id, training_ratio, seed)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synchronize a local Parquet snapshot of the experience')
+    parser.add_argument('directory', type=str, help='snapshot directory, it is created if it does not exist')
+    args = parser.parse_args()
+    sync(args.directory)
@@ -0,0 +1,123 @@
+"""This module plans all optimizer configs of a DP stage concurrently on separate presto sessions before any of them is executed"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import prestodb
+
+import settings
+import tracing
+from custom_logging import bao_logging
+from presto_connector import PrestoSession, get_default_session
+from session_properties import BAO_DISABLED_OPTIMIZERS, BAO_EXECUTE_QUERY, BAO_EXPORT_GRAPHVIZ, BAO_EXPORT_JSON, BAO_EXPORT_TIMES
+
+PLANNING_SESSIONS = 4
+
+
+class PlannedConfig:
+    """The query plan of an optimizer config, error is set if presto could not plan the query using this config"""
+
+    def __init__(self, disabled_rules, properties, plan_hash=None, logical_dot=None, fragmented_dot=None, logical_json=None, fragmented_json=None,
+                 error=None):
+        self.disabled_rules = disabled_rules
+        self.properties = properties
+        self.plan_hash = plan_hash
+        self.logical_dot = logical_dot
+        self.fragmented_dot = fragmented_dot
+        self.logical_json = logical_json
+        self.fragmented_json = fragmented_json
+        self.error = error
+
+
+class PlanningSession(PrestoSession):
+    """A presto session that only optimizes queries (execute_query = false), presto sends the plans to the session's own callback server"""
+
+    def __init__(self, catalog, schema, host='localhost', port=8080, callback_host='localhost'):
+        super().__init__(catalog, schema, host=host, port=port, callback_host=callback_host, session_properties={
+            BAO_EXECUTE_QUERY: 'false', BAO_EXPORT_TIMES: 'true',
+            BAO_EXPORT_GRAPHVIZ: str(settings.EXPORT_GRAPHVIZ).lower(), BAO_EXPORT_JSON: str(settings.EXPORT_JSON).lower()})
+
+    def _execute(self, statement):
+        cursor = self.connection.cursor()
+        cursor.execute(statement)
+        cursor.fetchall()
+        return cursor
+
+    def plan(self, query_string, disabled_rules, properties):
+        with self.query():
+            return self._plan(query_string, disabled_rules, properties)
+
+    def _plan(self, query_string, disabled_rules, properties):
+        # the optimizer config is sent along with the query (session properties), see presto_connector.SessionProperties
+        self.properties.reset(BAO_DISABLED_OPTIMIZERS)
+        try:
+            self.properties.update(properties)
+            cursor = self._execute(query_string)
+        except (prestodb.exceptions.PrestoUserError, prestodb.exceptions.PrestoQueryError) as e:
+            self.callback_server.discard_pending()
+            return PlannedConfig(disabled_rules, properties, error=e)
+
+        try:
+            # graphviz and json plans (logical and fragmented) followed by the execution stats containing the plan hash
+            callbacks = self.callback_server.query_callbacks(cursor.stats['queryId'])
+        except TimeoutError as e:
+            return PlannedConfig(disabled_rules, properties, error=e)
+        if 'plan_hash' not in callbacks.execution_stats:
+            return PlannedConfig(disabled_rules, properties, error=ValueError('presto did not send the plan hash'))
+        return PlannedConfig(disabled_rules, properties, callbacks.execution_stats['plan_hash'], callbacks.logical_dot, callbacks.fragmented_dot,
+                             callbacks.logical_json, callbacks.fragmented_json)
+
+
+class StagePlanner:
+    """Plan the optimizer configs of a DP stage concurrently, each worker thread uses its own planning session.
+    The sessions are opened on first use and reused for all stages and queries.
+    :param session: the planning sessions connect to the same presto cluster and catalog:schema as this session (default: get_default_session)
+    """
+
+    def __init__(self, num_sessions=PLANNING_SESSIONS, session=None):
+        self.num_sessions = num_sessions
+        self.session = session
+        self.executor = None
+        self.sessions = queue.Queue()
+        self.lock = threading.Lock()
+        self.all_sessions = []
+
+    def _plan(self, query_string, disabled_rules, properties, attributes):
+        try:
+            session = self.sessions.get_nowait()
+        except queue.Empty:
+            template = self.session or get_default_session()
+            connection = template.connection
+            session = PlanningSession(connection.catalog, connection.schema, connection.host, connection.port, template.callback_host)
+            with self.lock:
+                self.all_sessions.append(session)
+        try:
+            with tracing.span('plan', **{**attributes, 'config': disabled_rules}):
+                return session.plan(query_string, disabled_rules, properties)
+        finally:
+            self.sessions.put(session)
+
+    def plan_stage(self, query_string, stage):
+        """Plan all configs of the stage
+        :param stage: list of (disabled rules, session properties), see OptimizerConfig.next_stage
+        :returns: planned configs in the order of the stage
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.num_sessions, thread_name_prefix='stage-planner')
+        # the worker threads trace their plans with the attributes of the caller's span (e.g. the query path)
+        attributes = tracing.current_attributes()
+        futures = [self.executor.submit(self._plan, query_string, disabled_rules, properties, attributes) for disabled_rules, properties in stage]
+        # the caller waits for presto to plan the configs, see tracing.CLUSTER_PHASES
+        with tracing.span('plan_wait'):
+            planned_configs = [future.result() for future in futures]
+        bao_logging.info('Planned %s configs using %s sessions', len(planned_configs), len(self.all_sessions))
+        return planned_configs
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for session in self.all_sessions:
+            session.close()
+        self.all_sessions = []
+        self.sessions = queue.Queue()
@@ -0,0 +1,103 @@
+"""Benchmark the driver against the presto stand-in (see presto_standin.py), no presto cluster is required.
+
+The suite measures the callback throughput of a session's callback server and runs the query span approximation and the DP exploration of
+the driver end-to-end: configs per second, and how the driver's time splits into cluster time, driver overhead, and storage writes (see
+tracing.py). The experience is written to a fresh sqlite file unless DB_BACKEND is set.
+
+    python3 standin_benchmark.py --queries 5 --time_scale 0.001
+"""
+import argparse
+import json
+import os
+import socket
+import tempfile
+import time
+
+if 'DB_BACKEND' not in os.environ:
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_FILE'] = os.path.join(tempfile.mkdtemp(prefix='standin-'), 'bao.sqlite')
+
+# pylint: disable=wrong-import-position
+import benchmark
+import settings
+import tracing
+from benchmark import JOB_QUERIES_PATH, load_query, reset_presto_config, run_get_query_span, run_query_with_optimizer_configs
+from custom_logging import bao_logging
+from presto_connector import FRAME_HEADER, JSON, LOGICAL, MAX_RETAINED_QUERIES, CallbackServer, PrestoSession
+from presto_standin import StandinServer, create_coordinator, get_parser as get_standin_parser
+from stage_planner import StagePlanner
+
+
+def benchmark_callbacks(coordinator, query_string, num_queries):
+    """Push the json plan and execution stats of num_queries queries to a callback server
+    :returns: messages per second and MB per second until the callbacks of the last query are consumed
+    """
+    server = CallbackServer()
+    _, logical, _, _ = coordinator.model.plan(query_string, set())
+    plan = JSON + LOGICAL + json.dumps(logical).encode()
+    frames = []
+    for i in range(num_queries):
+        stats = JSON + json.dumps({'query_id': f'q{i}', 'plan_hash': i, 'elapsed': 1}).encode()
+        frames.append(FRAME_HEADER.pack(len(plan)) + plan + FRAME_HEADER.pack(len(stats)) + stats)
+    # the server drops the callbacks of queries that are not consumed in time, send them in windows of queries
+    window = MAX_RETAINED_QUERIES // 2
+    start = time.perf_counter()
+    with socket.create_connection((server.host, server.port)) as connection:
+        for first in range(0, num_queries, window):
+            connection.sendall(b''.join(frames[first:first + window]))
+            for i in range(first, min(first + window, num_queries)):
+                server.query_callbacks(f'q{i}')
+    seconds = time.perf_counter() - start
+    server.close()
+    return 2 * num_queries / seconds, sum(map(len, frames)) / seconds / 1e6
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the driver against the presto stand-in', parents=[get_standin_parser()],
+                                     conflict_handler='resolve')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--time_scale', help='scale all latencies of the stand-in by this factor', type=float, default=0.001)
+    parser.add_argument('--queries', help='number of JOB queries to explore', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--planning_sessions', type=int, default=4)
+    parser.add_argument('--callback_queries', help='number of queries of the callback throughput benchmark', type=int, default=5000)
+    parser.add_argument('--trace', help='write the chrome trace of the driver to this file', type=str)
+    return parser
+
+
+if __name__ == '__main__':
+    ARGS = get_parser().parse_args()
+    COORDINATOR = create_coordinator(ARGS)
+    SERVER = StandinServer(COORDINATOR, ARGS.host, ARGS.port)
+    QUERIES = [f'{JOB_QUERIES_PATH}{query}' for query in sorted(q for q in os.listdir(JOB_QUERIES_PATH) if q.endswith('.sql') and q != 'schema_job.sql')]
+    QUERIES = QUERIES[:ARGS.queries]
+
+    MESSAGES, MEGABYTES = benchmark_callbacks(COORDINATOR, load_query(QUERIES[0]), ARGS.callback_queries)
+    bao_logging.info('callback throughput: %.0f messages/s, %.1f MB/s', MESSAGES, MEGABYTES)
+
+    settings.REPEATS = ARGS.repeats
+    settings.EXPORT_JSON = True
+    tracing.TRACER.enable()
+    SESSION = PrestoSession('standin', 'synthetic', host=SERVER.host, port=SERVER.port)
+    reset_presto_config(SESSION)
+    benchmark.PLANNER = StagePlanner(ARGS.planning_sessions, SESSION)
+    START = time.perf_counter()
+    for query_path in QUERIES:
+        run_get_query_span(SESSION, query_path)
+        reset_presto_config(SESSION)
+        run_query_with_optimizer_configs(SESSION, query_path)
+    SECONDS = time.perf_counter() - START
+    benchmark.PLANNER.close()
+    SESSION.close()
+    SERVER.close()
+
+    COUNTS = COORDINATOR.counts
+    bao_logging.info('Time spent per phase of the driver:\n%s', tracing.TRACER.summary())
+    if ARGS.trace is not None:
+        tracing.TRACER.export(ARGS.trace)
+    print(f'{len(QUERIES)} queries in {SECONDS:.2f}s: {COUNTS["planned"] / SECONDS:.1f} planned configs/s, '
+          f'{COUNTS["executed"] / SECONDS:.1f} runs/s ({COUNTS["executed"]} runs, {COUNTS["failed"]} failed plans, {COUNTS["timeouts"]} timeouts)')
+    print(f'callbacks: {MESSAGES:.0f} messages/s ({MEGABYTES:.1f} MB/s), stand-in sent {COORDINATOR.callbacks.messages} messages '
+          f'({COORDINATOR.callbacks.bytes / 1e6:.1f} MB)')
+    STORAGE = tracing.TRACER.phases.get('storage', (0, 0.0, 0.0))[2]
+    print(f'storage overhead: {STORAGE:.2f}s ({STORAGE / SECONDS:.1%} of the wall time)')
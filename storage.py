@@ -2,18 +2,28 @@
 import json
 from custom_logging import bao_logging
 import os
+import itertools
 import numpy as np
 import pandas as pd
 import random
 import socket
+import statistics
 import sqlalchemy
+import threading
+import zlib
 from datetime import datetime
-from sqlalchemy import create_engine
 from sqlalchemy.sql import text
 from sqlalchemy.exc import IntegrityError
+from measurement_table import MeasurementTable
+from plan_store import CompressedPlan, compress_plan, plan_digest
+from result_fingerprint import comparable
+from storage_backends import PostgresBackend, get_backend
 
-SCHEMA_FILE = 'schema.sql'
+# bump this version whenever the schema files change, existing databases replay the (idempotent) DDL exactly once
+SCHEMA_VERSION = 10
 ENGINE = None
+BACKEND = None
+ENGINE_LOCK = threading.Lock()
 
 
 def read_sql_file(filename, encoding='utf-8') -> str:
@@ -24,53 +34,160 @@ def read_sql_file(filename, encoding='utf-8') -> str:
     return '\n'.join(filter(lambda line: not line.startswith('--'), statements))
 
 
-def _db():
-    global ENGINE
-    if ENGINE is None:
-        user = os.getenv('DB_USER')
-        database = os.getenv('DB_NAME')
-        password = os.getenv('DB_PASSWORD')
-
-        host = os.getenv('DB_HOST')
-        if host is None:
-            host = os.getenv('POSTGRES_SERVICE_HOST')
-        assert host is not None
+def _schema_version(conn):
+    if not sqlalchemy.inspect(conn).has_table('schema_version'):
+        return None
+    return conn.execute(text('SELECT max(version) FROM schema_version')).scalar()
+
+
+def _bootstrap_schema(engine, backend):
+    """Create tables and functions once per process, the DDL is skipped if the database already runs the current SCHEMA_VERSION"""
+    with engine.connect() as conn:
+        if _schema_version(conn) == SCHEMA_VERSION:
+            return
+        with conn.begin():
+            backend.lock_schema(conn)
+            # another driver might have finished the bootstrap while we were waiting for the lock
+            previous_version = _schema_version(conn)
+            if previous_version == SCHEMA_VERSION:
+                return
+            bao_logging.info('Bootstrap database schema (version %s)', SCHEMA_VERSION)
+            for statement in read_sql_file(backend.schema_file).split(';'):
+                if len(statement.strip()) > 0:
+                    backend.execute_ddl(conn, statement)
+            # derive the content of tables introduced by newer schema versions
+            for version, migration in SCHEMA_MIGRATIONS:
+                if previous_version is None or previous_version < version:
+                    migration(conn)
+            conn.execute(text('DELETE FROM schema_version'))
+            conn.execute(text('INSERT INTO schema_version (version) VALUES (:version)'), version=SCHEMA_VERSION)
+
+
+def _engine():
+    """Connect to the backend selected by the env variable DB_BACKEND (postgres or sqlite, default: postgres)"""
+    global ENGINE, BACKEND
+    with ENGINE_LOCK:
+        if ENGINE is None:
+            backend = get_backend(os.getenv('DB_BACKEND', PostgresBackend.name))
+            engine = backend.create_engine()
+            # the migrations of the bootstrap already use the prepared statements of the backend
+            BACKEND = backend
+            _bootstrap_schema(engine, backend)
+            ENGINE = engine
+    return ENGINE
 
-        url = f'postgresql://{user}:{password}@{host}:5432/{database}'
-        bao_logging.info('Connect to database: %s', url)
-        ENGINE = create_engine(url)
 
-    schema = os.getenv('DB_SCHEMA')
-    conn = ENGINE.connect()
-    conn.execute(f'SET search_path TO {schema};')
+def _db():
+    """Check out a warm connection from the pool, use it as context manager to return it afterwards"""
+    return _engine().connect()
 
-    schema = read_sql_file(SCHEMA_FILE)
 
-    for statement in schema.split(';'):
-        if len(statement.strip()) > 0:
-            conn.execute(statement)
-    return conn
+def _execute_prepared(conn, name, param_types, statement, *params):
+    """Execute the statement as named prepared statement, postgres prepares it once per pooled connection.
+    Use $1, $2, ... as placeholders in the statement, the parameters are bound and not embedded into the statement text.
+    """
+    return BACKEND.execute_prepared(conn, name, param_types, statement, params)
+
+
+class MetadataCache:
+    """Write-through cache of query ids, config ids, plan hashes, and result fingerprints.
+    The hot paths write rows by primary key and detect duplicated plans without a database round trip.
+    The cached values never change once they are written, plan hashes and fingerprints of a query are only written by the driver exploring it."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.query_ids = {}  # query path -> query id
+        self.config_ids = {}  # (query id, disabled rules) -> config id
+        self.plan_hashes = {}  # query id -> {plan hash -> disabled rules in registration order}
+        self.fingerprints = {}  # query id -> result fingerprint
+        self.plan_digests = set()  # digests of the plans in the plan store
+
+    def invalidate(self):
+        """Forget ids and fingerprints which might have been written by a transaction that was rolled back"""
+        with self.lock:
+            self.query_ids.clear()
+            self.config_ids.clear()
+            self.fingerprints.clear()
+            self.plan_digests.clear()
+
+
+CACHE = MetadataCache()
+
+
+def _query_id(conn, query_path):
+    with CACHE.lock:
+        if query_path in CACHE.query_ids:
+            return CACHE.query_ids[query_path]
+    query_id = conn.execute(text('SELECT id FROM queries WHERE query_path = :query_path'), query_path=query_path).scalar()
+    if query_id is not None:
+        with CACHE.lock:
+            CACHE.query_ids[query_path] = query_id
+    return query_id
+
+
+def _config_id(conn, query_id, disabled_rules):
+    key = (query_id, str(disabled_rules))
+    with CACHE.lock:
+        if key in CACHE.config_ids:
+            return CACHE.config_ids[key]
+    config_id = conn.execute(text('SELECT id FROM query_optimizer_configs WHERE query_id = :query_id AND disabled_rules = :disabled_rules'),
+                             query_id=query_id, disabled_rules=str(disabled_rules)).scalar()
+    if config_id is not None:
+        with CACHE.lock:
+            CACHE.config_ids[key] = config_id
+    return config_id
+
+
+def _plan_hashes(conn, query_id):
+    """Get the plan hashes of the query together with the configs that produced them, they are loaded once per query"""
+    with CACHE.lock:
+        if query_id in CACHE.plan_hashes:
+            return CACHE.plan_hashes[query_id]
+    rows = conn.execute(text('SELECT hash, disabled_rules FROM query_optimizer_configs WHERE query_id = :query_id ORDER BY id'),
+                        query_id=query_id).fetchall()
+    with CACHE.lock:
+        if query_id not in CACHE.plan_hashes:
+            hashes = {}
+            for plan_hash, disabled_rules in rows:
+                hashes.setdefault(plan_hash, {}).setdefault(disabled_rules)
+            CACHE.plan_hashes[query_id] = hashes
+        return CACHE.plan_hashes[query_id]
 
 
 def register_query(query_path):
+    benchmark = query_benchmark(query_path)
     with _db() as conn:
         try:
-            stmt = text('INSERT INTO queries (query_path, result_fingerprint) VALUES ( :query_path, :result_fingerprint )')
-            conn.execute(stmt, query_path=query_path, result_fingerprint=None)
+            stmt = text('INSERT INTO queries (query_path, result_fingerprint, benchmark) VALUES ( :query_path, :result_fingerprint, :benchmark )')
+            conn.execute(stmt, query_path=query_path, result_fingerprint=None, benchmark=benchmark)
         except IntegrityError:
-            pass
+            return
+        with conn.begin():
+            BACKEND.create_partition(conn, benchmark)
+
+
+def check_query_fingerprint(conn, query_path, fingerprint):
+    """Store the result fingerprint of the query if there is none yet, otherwise compare it to the stored one.
+    A stored fingerprint that cannot be compared (older version or different sample rate, see result_fingerprint.py) is replaced.
+    :returns: false if the fingerprints do not match
+    """
+    query_id = _query_id(conn, query_path)
+    with CACHE.lock:
+        stored = CACHE.fingerprints.get(query_id)
+    if stored is None:
+        result = conn.execute(text('SELECT result_fingerprint FROM queries WHERE id = :query_id'), query_id=query_id).fetchone()[0]
+        stored = None if result is None else bytes(result)
+    if stored is None or not comparable(stored, fingerprint):
+        conn.execute(text('UPDATE queries SET result_fingerprint = :fingerprint WHERE id = :query_id;'), fingerprint=fingerprint, query_id=query_id)
+        stored = fingerprint
+    with CACHE.lock:
+        CACHE.fingerprints[query_id] = stored
+    return stored == fingerprint  # false if fingerprints do not match
 
 
 def register_query_fingerprint(query_path, fingerprint):
     with _db() as conn:
-        result = conn.execute(text('SELECT result_fingerprint FROM queries WHERE query_path= :query_path'), query_path=query_path).fetchone()[0]
-        if result is None:
-            conn.execute(
-                text('UPDATE queries SET result_fingerprint = :fingerprint WHERE query_path = :query_path;'), fingerprint=fingerprint, query_path=query_path)
-            return True
-        elif bytes(result) != fingerprint:
-            return False  # fingerprints do not match
-        return True
+        return check_query_fingerprint(conn, query_path, fingerprint)
 
 
 def register_optimizer(query_path, optimizer, table):
@@ -93,6 +210,47 @@ def register_optimizer_dependency(query_path, optimizer, dependency, table):
             pass  # do not store duplicates
 
 
+def _insert_ignore_duplicates(conn, table, columns, rows):
+    """Insert all rows using one multi-row statement, rows that violate a unique constraint are skipped"""
+    rows = list(dict.fromkeys(rows))  # remove duplicates but keep the order
+    if len(rows) == 0:
+        return
+    params = {}
+    values = []
+    for i, row in enumerate(rows):
+        placeholders = []
+        for column, value in zip(columns, row):
+            params[f'{column}_{i}'] = value
+            placeholders.append(f':{column}_{i}')
+        values.append(f'({", ".join(placeholders)})')
+    stmt = text(f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join(values)} ON CONFLICT DO NOTHING')
+    conn.execute(stmt, **params)
+
+
+def register_query_span(query_path, effective_optimizers, required_optimizers):
+    """Store the complete query span of a query within a single transaction.
+    :param effective_optimizers: list of effective optimizers, each given as dict with its 'name' and 'dependencies'
+    :param required_optimizers: list of required optimizers, each given as dict with its 'name'
+    """
+    benchmark = query_benchmark(query_path)
+    with _db() as conn, conn.begin():
+        conn.execute(text('INSERT INTO queries (query_path, benchmark) VALUES (:query_path, :benchmark) ON CONFLICT DO NOTHING'),
+                     query_path=query_path, benchmark=benchmark)
+        # queries registered by the span of previous versions have no benchmark
+        conn.execute(text('UPDATE queries SET benchmark = :benchmark WHERE query_path = :query_path AND benchmark IS NULL'),
+                     query_path=query_path, benchmark=benchmark)
+        BACKEND.create_partition(conn, benchmark)
+        query_id = _query_id(conn, query_path)
+
+        _insert_ignore_duplicates(conn, 'query_effective_optimizers', ['query_id', 'optimizer'],
+                                  [(query_id, optimizer['name']) for optimizer in effective_optimizers])
+        # consider recursive optimizer dependencies here
+        _insert_ignore_duplicates(conn, 'query_effective_optimizers_dependencies', ['query_id', 'optimizer', 'dependent_optimizer'],
+                                  [(query_id, optimizer['name'], dependency) for optimizer in effective_optimizers for dependency in optimizer['dependencies']])
+        _insert_ignore_duplicates(conn, 'query_required_optimizers', ['query_id', 'optimizer'],
+                                  [(query_id, optimizer['name']) for optimizer in required_optimizers])
+
+
 def best_alternative_configuration(benchmark=None):
     class OptimizerConfigResult:
         def __init__(self, path, num_disabled_rules, runtime, runtime_baseline, savings, disabled_rules, rank):
@@ -104,50 +262,60 @@ def best_alternative_configuration(benchmark=None):
             self.disabled_rules = disabled_rules
             self.rank = rank
 
-    stmt = f"""
+    stmt = """
        with default_plans (query_path, running_time) as (
-        select q.query_path, median(m.running + m.finishing)
+        select q.query_path, s.runtime_median
         from queries q,
              query_optimizer_configs qoc,
-             measurements m
+             config_runtime_stats s
         where q.id = qoc.query_id
-          and qoc.id = m.query_optimizer_config_id
+          and qoc.id = s.query_optimizer_config_id
           and qoc.num_disabled_rules = 0
           and qoc.disabled_rules = 'None'
-        group by q.query_path, qoc.num_disabled_rules, qoc.disabled_rules),
+          and (:benchmark is null or q.benchmark = :benchmark)),
          results(query_path, num_disabled_rules, runtime, runtime_baseline, savings, disabled_rules, rank) as (
              select q.query_path,
                     qoc.num_disabled_rules,
-                    median(m.running + m.finishing),
+                    s.runtime_median,
                     dp.running_time,
-                    (dp.running_time - median(m.running + m.finishing)) / dp.running_time as savings,
+                    (dp.running_time - s.runtime_median) / dp.running_time as savings,
                     qoc.disabled_rules,
                     dense_rank() over (
                         partition by q.query_path
-                        order by (dp.running_time - median(m.running + m.finishing)) / dp.running_time desc ) as ranki
+                        order by (dp.running_time - s.runtime_median) / dp.running_time desc ) as ranki
              from queries q,
                   query_optimizer_configs qoc,
-                  measurements m,
+                  config_runtime_stats s,
                   default_plans dp
              where q.id = qoc.query_id
-               and qoc.id = m.query_optimizer_config_id
+               and qoc.id = s.query_optimizer_config_id
                and dp.query_path = q.query_path
                and qoc.num_disabled_rules > 0
-             group by q.query_path, qoc.num_disabled_rules, qoc.disabled_rules, dp.running_time
              order by savings desc)
     select *
     from results
     where rank = 1
-    and query_path like '%%{'' if benchmark is None else benchmark}%%'
     order by savings desc;"""
 
     with _db() as conn:
-        cursor = conn.execute(stmt, )
+        cursor = conn.execute(text(stmt), benchmark=benchmark_name(benchmark))
         return [OptimizerConfigResult(*row) for row in cursor.fetchall()]
 
 
+def get_runtime_stats(query_path):
+    """Get the runtime statistics of all measured configs of the query"""
+    stmt = """select qoc.disabled_rules, qoc.num_disabled_rules, qoc.duplicated_plan, s.num_measurements,
+                     s.runtime_median, s.runtime_mean, s.runtime_min, s.runtime_max, s.cpu_time_median
+              from query_optimizer_configs qoc, config_runtime_stats s
+              where qoc.id = s.query_optimizer_config_id
+                and qoc.query_id = :query_id"""
+    with _db() as conn:
+        return pd.read_sql(text(stmt), conn, params={'query_id': _query_id(conn, query_path)})
+
+
 class Measurement:
-    """This class stores the measurement for a certain query and optimizer configuration"""
+    """This class stores the measurement for a certain query and optimizer configuration.
+    The experience is loaded into a MeasurementTable, single measurements remain readable from pickles of previous versions."""
 
     def __init__(self, query_path, query_id, optimizer_config, disabled_rules,
                  num_disabled_rules, plan_json, running_time, cpu_time):
@@ -160,39 +328,151 @@ class Measurement:
         self.running_time = running_time
         self.cpu_time = cpu_time
 
+    @property
+    def plan_json(self):
+        """The plan is either text or a CompressedPlan from the plan store which gets decompressed on access"""
+        if isinstance(self._plan_json, CompressedPlan):
+            return self._plan_json.decompress()
+        return self._plan_json
+
+    @plan_json.setter
+    def plan_json(self, plan_json):
+        self._plan_json = plan_json
+
+    def __setstate__(self, state):
+        # measurements pickled by previous versions store the plan as plain attribute
+        if 'plan_json' in state:
+            state['_plan_json'] = state.pop('plan_json')
+        self.__dict__.update(state)
+
+
+def _measurement_table(rows):
+    """Create a MeasurementTable from rows of the EXPERIENCE_STATEMENT, configs with the same plan share it"""
+    return MeasurementTable.from_rows(
+        (query_path, query_id, config_id, disabled_rules, num_disabled_rules, None if plan is None else bytes(digest),
+         inline_plan if plan is None else CompressedPlan(codec, plan), running_time, cpu_time)
+        for query_path, query_id, config_id, disabled_rules, num_disabled_rules, inline_plan, digest, codec, plan, running_time, cpu_time in rows)
+
+
+# median runtime per config (maintained in config_runtime_stats), plans are either stored in the plan store or inline (configs of older versions)
+EXPERIENCE_STATEMENT = """select qu.query_path, q.query_id, q.id, q.disabled_rules, q.num_disabled_rules, q.logical_plan_json, pb.digest, pb.codec, pb.plan,
+                   m.runtime_median, m.cpu_time_median
+            from config_runtime_stats m
+                 join query_optimizer_configs q on m.query_optimizer_config_id = q.id
+                 join queries qu on qu.id = q.query_id
+                 left join plan_blobs pb on pb.digest = q.logical_plan_json_digest
+            where (pb.digest is not null or q.logical_plan_json != 'None')
+              and (:benchmark is null or qu.benchmark = :benchmark)
+            order by q.query_id, q.id"""
+EXPERIENCE_BATCH_SIZE = 1000
+
+
+# runtime statistics of all configs with measurements newer than the last synchronized measurement (see snapshot.py)
+SNAPSHOT_STATEMENT = """select qu.query_path, q.query_id, q.id, q.disabled_rules, q.num_disabled_rules, q.logical_plan_json, q.logical_plan_json_digest,
+                   m.num_measurements, m.runtime_median, m.runtime_mean, m.runtime_min, m.runtime_max, m.cpu_time_median
+            from config_runtime_stats m
+                 join query_optimizer_configs q on m.query_optimizer_config_id = q.id
+                 join queries qu on qu.id = q.query_id
+            where (q.logical_plan_json_digest is not null or q.logical_plan_json != 'None')
+              and q.id in (select query_optimizer_config_id from measurements
+                           where ({measurement_id} > :last_id and {measurement_id} <= :max_id) or {measurement_id} in :recovered_ids)
+            order by q.query_id, q.id"""
+# measurement ids are allocated when a row is inserted, but rows of concurrent writers (write-behind sinks of several drivers) commit in
+# any order, i.e. a row below the latest synchronized id can still show up. Missing ids of this many ids below the latest id are re-checked.
+SYNC_WINDOW = 10000
+
+
+# short benchmark names of the driver (--benchmark) and the evaluation scripts
+BENCHMARK_ALIASES = {'stack': 'stackoverflow'}
+
+
+def query_benchmark(query_path):
+    """The benchmark of a query is the directory below queries/ (e.g. queries/stackoverflow/q1/q1-001.sql -> stackoverflow),
+    queries outside of the queries directory use the name of their parent directory"""
+    parts = os.path.normpath(query_path).split(os.sep)
+    if 'queries' in parts[:-2]:
+        return parts[parts.index('queries') + 1].lower()
+    return os.path.basename(os.path.dirname(os.path.normpath(query_path))).lower()
+
+
+def benchmark_name(benchmark):
+    """Normalize the benchmark name used to filter the experience, None selects all benchmarks"""
+    if benchmark is None:
+        return None
+    return BENCHMARK_ALIASES.get(benchmark.lower(), benchmark.lower())
+
+
+def changed_experience(last_measurement_id, missing_ids=()):
+    """Get the runtime statistics of all configs that received measurements after last_measurement_id or whose measurements with a missing id
+    committed since the last sync (see SYNC_WINDOW)
+    :param missing_ids: ids below last_measurement_id without a measurement at the last sync
+    :returns: id of the latest measurement, the ids below it that are still missing, and the rows of the changed configs
+    """
+    measurement_id = BACKEND.measurement_id
+    with _db() as conn:
+        max_id = conn.execute(text(f'select max({measurement_id}) from measurements')).scalar()
+        if max_id is None:
+            return last_measurement_id, list(missing_ids), []
+        max_id = max(max_id, last_measurement_id)
+        window_start = max(last_measurement_id, max_id - SYNC_WINDOW)
+        stmt = text(f'select {measurement_id} from measurements where {measurement_id} in :ids').bindparams(sqlalchemy.bindparam('ids', expanding=True))
+        missing_ids = [i for i in missing_ids if i > max_id - SYNC_WINDOW]
+        recovered_ids = {row[0] for i in range(0, len(missing_ids), EXPERIENCE_BATCH_SIZE)
+                         for row in conn.execute(stmt, ids=missing_ids[i:i + EXPERIENCE_BATCH_SIZE])}
+        window = text(f'select {measurement_id} from measurements where {measurement_id} > :start and {measurement_id} <= :max_id')
+        new_ids = {row[0] for row in conn.execute(window, start=window_start, max_id=max_id)}
+        missing_ids = [i for i in missing_ids if i not in recovered_ids] + [i for i in range(window_start + 1, max_id + 1) if i not in new_ids]
+        if max_id == last_measurement_id and len(recovered_ids) == 0:
+            return last_measurement_id, missing_ids, []
+        cursor = conn.execute(text(SNAPSHOT_STATEMENT.format(measurement_id=measurement_id)).bindparams(sqlalchemy.bindparam('recovered_ids', expanding=True)),
+                              last_id=last_measurement_id, max_id=max_id, recovered_ids=sorted(recovered_ids))
+        return max_id, missing_ids, cursor.fetchall()
+
+
+def get_plans(digests):
+    """Load plans from the plan store
+    :returns: dict of digest -> CompressedPlan
+    """
+    stmt = text('select digest, codec, plan from plan_blobs where digest in :digests').bindparams(sqlalchemy.bindparam('digests', expanding=True))
+    digests = list(digests)
+    plans = {}
+    with _db() as conn:
+        for i in range(0, len(digests), EXPERIENCE_BATCH_SIZE):
+            for digest, codec, plan in conn.execute(stmt, digests=digests[i:i + EXPERIENCE_BATCH_SIZE]):
+                plans[bytes(digest)] = CompressedPlan(codec, plan)
+    return plans
 
-def experience(benchmark=None, training_ratio=0.8):
-    """Get experience to train BAO"""
-    stmt = f"""select qu.query_path, q.query_id, q.id,  q.disabled_rules, q.num_disabled_rules, q.logical_plan_json, median(running+finishing), median(cpu_time)
-            from measurements m, query_optimizer_configs q, queries qu
-            where m.query_optimizer_config_id = q.id
-              and q.logical_plan_json != 'None' 
-              and qu.id = q.query_id
-              and qu.query_path ILIKE '%%{'' if benchmark is None else benchmark}%%'
-            group by qu.query_path, q.query_id, q.id, q.logical_plan_json, q.disabled_rules, q.num_disabled_rules;"""
 
+def experience(benchmark=None, training_ratio=0.8):
+    """Get experience to train BAO
+    :returns: MeasurementTables of the training and test queries
+    """
     with _db() as conn:
-        cursor = conn.execute(stmt)
-        rows = [Measurement(*row) for row in cursor.fetchall()]
+        cursor = conn.execute(text(EXPERIENCE_STATEMENT), benchmark=benchmark_name(benchmark))
+        table = _measurement_table(cursor.fetchall())
 
-    # group training and test data by query
-    result = {}
-    for row in rows:
-        if row.query_id in result:
-            result[row.query_id].append(row)
-        else:
-            result[row.query_id] = [row]
+    # split training and test data by query
+    query_ids = np.unique(table.query_ids).tolist()
+    random.shuffle(query_ids)
+    return table.split_by_query(query_ids[:int(len(query_ids) * training_ratio)])
 
-    keys = list(result.keys())
-    random.shuffle(keys)
-    split_index = int(len(keys) * training_ratio)
-    train_keys = keys[:split_index]
-    test_keys = keys[split_index:]
 
-    train_data = np.concatenate([result[key] for key in train_keys])
-    test_data = np.concatenate([result[key] for key in test_keys])
+def is_training_query(query_id, training_ratio, seed=0):
+    """Assign a query deterministically to the training or test set by hashing its id, all its plans end up in the same set"""
+    return zlib.crc32(f'{seed}:{query_id}'.encode()) < training_ratio * 2 ** 32
 
-    return train_data, test_data
+
+def stream_experience(benchmark=None, training_ratio=0.8, batch_size=EXPERIENCE_BATCH_SIZE, seed=0):
+    """Stream the experience to train BAO in batches instead of loading all measured plans at once.
+    The rows are fetched using a server-side cursor, the train/test split is based on hashed query ids (see is_training_query).
+    :returns: generator of (training MeasurementTable, test MeasurementTable) per batch
+    """
+    with _db() as conn:
+        cursor = conn.execution_options(stream_results=True).execute(text(EXPERIENCE_STATEMENT), benchmark=benchmark_name(benchmark))
+        for rows in cursor.partitions(batch_size):
+            table = _measurement_table(rows)
+            yield table.split_by_query([query_id for query_id in np.unique(table.query_ids).tolist()
+                                        if is_training_query(query_id, training_ratio, seed)])
 
 
 def register_rule(query_path, rule, table):
@@ -209,9 +489,9 @@ def get_optimizers(table_name, query_path, projections):
         stmt = f"""
                SELECT {','.join(projections)}
                FROM queries q, {table_name} qro
-               WHERE q.query_path='{query_path}' AND q.id = qro.query_id
+               WHERE q.query_path = $1 AND q.id = qro.query_id
                """
-        cursor = conn.execute(stmt)
+        cursor = _execute_prepared(conn, f'select_{table_name}_{"_".join(projections)}', ['text'], stmt, query_path)
         return cursor.fetchall()
 
 
@@ -239,72 +519,368 @@ def get_df(query):
         return df
 
 
+def check_plan_hash(query_path, disabled_rules, plan_hash):
+    """Check if another optimizer configuration of the query has already produced a query plan with the same hash.
+    The plan hash is remembered for the given configuration, i.e. later configurations see it even before the config row is written.
+    Checking a configuration again returns the same answer, only the first configuration that produced the plan is distinct.
+    :returns: query plan is already known and a duplicate
+    """
+    with CACHE.lock:
+        query_id = CACHE.query_ids.get(query_path)
+        hashes = CACHE.plan_hashes.get(query_id)
+    if hashes is None:
+        with _db() as conn:
+            hashes = _plan_hashes(conn, _query_id(conn, query_path))
+    with CACHE.lock:
+        configs = hashes.setdefault(plan_hash, {})
+        configs.setdefault(str(disabled_rules))
+        return next(iter(configs)) != str(disabled_rules)
+
+
+def _store_plan(conn, plan):
+    """Store the plan once in the content-addressed plan store
+    :returns: the digest referencing the plan, None if there is no plan
+    """
+    if plan is None:
+        return None
+    digest = plan_digest(plan)
+    with CACHE.lock:
+        if digest in CACHE.plan_digests:
+            return digest
+    codec, data = compress_plan(plan)
+    stmt = 'INSERT INTO plan_blobs (digest, codec, plan) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING'
+    _execute_prepared(conn, 'insert_plan_blob', ['bytea', 'text', 'bytea'], stmt, digest, codec, data)
+    with CACHE.lock:
+        CACHE.plan_digests.add(digest)
+    return digest
+
+
+def insert_query_config(conn, query_path, disabled_rules, logical_dot, fragmented_dot, logical_json, fragmented_json, plan_hash, is_duplicate):
+    """Insert the query optimizer configuration, configurations that have already been inserted are skipped"""
+    query_id = _query_id(conn, query_path)
+    num_disabled_rules = 0 if disabled_rules is None else disabled_rules.count(',') + 1
+    stmt = """INSERT INTO query_optimizer_configs
+           (query_id, disabled_rules, logical_plan_dot_digest,
+           fragmented_plan_dot_digest, logical_plan_json_digest, fragmented_plan_json_digest,
+            num_disabled_rules, hash, duplicated_plan)
+           VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+           ON CONFLICT DO NOTHING
+           RETURNING id
+           """
+    config_id = _execute_prepared(conn, 'insert_query_config', ['integer', 'text', 'bytea', 'bytea', 'bytea', 'bytea', 'integer', 'integer', 'boolean'], stmt,
+                                  query_id, str(disabled_rules), _store_plan(conn, logical_dot), _store_plan(conn, fragmented_dot),
+                                  _store_plan(conn, None if logical_json is None else json.dumps(logical_json)),
+                                  _store_plan(conn, None if fragmented_json is None else json.dumps(fragmented_json)),
+                                  num_disabled_rules, plan_hash, is_duplicate).scalar()
+    if config_id is not None:
+        with CACHE.lock:
+            CACHE.config_ids[(query_id, str(disabled_rules))] = config_id
+            CACHE.plan_hashes.get(query_id, {}).setdefault(plan_hash, {}).setdefault(str(disabled_rules))
+
+
+def compact_plans(batch_size=1000):
+    """Move the inline plans of configs stored by previous versions into the plan store"""
+    columns = ['logical_plan_dot', 'fragmented_plan_dot', 'logical_plan_json', 'fragmented_plan_json']
+    select = f"""SELECT id, {', '.join(columns)} FROM query_optimizer_configs
+                 WHERE {' OR '.join(f'{column} IS NOT NULL' for column in columns)}
+                 LIMIT :batch_size"""
+    update = f"""UPDATE query_optimizer_configs
+                 SET {', '.join(f'{column} = NULL, {column}_digest = :{column}' for column in columns)}
+                 WHERE id = :id"""
+    num_configs = 0
+    while True:
+        with _db() as conn, conn.begin():
+            rows = conn.execute(text(select), batch_size=batch_size).fetchall()
+            for config_id, *plans in rows:
+                # plans that have not been exported were stored as 'None' (dot) or 'null' (json)
+                digests = {column: None if plan in (None, 'None', 'null') else _store_plan(conn, plan) for column, plan in zip(columns, plans)}
+                conn.execute(text(update), id=config_id, **digests)
+        num_configs += len(rows)
+        if len(rows) < batch_size:
+            bao_logging.info('Moved the plans of %s configs into the plan store', num_configs)
+            return
+
+
 def register_query_config(query_path, disabled_rules, logical_dot, fragmented_dot, logical_json, fragmented_json, plan_hash):
     """
     Store the passed query optimizer configuration in the database.
     :returns: query plan is already known and a duplicate
     """
-    check_for_duplicated_plans = """SELECT count(*)
-        from queries q, query_optimizer_configs qoc
-        where q.id = qoc.query_id
-              and q.query_path = '{0}'
-              and qoc.hash = {1}
-              and qoc.disabled_rules != '{2}'"""
-    result = select_query(check_for_duplicated_plans.format(query_path, plan_hash, disabled_rules))
-    is_duplicate = result[0] > 0
+    is_duplicate = check_plan_hash(query_path, disabled_rules, plan_hash)
+    with _db() as conn, conn.begin():
+        insert_query_config(conn, query_path, disabled_rules, logical_dot, fragmented_dot, logical_json, fragmented_json, plan_hash, is_duplicate)
+    return is_duplicate
+
 
+def check_for_existing_measurements(query_path, disabled_rules):
     with _db() as conn:
+        config_id = _config_id(conn, _query_id(conn, query_path), disabled_rules)
+        if config_id is None:
+            return False
+        stmt = 'select count(*) as num_measurements from measurements where query_optimizer_config_id = $1'
+        result = _execute_prepared(conn, 'count_measurements', ['integer'], stmt, config_id)
+        return result.scalar() > 0
+
+
+# the runtime statistics keep a uniform sample of this many runtimes (and cpu times) per config to compute the median
+MAX_RUNTIME_SAMPLES = 1000
+
+
+def _sample(values, value, num_values):
+    """Reservoir sampling: add the value to the uniform sample of the num_values values seen before, the sample is bounded by MAX_RUNTIME_SAMPLES"""
+    if len(values) < MAX_RUNTIME_SAMPLES:
+        values.append(value)
+    else:
+        index = random.randrange(num_values + 1)
+        if index < MAX_RUNTIME_SAMPLES:
+            values[index] = value
+    return values
+
+
+def _upsert_runtime_stats(conn, config_id, num_measurements, runtimes, cpu_times, runtime_mean, runtime_min, runtime_max):
+    """:param runtimes: sample of the runtimes (see MAX_RUNTIME_SAMPLES), the median is computed from the sample, mean, min, and max are exact"""
+    stmt = """INSERT INTO config_runtime_stats (query_optimizer_config_id, num_measurements, runtimes, cpu_times,
+                  runtime_median, runtime_mean, runtime_min, runtime_max, cpu_time_median)
+              VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+              ON CONFLICT (query_optimizer_config_id) DO UPDATE SET
+                  num_measurements = excluded.num_measurements, runtimes = excluded.runtimes, cpu_times = excluded.cpu_times,
+                  runtime_median = excluded.runtime_median, runtime_mean = excluded.runtime_mean, runtime_min = excluded.runtime_min,
+                  runtime_max = excluded.runtime_max, cpu_time_median = excluded.cpu_time_median"""
+    runtimes = sorted(runtimes)
+    cpu_times = sorted(cpu_times)
+    _execute_prepared(conn, 'upsert_runtime_stats', ['integer', 'integer', 'text', 'text', 'decimal', 'decimal', 'integer', 'integer', 'decimal'], stmt,
+                      config_id, num_measurements, json.dumps(runtimes), json.dumps(cpu_times), statistics.median(runtimes), runtime_mean,
+                      runtime_min, runtime_max, statistics.median(cpu_times) if len(cpu_times) > 0 else None)
+
+
+def _update_runtime_stats(conn, config_id, runtime, cpu):
+    """Add the measurement to the runtime statistics of the config, the row of the config is locked until the transaction ends"""
+    # the empty row is locked by the first of concurrent writers, the others read the statistics once it committed
+    insert = """INSERT INTO config_runtime_stats (query_optimizer_config_id, num_measurements, runtimes, cpu_times) VALUES ($1, 0, '[]', '[]')
+                ON CONFLICT DO NOTHING"""
+    _execute_prepared(conn, 'insert_runtime_stats', ['integer'], insert, config_id)
+    stmt = f"""SELECT num_measurements, runtimes, cpu_times, runtime_mean, runtime_min, runtime_max FROM config_runtime_stats
+               WHERE query_optimizer_config_id = $1 {BACKEND.row_lock}"""
+    num_measurements, runtimes, cpu_times, runtime_mean, runtime_min, runtime_max = \
+        _execute_prepared(conn, 'select_runtime_stats', ['integer'], stmt, config_id).fetchone()
+    runtimes, cpu_times = json.loads(runtimes), json.loads(cpu_times)
+    if num_measurements == 0:
+        runtime_mean, runtime_min, runtime_max = runtime, runtime, runtime
+    else:
+        runtime_mean = (float(runtime_mean) * num_measurements + runtime) / (num_measurements + 1)
+        runtime_min, runtime_max = min(runtime_min, runtime), max(runtime_max, runtime)
+    _sample(runtimes, runtime, num_measurements)
+    if cpu is not None:
+        _sample(cpu_times, float(cpu), num_measurements)
+    _upsert_runtime_stats(conn, config_id, num_measurements + 1, runtimes, cpu_times, runtime_mean, runtime_min, runtime_max)
+
+
+def rebuild_runtime_stats(conn):
+    """Recompute the runtime statistics of all configs from their measurements"""
+    rows = conn.execute(text("""SELECT query_optimizer_config_id, running + finishing, cpu_time FROM measurements
+                                WHERE running IS NOT NULL AND finishing IS NOT NULL AND NOT warmup
+                                ORDER BY query_optimizer_config_id""")).fetchall()
+    conn.execute(text('DELETE FROM config_runtime_stats'))
+    for config_id, measurements in itertools.groupby(rows, key=lambda row: row[0]):
+        measurements = list(measurements)
+        runtimes = [runtime for _, runtime, _ in measurements]
+        cpu_times = [float(cpu) for _, _, cpu in measurements if cpu is not None]
+        _upsert_runtime_stats(conn, config_id, len(runtimes), random.sample(runtimes, min(len(runtimes), MAX_RUNTIME_SAMPLES)),
+                              random.sample(cpu_times, min(len(cpu_times), MAX_RUNTIME_SAMPLES)), statistics.mean(runtimes), min(runtimes),
+                              max(runtimes))
+    bao_logging.info('Rebuilt runtime statistics from %s measurements', len(rows))
+
+
+def insert_measurement(conn, query_path, disabled_rules, elapsed, planning, scheduling, running, finishing, cpu, input_data_size, nodes, now,
+                       warmup=False, stop_reason=None, censored=False, fetch_rows=None, fetch_seconds=None):
+    config_id = _config_id(conn, _query_id(conn, query_path), disabled_rules)
+    if config_id is None:
+        bao_logging.error('Cannot store measurement, there is no config for query %s and the disabled rules/optimizers [%s]', query_path, disabled_rules)
+        return
+    stmt = """INSERT INTO measurements (query_optimizer_config_id, elapsed, planning, scheduling, running,
+            finishing, machine, time, cpu_time, input_data_size, nodes, benchmark, warmup, stop_reason, censored, fetch_rows, fetch_seconds)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17)
+            """
+    _execute_prepared(conn, 'insert_measurement', ['integer', 'integer', 'integer', 'integer', 'integer', 'integer', 'text', 'timestamp', 'decimal',
+                                                   'bigint', 'integer', 'text', 'boolean', 'text', 'boolean', 'bigint', 'double precision'], stmt,
+                      config_id, elapsed, planning, scheduling, running, finishing, socket.gethostname(), now, cpu, input_data_size, nodes,
+                      query_benchmark(query_path), warmup, stop_reason, censored, fetch_rows, fetch_seconds)
+    # censored runs enter the statistics with their deadline, i.e. the config is worse than the baseline
+    if not warmup:
+        _update_runtime_stats(conn, config_id, running + finishing, cpu)
+
+
+def register_measurement(query_path, disabled_rules, elapsed, planning, scheduling, running, finishing, cpu, input_data_size, nodes,
+                         warmup=False, stop_reason=None, censored=False, fetch_rows=None, fetch_seconds=None):
+    bao_logging.info('register a new measurement for query %s and the disabled rules/optimizers [%s]', query_path, disabled_rules)
+    with _db() as conn, conn.begin():
+        insert_measurement(conn, query_path, disabled_rules, elapsed, planning, scheduling, running, finishing, cpu, input_data_size, nodes, datetime.now(),
+                           warmup, stop_reason, censored, fetch_rows, fetch_seconds)
 
-        def literal_processor(val):
-            return sqlalchemy.String('').literal_processor(dialect=ENGINE.dialect)(value=str(val))
 
-        try:
-            # created_dot_processed = literal_processor(created_dot)
-            logical_dot_processed = literal_processor(logical_dot)
-            fragmented_dot_processed = literal_processor(fragmented_dot)
-            logical_json_processed = literal_processor(
-                json.dumps(logical_json))
-            fragmented_json_processed = literal_processor(
-                json.dumps(fragmented_json))
-
-            num_disabled_rules = 0 if disabled_rules is None else disabled_rules.count(',') + 1
-            stmt = f"""INSERT INTO query_optimizer_configs
-                   (query_id, disabled_rules, logical_plan_dot,
-                   fragmented_plan_dot, logical_plan_json, fragmented_plan_json,
-                    num_disabled_rules, hash, duplicated_plan) 
-                   SELECT id, '{disabled_rules}', {logical_dot_processed}, {fragmented_dot_processed}, {logical_json_processed}, {fragmented_json_processed}, {num_disabled_rules}, {plan_hash}, {is_duplicate} from queries where query_path = '{query_path}'
-                   """
-            conn.execute(stmt)
-        except IntegrityError:
-            pass  # query configuration has already been inserted
+def get_runtimes(query_path, disabled_rules):
+    """:returns: runtimes (running + finishing) of the config without warm-up runs, empty if the config has not been measured"""
+    stmt = 'SELECT runtimes FROM config_runtime_stats WHERE query_optimizer_config_id = $1'
+    with _db() as conn:
+        config_id = _config_id(conn, _query_id(conn, query_path), disabled_rules)
+        if config_id is None:
+            return []
+        runtimes = _execute_prepared(conn, 'select_runtimes', ['integer'], stmt, config_id).scalar()
+        return [] if runtimes is None else json.loads(runtimes)
 
-    return is_duplicate
 
+def completed_configs(query_path, min_measurements):
+    """Configs whose repetition has been completed, i.e. their measurements store a stop reason (see repetition.py),
+    or measurements of previous versions that have at least min_measurements runs
+    :returns: disabled rules of the configs
+    """
+    stmt = """SELECT qoc.disabled_rules
+              FROM query_optimizer_configs qoc, measurements m
+              WHERE qoc.id = m.query_optimizer_config_id
+                AND qoc.query_id = :query_id
+              GROUP BY qoc.disabled_rules
+              HAVING count(*) >= :min_measurements OR count(m.stop_reason) > 0"""
+    with _db() as conn:
+        rows = conn.execute(text(stmt), query_id=_query_id(conn, query_path), min_measurements=min_measurements).fetchall()
+        return {row[0] for row in rows}
 
-def check_for_existing_measurements(query_path, disabled_rules):
-    query = f"""select count(*) as num_measurements
-                from measurements m, query_optimizer_configs qoc, queries q
-                where m.query_optimizer_config_id = qoc.id
-                and qoc.query_id = q.id
-                and q.query_path = '{query_path}'
-                and qoc.disabled_rules = '{disabled_rules}'
-             """
-    df = get_df(query)
-    values = df['num_measurements']
-    return values[0] > 0
-
-
-def register_measurement(query_path, disabled_rules, elapsed, planning, scheduling, running, finishing, cpu, input_data_size, nodes):
-    bao_logging.info('register a new measurement for query %s and the disabled rules/optimizers [%s]', query_path, disabled_rules)
+
+def save_exploration_state(query_path, stage, configs, blacklisted_configs, finished=False):
+    """Checkpoint the DP exploration of the query, see OptimizerConfig.checkpoint"""
+    stmt = """INSERT INTO exploration_state (query_id, stage, configs, blacklisted_configs, finished, updated)
+              VALUES ($1, $2, $3, $4, $5, $6)
+              ON CONFLICT (query_id) DO UPDATE SET
+                  stage = excluded.stage, configs = excluded.configs, blacklisted_configs = excluded.blacklisted_configs,
+                  finished = excluded.finished, updated = excluded.updated"""
+    with _db() as conn, conn.begin():
+        _execute_prepared(conn, 'save_exploration_state', ['integer', 'integer', 'text', 'text', 'boolean', 'timestamp'], stmt,
+                          _query_id(conn, query_path), stage, json.dumps(configs), json.dumps(blacklisted_configs), finished, datetime.now())
+
+
+def load_exploration_state(query_path):
+    """:returns: stage, configs, blacklisted configs, and whether the exploration finished, None if there is no checkpoint"""
+    stmt = 'SELECT stage, configs, blacklisted_configs, finished FROM exploration_state WHERE query_id = :query_id'
+    with _db() as conn:
+        row = conn.execute(text(stmt), query_id=_query_id(conn, query_path)).fetchone()
+    if row is None:
+        return None
+    stage, configs, blacklisted_configs, finished = row
+    return stage, json.loads(configs), json.loads(blacklisted_configs), bool(finished)
+
+
+def enqueue_work(query_paths, mode):
+    """Add the queries to the work queue of the mode (e.g. record_time), queries that are already queued keep their status"""
+    with _db() as conn, conn.begin():
+        _insert_ignore_duplicates(conn, 'work_items', ['query_path', 'mode'], [(query_path, mode) for query_path in query_paths])
+
+
+def claim_work(worker, mode, lease_seconds, max_attempts):
+    """Claim the next pending work item, or a running one whose lease expired because its driver stopped sending heartbeats.
+    Items that lost their lease max_attempts times are marked as failed.
+    :returns: id, query path, and attempt of the claimed item, None if the queue is drained
+    """
+    with _db() as conn, conn.begin():
+        conn.execute(text(f"""UPDATE work_items SET status = 'failed', updated = {BACKEND.now}
+                              WHERE mode = :mode AND status = 'running' AND lease_expires < {BACKEND.now} AND attempts >= :max_attempts"""),
+                     mode=mode, max_attempts=max_attempts)
+        row = conn.execute(text(f"""UPDATE work_items
+                                    SET status = 'running', worker = :worker, lease_expires = {BACKEND.lease_expiry}, attempts = attempts + 1,
+                                        updated = {BACKEND.now}
+                                    WHERE id = (SELECT id FROM work_items
+                                                WHERE mode = :mode AND attempts < :max_attempts
+                                                  AND (status = 'pending' OR (status = 'running' AND lease_expires < {BACKEND.now}))
+                                                ORDER BY id LIMIT 1 {BACKEND.claim_lock})
+                                    RETURNING id, query_path, attempts"""),
+                           worker=worker, mode=mode, lease_seconds=lease_seconds, max_attempts=max_attempts).fetchone()
+    return None if row is None else tuple(row)
+
+
+def renew_lease(item_id, worker, lease_seconds):
+    """Heartbeat of a running work item
+    :returns: whether the worker still holds the lease, it is lost if the lease expired and another driver claimed the item
+    """
+    with _db() as conn, conn.begin():
+        result = conn.execute(text(f"""UPDATE work_items SET lease_expires = {BACKEND.lease_expiry}, updated = {BACKEND.now}
+                                       WHERE id = :id AND worker = :worker AND status = 'running'"""),
+                              id=item_id, worker=worker, lease_seconds=lease_seconds)
+        return result.rowcount > 0
+
+
+def finish_work(item_id, worker, status):
+    """Set the status of a work item claimed by the worker: done, failed, or pending to hand it over to another driver"""
+    with _db() as conn, conn.begin():
+        conn.execute(text(f"""UPDATE work_items SET status = :status, lease_expires = NULL, updated = {BACKEND.now}
+                              WHERE id = :id AND worker = :worker AND status = 'running'"""),
+                     status=status, id=item_id, worker=worker)
+
+
+def work_queue_status(mode):
+    """:returns: number of work items per status"""
     with _db() as conn:
-        now = datetime.now()
-        query = f"""INSERT INTO measurements (query_optimizer_config_id, elapsed, planning, scheduling, running,
-                finishing, machine, time, cpu_time, input_data_size, nodes) 
-                SELECT id, {elapsed}, {planning}, {scheduling}, {running}, {finishing}, '{socket.gethostname()}', '{now.strftime('%m/%d/%Y, %H:%M:%S')}', {cpu}, {input_data_size}, {nodes} FROM query_optimizer_configs 
-                WHERE query_id = (SELECT id from queries where query_path = '{query_path}') and disabled_rules = '{disabled_rules}'
-                """
-        conn.execute('SET datestyle = mdy;')
-        conn.execute(query)
+        rows = conn.execute(text('SELECT status, count(*) FROM work_items WHERE mode = :mode GROUP BY status'), mode=mode).fetchall()
+    return dict(rows)
+
+
+def write_batch(operations):
+    """Run the given storage operations, pairs of an insert function (e.g. insert_measurement) and its keyword arguments, in one transaction.
+    :returns: the results of the operations
+    """
+    try:
+        with _db() as conn, conn.begin():
+            return [operation(conn, **kwargs) for operation, kwargs in operations]
+    except Exception:
+        CACHE.invalidate()
+        raise
+
+
+def migrate_benchmarks(conn):
+    """Derive the benchmark of existing queries and measurements, postgres moves the measurements into a table partitioned by benchmark"""
+    for query_id, query_path in conn.execute(text('SELECT id, query_path FROM queries WHERE benchmark IS NULL')).fetchall():
+        conn.execute(text('UPDATE queries SET benchmark = :benchmark WHERE id = :id'), benchmark=query_benchmark(query_path), id=query_id)
+    conn.execute(text("""UPDATE measurements SET benchmark = (SELECT q.benchmark
+                                                              FROM query_optimizer_configs qoc JOIN queries q ON q.id = qoc.query_id
+                                                              WHERE qoc.id = measurements.query_optimizer_config_id)
+                         WHERE benchmark IS NULL"""))
+    benchmarks = [row[0] for row in conn.execute(text('SELECT DISTINCT benchmark FROM queries')).fetchall()]
+    BACKEND.partition_measurements(conn, benchmarks)
+
+
+# (schema version, migration) pairs, the migration runs when a database of an older version is bootstrapped
+SCHEMA_MIGRATIONS = [(3, rebuild_runtime_stats), (5, migrate_benchmarks)]
+
+
+class MissingIndexError(Exception):
+    """A hot lookup scans whole tables, i.e. the database lacks an index that the lookup requires"""
+
+
+# hot lookups that must be answered using indexes, see check_index_usage()
+INDEXED_STATEMENTS = {
+    'query id': ('SELECT id FROM queries WHERE query_path = :query_path', {'query_path': 'queries/job/1a.sql'}),
+    'config id': ('SELECT id FROM query_optimizer_configs WHERE query_id = :query_id AND disabled_rules = :disabled_rules',
+                  {'query_id': 1, 'disabled_rules': 'None'}),
+    'plan hashes': ('SELECT hash, disabled_rules FROM query_optimizer_configs WHERE query_id = :query_id', {'query_id': 1}),
+    'duplicate plans': ('SELECT id FROM query_optimizer_configs WHERE query_id = :query_id AND hash = :hash', {'query_id': 1, 'hash': 1}),
+    'measurements': ('SELECT count(*) FROM measurements WHERE query_optimizer_config_id = :config_id', {'config_id': 1}),
+    'benchmark queries': ('SELECT id FROM queries WHERE benchmark = :benchmark', {'benchmark': 'job'}),
+    'experience': (EXPERIENCE_STATEMENT, {'benchmark': 'job'}),
+}
+
+
+def check_index_usage():
+    """Check that the hot lookups do not scan whole tables, the planner is asked to avoid sequential scans,
+    i.e. a remaining scan means that there is no suitable index
+    :raises MissingIndexError: if any lookup scans tables
+    """
+    with _db() as conn, conn.begin():
+        scans = {name: BACKEND.scanned_tables(conn, statement, params) for name, (statement, params) in INDEXED_STATEMENTS.items()}
+    missing = [f'{name} lookup scans the tables {scanned_tables}' for name, scanned_tables in scans.items() if len(scanned_tables) > 0]
+    if len(missing) > 0:
+        raise MissingIndexError(', '.join(missing))
+    bao_logging.info('All %s hot lookups use indexes', len(INDEXED_STATEMENTS))
+
+
+def flush():
+    """Writes are synchronous, this exists for compatibility with the asynchronous measurement_sink.MeasurementSink"""
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+"""This module implements the database backends of the storage module: a postgres server or an embedded sqlite file"""
+import json
+import os
+import re
+import statistics
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import text
+from custom_logging import bao_logging
+
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 10
+POOL_RECYCLE_SECONDS = 3600
+# arbitrary key of the advisory lock that serializes the schema bootstrap of concurrent driver processes
+SCHEMA_LOCK_KEY = 4711
+# indexes of the measurements table (see schema.sql), they are recreated when the table gets partitioned
+MEASUREMENT_INDEXES = ['CREATE INDEX IF NOT EXISTS measurements_id_idx ON measurements (id)',
+                       'CREATE INDEX IF NOT EXISTS measurements_config_idx ON measurements (query_optimizer_config_id)']
+
+
+class PostgresBackend:
+    """Store the experience in a postgres server, configured using the env variables DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, and DB_SCHEMA"""
+    name = 'postgres'
+    schema_file = 'schema.sql'
+    measurement_id = 'id'
+    # concurrent drivers skip work items that another driver is claiming instead of waiting for its transaction
+    claim_lock = 'FOR UPDATE SKIP LOCKED'
+    # concurrent writers of the runtime statistics of a config wait for each other instead of overwriting each other's measurements
+    row_lock = 'FOR UPDATE'
+    # leases are computed by the clock of the database server, the drivers' clocks might differ
+    now = 'LOCALTIMESTAMP'
+    lease_expiry = "LOCALTIMESTAMP + :lease_seconds * INTERVAL '1 second'"
+
+    def __init__(self):
+        self.partitions = set()
+
+    def create_engine(self):
+        user = os.getenv('DB_USER')
+        database = os.getenv('DB_NAME')
+        password = os.getenv('DB_PASSWORD')
+
+        host = os.getenv('DB_HOST')
+        if host is None:
+            host = os.getenv('POSTGRES_SERVICE_HOST')
+        assert host is not None
+
+        # pooled connections are configured once when they are opened instead of on every checkout
+        schema = os.getenv('DB_SCHEMA')
+        options = '' if schema is None else f'-c search_path={schema}'
+
+        url = f'postgresql://{user}:{password}@{host}:5432/{database}'
+        bao_logging.info('Connect to database: %s', url)
+        return create_engine(url, pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, pool_recycle=POOL_RECYCLE_SECONDS,
+                             connect_args={'options': options})
+
+    def execute_ddl(self, conn, statement):
+        conn.execute(statement)
+
+    def lock_schema(self, conn):
+        """Serialize the schema bootstrap of concurrent drivers until the end of the current transaction"""
+        conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), key=SCHEMA_LOCK_KEY)
+
+    def execute_prepared(self, conn, name, param_types, statement, params):
+        prepared = conn.info.setdefault('prepared_statements', set())
+        if name not in prepared:
+            conn.exec_driver_sql(f'PREPARE {name} ({", ".join(param_types)}) AS {statement}')
+            prepared.add(name)
+        placeholders = ', '.join(['%s'] * len(params))
+        return conn.exec_driver_sql(f'EXECUTE {name} ({placeholders})', tuple(params))
+
+    def create_partition(self, conn, benchmark):
+        """Create the measurements partition of the benchmark if it does not exist yet"""
+        if benchmark in self.partitions:
+            return
+        self.lock_schema(conn)
+        name = re.sub(r'[^a-z0-9_]', '_', benchmark.lower())
+        value = benchmark.replace("'", "''")
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS measurements_{name} PARTITION OF measurements FOR VALUES IN ('{value}')"))
+        self.partitions.add(benchmark)
+
+    def partition_measurements(self, conn, benchmarks):
+        """Move the measurements into a table partitioned by benchmark (list partitioning), measurements of benchmarks
+        without a partition end up in the default partition"""
+        partitioned = conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = 'measurements'::regclass")).scalar()
+        if not partitioned:
+            bao_logging.info('Partition the measurements by benchmark')
+            conn.execute(text('ALTER TABLE measurements RENAME TO measurements_unpartitioned'))
+            conn.execute(text('DROP INDEX IF EXISTS measurements_id_idx, measurements_config_idx'))
+            conn.execute(text('CREATE TABLE measurements (LIKE measurements_unpartitioned INCLUDING DEFAULTS) PARTITION BY LIST (benchmark)'))
+            conn.execute(text('ALTER TABLE measurements ADD FOREIGN KEY (query_optimizer_config_id) REFERENCES query_optimizer_configs'))
+            # serial columns (id, input_data_size) keep their sequences
+            owned_sequences = conn.execute(text("""SELECT s.relname, a.attname
+                                                 FROM pg_depend d
+                                                      JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+                                                      JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+                                                 WHERE d.refobjid = 'measurements_unpartitioned'::regclass AND d.deptype = 'a'""")).fetchall()
+            for sequence, column in owned_sequences:
+                conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY measurements.{column}'))
+            conn.execute(text('CREATE TABLE measurements_default PARTITION OF measurements DEFAULT'))
+            for benchmark in benchmarks:
+                self.create_partition(conn, benchmark)
+            conn.execute(text('INSERT INTO measurements SELECT * FROM measurements_unpartitioned'))
+            conn.execute(text('DROP TABLE measurements_unpartitioned'))
+        for statement in MEASUREMENT_INDEXES:
+            conn.execute(text(statement))
+
+    def scanned_tables(self, conn, statement, params):
+        """:returns: tables that are read by sequential scans although the planner is asked to avoid them"""
+        conn.execute(text('SET LOCAL enable_seqscan = off'))
+        plan = conn.execute(text(f'EXPLAIN (FORMAT JSON) {statement}'), **params).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+
+        def _scans(node):
+            tables = [node['Relation Name']] if node['Node Type'] == 'Seq Scan' else []
+            for child in node.get('Plans', []):
+                tables.extend(_scans(child))
+            return tables
+
+        return _scans(plan[0]['Plan'])
+
+
+class Median:
+    """Median aggregate for sqlite, it matches the median() aggregate defined in schema.sql"""
+
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if len(self.values) == 0:
+            return None
+        return float(statistics.median(self.values))
+
+
+class SQLiteBackend:
+    """Store the experience in an embedded sqlite file (env variable DB_FILE), no database server is required"""
+    name = 'sqlite'
+    schema_file = 'schema_sqlite.sql'
+    # sqlite cannot add an autoincrement column to existing tables, but every row has an increasing rowid
+    measurement_id = 'rowid'
+    # sqlite serializes writers, the claiming update statement is atomic without row locks
+    claim_lock = ''
+    row_lock = ''
+    now = "datetime('now')"
+    lease_expiry = "datetime('now', :lease_seconds || ' seconds')"
+
+    def create_engine(self):
+        path = os.getenv('DB_FILE', 'bao.sqlite')
+        bao_logging.info('Open database file: %s', path)
+        # sqlite connections are only used by one thread at a time, the pool hands them over between driver and measurement sink
+        engine = create_engine(f'sqlite:///{path}', poolclass=QueuePool, pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                               connect_args={'check_same_thread': False, 'timeout': 60})
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_connection, _):
+            dbapi_connection.create_aggregate('median', 1, Median)
+            dbapi_connection.execute('PRAGMA journal_mode = WAL')
+            dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+        return engine
+
+    def execute_ddl(self, conn, statement):
+        # sqlite does not support ADD COLUMN IF NOT EXISTS, columns of previous bootstraps already exist
+        try:
+            conn.execute(statement)
+        except OperationalError as e:
+            if 'duplicate column name' not in str(e):
+                raise
+
+    def lock_schema(self, conn):
+        pass  # sqlite locks the database file for the first write of the transaction
+
+    def execute_prepared(self, conn, name, param_types, statement, params):
+        # sqlite3 caches prepared statements per connection, it only needs numbered placeholders
+        return conn.exec_driver_sql(re.sub(r'\$(\d+)', r'?\1', statement), tuple(params))
+
+    def create_partition(self, conn, benchmark):
+        pass  # sqlite does not support partitioning, the benchmark column is indexed instead
+
+    def partition_measurements(self, conn, benchmarks):
+        pass
+
+    def scanned_tables(self, conn, statement, params):
+        """:returns: tables that are read by full table scans"""
+        plan = conn.execute(text(f'EXPLAIN QUERY PLAN {statement}'), **params).fetchall()
+        # the detail is either 'SEARCH <table> USING ...', 'SCAN <table> USING COVERING INDEX ...', or a full 'SCAN <table>'
+        return [row[-1].split()[1] for row in plan if row[-1].startswith('SCAN ') and ' USING ' not in row[-1]]
+
+
+BACKENDS = {backend.name: backend for backend in [PostgresBackend, SQLiteBackend]}
+
+
+def get_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown storage backend {name}, choose one of {list(BACKENDS.keys())}')
+    return BACKENDS[name]()
+
@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import storage
+
+
+class SQLiteStorageTestCase(unittest.TestCase):
+    """Runs the test against a new sqlite database file, the engine of storage is reset before and after the test"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.dict(os.environ, {'DB_BACKEND': 'sqlite', 'DB_FILE': os.path.join(self.directory, 'bao.sqlite')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._reset_storage()
+        self.addCleanup(self._reset_storage)
+
+    @staticmethod
+    def _reset_storage():
+        if storage.ENGINE is not None:
+            storage.ENGINE.dispose()
+        storage.ENGINE = None
+        storage.BACKEND = None
+        storage.CACHE = storage.MetadataCache()
+
+    @staticmethod
+    def register_config(query_path, disabled_rules, plan, plan_hash, runtimes):
+        storage.register_query(query_path)
+        storage.register_query_config(query_path, disabled_rules, None, None, plan, None, plan_hash)
+        for runtime in runtimes:
+            storage.register_measurement(query_path, disabled_rules, runtime, 0, 0, runtime, 0, runtime, 0, 1)
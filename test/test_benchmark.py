@@ -0,0 +1,21 @@
+import unittest
+from unittest import mock
+
+import benchmark
+import work_queue
+from session_properties import QUERY_MAX_EXECUTION_TIME
+
+
+class TestRunConfig(unittest.TestCase):
+
+    def test_deadline_is_reset_if_the_run_raises(self):
+        session = mock.MagicMock(execution_timeout='4m')
+        with mock.patch.object(benchmark, 'run', side_effect=work_queue.LeaseLost('lease lost')), \
+                mock.patch.object(benchmark.settings, 'TIMEOUT_FACTOR', 3.0), mock.patch.object(benchmark.settings, 'TIMEOUT_SLACK_SECONDS', 10.0):
+            with self.assertRaises(work_queue.LeaseLost):
+                benchmark.run_config('rule', session, 'queries/job/1a.sql', baseline=[1000, 2000, 3000])
+        self.assertEqual(session.properties.set.call_args_list, [mock.call(QUERY_MAX_EXECUTION_TIME, '16000ms'), mock.call(QUERY_MAX_EXECUTION_TIME, '4m')])
+
+
+if __name__ == '__main__':
+    unittest.main()
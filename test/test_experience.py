@@ -0,0 +1,93 @@
+import importlib.util
+import json
+import unittest
+
+import numpy as np
+
+import storage
+from featurize import TreeFeaturizer
+from presto_query_plan.operators import FILTER, INNER_JOIN, TABLE_SCAN
+from test.sqlite_storage import SQLiteStorageTestCase
+
+HAS_MODEL_DEPENDENCIES = all(importlib.util.find_spec(module) is not None for module in ['torch', 'sklearn', 'joblib'])
+
+
+def scan(table, rows):
+    return {'name': FILTER, 'estimates': [{'cpuCost': rows * 10.0, 'rows': rows / 2}],
+            'children': [{'name': TABLE_SCAN, 'tableName': table, 'estimates': [{'cpuCost': rows * 5.0, 'rows': rows}]}]}
+
+
+def join_plan(query, config):
+    return {'name': INNER_JOIN, 'estimates': [{'cpuCost': 100.0 * (query + config), 'rows': 10.0 * config}],
+            'children': [scan(f't{query % 4}', 100 * (config + 1)), scan(f't{config % 3}', 1000 * (query + 1))]}
+
+
+def flatten(tree):
+    if isinstance(tree, tuple):
+        return np.concatenate([flatten(child) for child in tree])
+    return np.asarray(tree, dtype=float)
+
+
+class TestStreamExperience(SQLiteStorageTestCase):
+    num_queries = 6
+    num_configs = 3
+    # smaller than the configs of two queries, i.e. the plans of a query are split across batches
+    batch_size = 4
+
+    def setUp(self):
+        super().setUp()
+        for query in range(self.num_queries):
+            for config in range(self.num_configs):
+                disabled_rules = None if config == 0 else f'rule_{config}'
+                self.register_config(f'queries/job/{query}.sql', disabled_rules, join_plan(query, config), query * self.num_configs + config,
+                                     [1000 * (query + 1) + 10 * config + run for run in range(3)])
+
+    def stream(self):
+        return storage.stream_experience('job', training_ratio=0.5, batch_size=self.batch_size)
+
+    def test_split_by_query(self):
+        batches = list(self.stream())
+        self.assertGreater(len(batches), 1)
+        training_ids = np.concatenate([training.query_ids for training, _ in batches])
+        test_ids = np.concatenate([test.query_ids for _, test in batches])
+        self.assertEqual(len(training_ids) + len(test_ids), self.num_queries * self.num_configs)
+        self.assertFalse(set(training_ids.tolist()) & set(test_ids.tolist()))
+        for query_id in training_ids.tolist():
+            self.assertTrue(storage.is_training_query(query_id, 0.5))
+        # the median runtime (1000 * (query + 1) + 10 * config + 1) is streamed with the plan of the config
+        for training, test in batches:
+            for row in list(training) + list(test):
+                query, config = int(row.running_time) // 1000 - 1, int(row.running_time) % 1000 // 10
+                self.assertEqual(row.query_path, f'queries/job/{query}.sql')
+                self.assertEqual(json.loads(row.plan_json), join_plan(query, config))
+
+    def test_featurizer_fitted_on_stream(self):
+        featurizer = TreeFeaturizer()
+        for training, test in self.stream():
+            featurizer.partial_fit([json.loads(plan) for plan in training.plans_json() + test.plans_json()])
+        plans = [join_plan(query, config) for query in range(self.num_queries) for config in range(self.num_configs)]
+        reference = TreeFeaturizer()
+        reference.fit([json.loads(json.dumps(plan)) for plan in plans])
+        for streamed, expected in zip(featurizer.transform([json.loads(json.dumps(plan)) for plan in plans]),
+                                      reference.transform([json.loads(json.dumps(plan)) for plan in plans])):
+            np.testing.assert_allclose(flatten(streamed), flatten(expected))
+
+    @unittest.skipUnless(HAS_MODEL_DEPENDENCIES, 'the model requires torch and scikit-learn')
+    def test_fit_experience(self):
+        import model
+        regression_model = model.BaoRegression()
+        regression_model.fit_experience(self.stream)
+        num_training_rows = sum(len(training) for training, _ in self.stream())
+        self.assertEqual(regression_model.num_items_trained_on(), num_training_rows)
+        predictions = regression_model.predict([join_plan(0, config) for config in range(self.num_configs)])
+        self.assertEqual(len(predictions), self.num_configs)
+
+    @unittest.skipUnless(HAS_MODEL_DEPENDENCIES, 'the model requires torch and scikit-learn')
+    def test_fit_experience_without_experience(self):
+        import model
+        with self.assertRaises(ValueError):
+            model.BaoRegression().fit_experience(lambda: storage.stream_experience('stack'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import measurement_sink
+import storage
+from measurement_sink import MeasurementSink, SpillFile, spill_path
+
+
+class FlakyDatabase:
+    """Replaces storage.write_batch, the first calls fail and batches containing a rejected query path always fail"""
+
+    def __init__(self, failures, rejected=()):
+        self.failures = failures
+        self.rejected = set(rejected)
+        self.written = []
+
+    def write_batch(self, rows):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('database is unreachable')
+        query_paths = [kwargs['query_path'] for _, kwargs in rows]
+        if self.rejected.intersection(query_paths):
+            raise ValueError('constraint violation')
+        self.written.extend(query_paths)
+        return [True] * len(rows)
+
+
+class TestMeasurementSink(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spill_path = os.path.join(self.directory, 'sink.spill')
+        patcher = mock.patch.object(measurement_sink, 'RETRY_DELAY_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run_sink(self, database, query_paths, path=None):
+        """:returns: number of unwritten rows reported by flush and close"""
+        with mock.patch.object(storage, 'write_batch', database.write_batch):
+            sink = MeasurementSink(path=path or self.spill_path)
+            unwritten = []
+            for query_path in query_paths:
+                sink.register_query_fingerprint(query_path, b'fingerprint')
+                unwritten.append(sink.flush())
+            unwritten.append(sink.close())
+        return unwritten
+
+    def test_retry(self):
+        database = FlakyDatabase(measurement_sink.FLUSH_RETRIES - 1)
+        self.assertEqual(self._run_sink(database, ['q1', 'q2']), [0, 0, 0])
+        self.assertEqual(database.written, ['q1', 'q2'])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_spill_and_replay_with_next_batch(self):
+        database = FlakyDatabase(measurement_sink.FLUSH_RETRIES)
+        self._run_sink(database, ['q1', 'q2'])
+        # the failed batch is written before the next one
+        self.assertEqual(database.written, ['q1', 'q2'])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_replay_on_start(self):
+        unreachable = FlakyDatabase(float('inf'))
+        self.assertEqual(self._run_sink(unreachable, ['q1', 'q2']), [1, 2, 2])
+        self.assertEqual(unreachable.written, [])
+        self.assertTrue(os.path.exists(self.spill_path))
+
+        database = FlakyDatabase(0)
+        self.assertEqual(self._run_sink(database, ['q3']), [0, 0])
+        self.assertEqual(database.written, ['q1', 'q2', 'q3'])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_rejected_rows_do_not_block_later_batches(self):
+        database = FlakyDatabase(0, rejected=['q1'])
+        unwritten = self._run_sink(database, ['q1', 'q2', 'q3'])
+        self.assertEqual(database.written, ['q2', 'q3'])
+        self.assertEqual(unwritten[-1], 1)
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertEqual([kwargs['query_path'] for _, kwargs in SpillFile(f'{self.spill_path}.rejected').load()], ['q1'])
+
+    def test_adopt_spill_files_of_stopped_drivers(self):
+        own = spill_path(self.directory)
+        self.assertNotEqual(own, spill_path(self.directory, os.getppid()))
+        # spill files of running drivers are not adopted
+        SpillFile(spill_path(self.directory, os.getppid())).save([(storage.check_query_fingerprint, {'query_path': 'running'})])
+        stopped = spill_path(self.directory, 2 ** 22 + 1)
+        SpillFile(stopped).save([(storage.check_query_fingerprint, {'query_path': 'q1'})])
+
+        self.assertEqual(SpillFile(own).adopt_orphans(), 1)
+        self.assertFalse(os.path.exists(stopped))
+        self.assertTrue(os.path.exists(spill_path(self.directory, os.getppid())))
+        database = FlakyDatabase(0)
+        self._run_sink(database, ['q2'], path=own)
+        self.assertEqual(database.written, ['q1', 'q2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import random
+import unittest
+
+from repetition import CONVERGED, MAX_RUNS, REPEATS, WORSE_THAN_BASELINE, AdaptiveRepetition, FixedRepetition, median_confidence_interval, \
+    sign_test_greater
+
+
+def run_until_stop(repetition, runtimes):
+    """:returns: number of runs until the repetition stopped and the stop reason"""
+    for runs, runtime in enumerate(runtimes, start=1):
+        repetition.add(runtime)
+        stop_reason = repetition.stop_reason()
+        if stop_reason is not None:
+            return runs, stop_reason
+    return len(runtimes), None
+
+
+class TestMedianConfidenceInterval(unittest.TestCase):
+
+    def test_order_statistics(self):
+        # 5 values cover the median with at most 1 - 2 / 2^5 < 95%
+        self.assertIsNone(median_confidence_interval([1, 2, 3, 4, 5]))
+        self.assertEqual(median_confidence_interval([6, 1, 5, 2, 4, 3]), (1, 6))
+        # [x_(2), x_(8)] of 9 values covers the median with 1 - 2 * 10 / 2^9 > 95%
+        self.assertEqual(median_confidence_interval([9, 8, 7, 6, 5, 4, 3, 2, 1]), (2, 8))
+        self.assertEqual(median_confidence_interval([9, 8, 7, 6, 5, 4, 3, 2, 1], confidence=0.8), (3, 7))
+
+    def test_coverage(self):
+        rng = random.Random(0)
+        trials = 2000
+        # the median of the exponential distribution with rate 1 is ln(2)
+        covered = 0
+        for _ in range(trials):
+            lower, upper = median_confidence_interval([rng.expovariate(1) for _ in range(10)])
+            covered += lower <= 0.6931 <= upper
+        self.assertGreaterEqual(covered / trials, 0.94)
+
+
+class TestSignTest(unittest.TestCase):
+
+    def test_greater(self):
+        self.assertTrue(sign_test_greater([110] * 5, 100))
+        # p = 5 / 32 for 4 of 5 greater values
+        self.assertFalse(sign_test_greater([110] * 4 + [90], 100))
+        self.assertFalse(sign_test_greater([90] * 5, 100))
+
+    def test_ties_are_ignored(self):
+        self.assertFalse(sign_test_greater([100] * 10 + [110] * 4, 100))
+        self.assertTrue(sign_test_greater([100] * 10 + [110] * 5, 100))
+
+
+class TestAdaptiveRepetition(unittest.TestCase):
+
+    def test_warmup_runs(self):
+        for runtimes, warmup_runs in [([300, 100, 101, 99, 100], 1), ([300, 250, 100, 100, 100, 100], 2), ([300, 300, 300, 100, 100, 100, 100], 2),
+                                      ([110, 100, 100, 100], 0), ([300, 100, 100], 0)]:
+            repetition = AdaptiveRepetition()
+            for runtime in runtimes:
+                repetition.add(runtime)
+            self.assertEqual(repetition.warmup_runs(), warmup_runs, runtimes)
+            self.assertEqual(repetition.steady_runtimes(), runtimes[warmup_runs:])
+
+    def test_stops_on_convergence(self):
+        self.assertEqual(run_until_stop(AdaptiveRepetition(), [100] * 20), (6, CONVERGED))
+        # the warm-up run is excluded from the confidence interval
+        repetition = AdaptiveRepetition()
+        self.assertEqual(run_until_stop(repetition, [500] + [100] * 20), (7, CONVERGED))
+        self.assertEqual(repetition.warmup_runs(), 1)
+
+    def test_stops_on_worse_than_baseline(self):
+        repetition = AdaptiveRepetition(baseline=[100, 101, 99])
+        self.assertEqual(run_until_stop(repetition, [200, 210, 190, 220, 205, 200]), (5, WORSE_THAN_BASELINE))
+        # a plan as fast as the baseline converges instead
+        self.assertEqual(run_until_stop(AdaptiveRepetition(baseline=[100, 101, 99]), [100] * 20), (6, CONVERGED))
+
+    def test_stops_after_max_runs(self):
+        # too noisy to converge within 8 runs
+        rng = random.Random(0)
+        runtimes = [rng.uniform(50, 150) for _ in range(20)]
+        self.assertEqual(run_until_stop(AdaptiveRepetition(max_runs=8), runtimes), (8, MAX_RUNS))
+
+
+class TestFixedRepetition(unittest.TestCase):
+
+    def test_repeats(self):
+        repetition = FixedRepetition(3)
+        self.assertEqual(run_until_stop(repetition, [500, 100, 100, 100]), (3, REPEATS))
+        self.assertEqual(repetition.warmup_runs(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
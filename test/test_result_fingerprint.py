@@ -0,0 +1,58 @@
+import hashlib
+import random
+import unittest
+import zlib
+
+from result_fingerprint import ResultFingerprint, comparable
+
+
+def result(num_rows=1000):
+    return [(i, f'name {i % 17}', i * 0.25, None if i % 5 == 0 else i % 3 == 0) for i in range(num_rows)]
+
+
+def fingerprint(rows, sample_rate=1):
+    return ResultFingerprint(sample_rate).add_all(rows).digest()
+
+
+class TestResultFingerprint(unittest.TestCase):
+
+    def test_order_insensitive(self):
+        rows = result()
+        shuffled = list(rows)
+        random.Random(0).shuffle(shuffled)
+        self.assertEqual(fingerprint(shuffled), fingerprint(rows))
+        self.assertEqual(fingerprint(reversed(rows)), fingerprint(rows))
+
+    def test_different_results(self):
+        rows = result()
+        self.assertNotEqual(fingerprint(rows[:-1]), fingerprint(rows))
+        # results are multisets, duplicated rows count
+        self.assertNotEqual(fingerprint(rows + rows[:1]), fingerprint(rows))
+        self.assertNotEqual(fingerprint(rows[:-1] + [(999, 'name 13', 249.5, False)]), fingerprint(rows))
+
+    def test_float_normalization(self):
+        self.assertEqual(fingerprint([(1.0001, -0.0)]), fingerprint([(1.0, 0.0)]))
+        self.assertNotEqual(fingerprint([(1.01,)]), fingerprint([(1.0,)]))
+
+    def test_sampling(self):
+        rows = result()
+        shuffled = list(rows)
+        random.Random(1).shuffle(shuffled)
+        self.assertEqual(fingerprint(shuffled, sample_rate=4), fingerprint(rows, sample_rate=4))
+        self.assertNotEqual(fingerprint(rows, sample_rate=4), fingerprint(rows))
+        # the sample is chosen by the row content, rows outside of the sample only change the row count
+        sampled = [row for row in rows if zlib.crc32(repr(row).encode()) % 4 == 0]
+        self.assertLess(len(sampled), len(rows) / 2)
+        self.assertEqual(fingerprint(rows, sample_rate=4)[-16:], fingerprint(sampled, sample_rate=4)[-16:])
+        self.assertNotEqual(fingerprint(rows, sample_rate=4), fingerprint(sampled, sample_rate=4))
+
+    def test_comparable(self):
+        digest = fingerprint(result())
+        self.assertTrue(comparable(digest, fingerprint(result(10))))
+        self.assertFalse(comparable(digest, fingerprint(result(), sample_rate=4)))
+        # md5 hashes of previous versions
+        self.assertFalse(comparable(digest, hashlib.md5(b'result').digest()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import unittest
+
+from sqlalchemy.sql import text
+
+import storage
+from plan_store import plan_digest
+from test.sqlite_storage import SQLiteStorageTestCase
+
+
+class TestIndexUsage(SQLiteStorageTestCase):
+
+    def test_hot_lookups_use_indexes(self):
+        storage.check_index_usage()
+
+    def test_missing_index(self):
+        with storage._db() as conn, conn.begin():
+            conn.execute(text('DROP INDEX measurements_config_idx'))
+        with self.assertRaisesRegex(storage.MissingIndexError, 'measurements lookup scans the tables'):
+            storage.check_index_usage()
+
+
+
+class TestCompactPlans(SQLiteStorageTestCase):
+    num_configs = 5
+
+    def setUp(self):
+        super().setUp()
+        # configs stored by previous versions keep their plans inline, configs 1 and 2 share a plan, config 4 has not exported its plan
+        self.plans = [json.dumps({'name': 'InnerJoin', 'config': min(config, 1)}) for config in range(self.num_configs - 1)] + ['None']
+        for config, plan in enumerate(self.plans):
+            self.register_config('queries/job/1a.sql', None if config == 0 else f'rule_{config}', None, config, [100 + config])
+            with storage._db() as conn, conn.begin():
+                conn.execute(text("""UPDATE query_optimizer_configs SET logical_plan_json = :plan, logical_plan_dot = 'digraph {}'
+                                     WHERE disabled_rules = :disabled_rules"""), plan=plan, disabled_rules=str(None if config == 0 else f'rule_{config}'))
+
+    def _configs(self):
+        with storage._db() as conn:
+            return conn.execute(text("""SELECT logical_plan_json, logical_plan_dot, logical_plan_json_digest, logical_plan_dot_digest
+                                        FROM query_optimizer_configs ORDER BY id""")).fetchall()
+
+    def test_compact_plans(self):
+        experience = [(row.query_path, row.optimizer_config, row.plan_json, row.running_time) for row in storage.experience('job', 1.0)[0]]
+        self.assertEqual(len(experience), self.num_configs - 1)
+
+        storage.compact_plans(batch_size=2)
+
+        configs = self._configs()
+        self.assertTrue(all(json_plan is None and dot_plan is None for json_plan, dot_plan, _, _ in configs))
+        digests = [json_digest for _, _, json_digest, _ in configs]
+        self.assertEqual(digests, [plan_digest(plan) for plan in self.plans[:-1]] + [None])
+        self.assertEqual(len({bytes(digest) for digest in digests[:-1]}), 2)
+        plans = storage.get_plans(bytes(digest) for digest in digests[:-1])
+        self.assertEqual([plans[bytes(digest)].decompress() for digest in digests[:-1]], self.plans[:-1])
+        self.assertEqual({bytes(dot_digest) for _, _, _, dot_digest in configs}, {plan_digest('digraph {}')})
+        # the experience reads the plans from the plan store
+        self.assertEqual([(row.query_path, row.optimizer_config, row.plan_json, row.running_time) for row in storage.experience('job', 1.0)[0]],
+                         experience)
+
+        # compacting again does nothing
+        storage.compact_plans(batch_size=2)
+        self.assertEqual(self._configs(), configs)
+
+
+if __name__ == '__main__':
+    unittest.main()
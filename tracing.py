@@ -0,0 +1,176 @@
+"""This module records where the benchmark driver spends its time, e.g. planning, execution, callback waits, result fetch, and storage writes.
+
+Every phase is a span with the query path and config as attributes (nested spans inherit them). The spans are exported as Chrome trace
+JSON (open it in ui.perfetto.dev or chrome://tracing) and summarized in a table that splits the driver's time into cluster time (waiting for
+presto) and driver overhead. Tracing is disabled by default, disabled spans cost a function call.
+
+A phase can be profiled using cProfile, the profiles of all spans of the phase (on all threads) are merged and written next to the trace.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+from custom_logging import bao_logging
+
+# phases that wait for presto, the self time of all other phases is driver overhead. plan_wait is the driver waiting for the planning
+# sessions (their plan spans run on other threads and do not count as child time of the waiting span)
+CLUSTER = 'cluster'
+DRIVER = 'driver'
+CLUSTER_PHASES = {'plan', 'plan_wait', 'query_span', 'execute', 'drain', 'callback_wait'}
+PROFILE_TOP_FUNCTIONS = 25
+
+
+class _Span:
+    """A traced phase, its self time excludes the time of nested spans on the same thread"""
+    __slots__ = ('tracer', 'name', 'attributes', 'parent', 'start', 'child_seconds', 'profile')
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = None
+        self.child_seconds = 0.0
+        self.profile = None
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if len(stack) > 0:
+            self.parent = stack[-1]
+            self.attributes = {**self.parent.attributes, **self.attributes}
+        stack.append(self)
+        if self.name == self.tracer.profile_phase and not any(span.profile is not None for span in stack[:-1]):
+            self.profile = self.tracer.thread_profile()
+            self.profile.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        self.tracer.stack().pop()
+        if self.parent is not None:
+            self.parent.child_seconds += seconds
+        self.tracer.record(self, seconds, exc_type)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Collect the spans of all threads of the driver"""
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_phase = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = []
+        self.thread_names = {}
+        self.phases = {}
+        self.profiles = []
+        self.origin = time.perf_counter()
+
+    def enable(self, profile_phase=None):
+        self.enabled = True
+        self.profile_phase = profile_phase
+        self.origin = time.perf_counter()
+
+    def span(self, name, **attributes):
+        return _Span(self, name, attributes) if self.enabled else NULL_SPAN
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def thread_profile(self):
+        """cProfile only profiles the thread that enabled it, every thread uses its own profile"""
+        if not hasattr(self.local, 'profile'):
+            self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(self.local.profile)
+        return self.local.profile
+
+    def record(self, span, seconds, exc_type):
+        thread = threading.current_thread()
+        self_seconds = seconds - span.child_seconds
+        args = dict(span.attributes)
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+        event = {'name': span.name, 'cat': CLUSTER if span.name in CLUSTER_PHASES else DRIVER, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                 'ts': (span.start - self.origin) * 1e6, 'dur': seconds * 1e6, 'args': args}
+        with self.lock:
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+            count, total, self_total = self.phases.get(span.name, (0, 0.0, 0.0))
+            self.phases[span.name] = (count + 1, total + seconds, self_total + self_seconds)
+
+    def export(self, path):
+        """Write the spans as Chrome trace JSON, the profile of the profiled phase is written to <path>.<phase>.prof"""
+        with self.lock:
+            events = list(self.events)
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                        for tid, name in self.thread_names.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f, default=str)
+        bao_logging.info('Wrote %s spans to %s', len(events), path)
+        if self.profile_phase is not None and len(self.profiles) > 0:
+            stats = pstats.Stats(*self.profiles)
+            stats.dump_stats(f'{path}.{self.profile_phase}.prof')
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+    def summary(self):
+        """:returns: table of the phases (count, total and self time) and the split of the wall time into cluster time and driver overhead.
+        Spans of concurrent threads (e.g. planning sessions, result fetch) overlap, their shares can add up to more than 100%."""
+        wall = time.perf_counter() - self.origin
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda phase: -phase[1][2])
+        lines = [f'{"phase":<16} {"category":<8} {"count":>7} {"total [s]":>10} {"self [s]":>10} {"mean [ms]":>10} {"share":>7}']
+        seconds = {CLUSTER: 0.0, DRIVER: 0.0}
+        for name, (count, total, self_total) in phases:
+            category = CLUSTER if name in CLUSTER_PHASES else DRIVER
+            seconds[category] += self_total
+            lines.append(f'{name:<16} {category:<8} {count:>7} {total:>10.3f} {self_total:>10.3f} {1000 * total / count:>10.2f} '
+                         f'{self_total / wall:>7.1%}')
+        lines.append(f'wall time {wall:.3f}s, cluster time {seconds[CLUSTER]:.3f}s ({seconds[CLUSTER] / wall:.1%}), '
+                     f'driver overhead {seconds[DRIVER]:.3f}s ({seconds[DRIVER] / wall:.1%})')
+        return '\n'.join(lines)
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    """Trace a phase of the driver: with span('execute', query=query_path): ..."""
+    return TRACER.span(name, **attributes)
+
+
+def current_attributes():
+    """:returns: attributes of the innermost span of the calling thread, pass them to spans of the threads it hands work to"""
+    stack = TRACER.stack() if TRACER.enabled else []
+    return dict(stack[-1].attributes) if len(stack) > 0 else {}
+
+
+def traced(name, function):
+    """:returns: the function, every call is traced as a span of the phase (if tracing is enabled)"""
+    if not TRACER.enabled:
+        return function
+
+    def _traced(*args, **kwargs):
+        with TRACER.span(name):
+            return function(*args, **kwargs)
+    return _traced
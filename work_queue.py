@@ -0,0 +1,131 @@
+"""This module distributes the queries of a benchmark over several drivers, e.g. one driver per presto cluster writing into one experience store.
+
+The queries are work items in the storage database. A driver claims one item at a time with a lease and renews the lease by heartbeats
+while it explores the query. If a driver dies, its lease expires and another driver claims the item again, it resumes the exploration from
+the last checkpoint (see OptimizerConfig.checkpoint). A driver that lost its lease stops exploring the item (see check_lease) instead of
+recording its measurements a second time.
+"""
+import os
+import socket
+import threading
+import time
+
+import storage
+from custom_logging import bao_logging
+
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 60
+# a query is marked as failed after this many claims, e.g. if it crashes every driver
+MAX_ATTEMPTS = 3
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+RUNNING = 'running'
+
+# lease of the work item the driver is exploring
+_active_lease = None
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def check_lease():
+    """Stop the exploration of the current work item if another driver claimed it after this driver's lease expired
+    :raises LeaseLost: the lease of the current work item is lost
+    """
+    lease = _active_lease
+    if lease is not None and lease.lost:
+        raise LeaseLost(f'Lost the lease of {lease.query_path}, another driver explores it')
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class Lease:
+    """Renew the lease of a claimed work item in a background thread until the item is finished"""
+
+    def __init__(self, item_id, query_path, attempt, worker, lease_seconds=LEASE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS,
+                 max_attempts=MAX_ATTEMPTS):
+        self.item_id = item_id
+        self.query_path = query_path
+        self.attempt = attempt
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_attempts = max_attempts
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._heartbeat, name=f'lease-{item_id}', daemon=True)
+
+    def _heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_seconds):
+            try:
+                if not storage.renew_lease(self.item_id, self.worker, self.lease_seconds):
+                    # the driver stops exploring the item at the next check_lease
+                    bao_logging.warning('Lost the lease of %s, another driver claimed it', self.query_path)
+                    self.lost = True
+                    return
+            except Exception as e:  # pylint: disable=broad-except
+                # the next heartbeat retries, the lease only expires if the database is unreachable for lease_seconds
+                bao_logging.warning('Could not renew the lease of %s: %s', self.query_path, e)
+
+    def __enter__(self):
+        global _active_lease
+        _active_lease = self
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_lease
+        _active_lease = None
+        self.stopped.set()
+        self.thread.join()
+        if self.lost:
+            # the item belongs to the driver that claimed it
+            return False
+        if exc_type is None:
+            status = DONE
+        else:
+            # hand the item over to the next driver (e.g. the driver was interrupted or its presto cluster failed)
+            status = FAILED if self.attempt >= self.max_attempts else PENDING
+        storage.finish_work(self.item_id, self.worker, status)
+        return False
+
+
+def run_worker(run_query, query_paths, mode, worker=None, lease_seconds=LEASE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS,
+               max_attempts=MAX_ATTEMPTS, poll_seconds=None):
+    """Enqueue the queries (every driver of the benchmark may do so) and run queries claimed from the queue until it is drained
+    :param run_query: called with the path of every claimed query, it calls check_lease before recording measurements
+    :param mode: name of the queue, e.g. record_time or query_span
+    :param poll_seconds: while other drivers run the remaining items, poll this often for items whose lease expired (default: lease_seconds)
+    :returns: number of queries run by this driver
+    """
+    worker = worker or worker_name()
+    poll_seconds = lease_seconds if poll_seconds is None else poll_seconds
+    storage.enqueue_work(query_paths, mode)
+    num_queries = 0
+    while True:
+        item = storage.claim_work(worker, mode, lease_seconds, max_attempts)
+        if item is None:
+            # the items of other drivers are claimed again if these drivers die, the queue is drained once no item is running
+            running = storage.work_queue_status(mode).get(RUNNING, 0)
+            if running == 0:
+                break
+            bao_logging.info('%s items of %s are running on other drivers, wait for them', running, mode)
+            time.sleep(poll_seconds)
+            continue
+        item_id, query_path, attempt = item
+        bao_logging.info('%s claimed %s (attempt %s)', worker, query_path, attempt)
+        try:
+            with Lease(item_id, query_path, attempt, worker, lease_seconds, heartbeat_seconds, max_attempts):
+                run_query(query_path)
+            num_queries += 1
+        except LeaseLost as e:
+            bao_logging.warning('Stopped running %s: %s', query_path, e)
+        except Exception as e:  # pylint: disable=broad-except
+            bao_logging.error('Failed to run %s: %s', query_path, e)
+    bao_logging.info('Work queue %s drained, status: %s', mode, storage.work_queue_status(mode))
+    return num_queries